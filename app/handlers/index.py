@@ -4,6 +4,8 @@ from aiogram.types import Message
 
 from app.handlers.sc_download.commands import process_sc_track_url
 from app.handlers.yt_download.commands import process_yt_track_url
+from app.utils.helpers.batch import process_links
+from app.utils.helpers.links import Link, find_links
 
 router = Router()
 
@@ -18,19 +20,31 @@ async def command_start_handler(message: Message):
     )
 
 
+async def process_link(message: Message, link: Link, quiet: bool = False) -> str:
+    if link.source == "soundcloud":
+        return await process_sc_track_url(message=message, link=link, quiet=quiet)
+    return await process_yt_track_url(message=message, link=link, quiet=quiet)
+
+
 @router.message()
 async def any_message(message: Message):
     """Handler for any messages"""
-    if not message.text:
+    text = message.text or message.caption
+    if not text:
         await message.answer(
             f"I see that! 👀 But I'm only built to handle links. Send me a {html.bold('YouTube video')} or {html.bold('SoundCloud track')} link, please!"
         )
         return
 
-    if "soundcloud.com" in message.text:
-        await process_sc_track_url(message=message)
-    elif "youtube.com" in message.text or "youtu.be" in message.text:
-        await process_yt_track_url(message=message)
+    links = find_links(text, message.entities or message.caption_entities)
+    if len(links) == 1:
+        await process_link(message=message, link=links[0])
+    elif links:
+        await process_links(
+            message=message,
+            links=links,
+            process=lambda link: process_link(message=message, link=link, quiet=True),
+        )
     else:
         await message.answer(
             f"I can't process that text. 🤔 Please send me a direct link to a {html.bold('YouTube video')} or a {html.bold('SoundCloud track')}."
@@ -1,76 +1,198 @@
-from aiogram.types import Message, BufferedInputFile
+import time
 
-from app.utils.api.api_integrations import get_sc_file
+from aiogram.types import Message
+
+from app.utils.api.api_integrations import get_sc_file, pick_lane
 from app.utils.api.soundcloud import (
-    get_track_info,
-    get_stream_url,
+    get_download_url,
+    get_playlist_tracks,
     resolve_soundcloud_url,
+    resolve_url,
+)
+from app.utils.database.models import File
+from app.utils.database.requests import (
+    get_file_by_track_id,
+    get_track_link,
+    save_track_links,
+)
+from app.utils.helpers.files import remove_file
+from app.utils.helpers.links import Link, canonical_link
+from app.utils.helpers.metrics import cache_lookups, record_request, stage_timer
+from app.utils.helpers.playlist import PLAYLIST_MAX_TRACKS, PlaylistItem, send_playlist
+from app.utils.helpers.scheduler import QueueFullError, UserLimitError
+from app.utils.helpers.telegram import (
+    answer_scheduler_error,
+    answer_status,
+    get_user_id,
+    queue_position_reporter,
+    reply_with_audio_file,
+    reply_with_cached_audio,
+    remember_telegram_file,
 )
-from app.utils.database.requests import get_client_id_cached
-from app.utils.helpers.track_metadata import get_cover
 from logging_config import get_app_logger
 
 logger = get_app_logger(name=__name__)
 
+SOURCE = "soundcloud"
 
-async def process_sc_track_url(message: Message):
-    if not message.text:
-        await message.answer("Link must be a string!")
-        return
-    try:
-        track_url_input = message.text
-        loading_state_message = await message.answer("Checking your link...")
 
-        track_url = await resolve_soundcloud_url(short_url=track_url_input)
+def _get_filename(track_info: dict) -> str:
+    # check if file name is safe for file system
+    title_safe = "".join(c for c in track_info["title"] if c.isalnum() or c in " _-")
+    return f"{title_safe}.mp3"
 
-        client_id = await get_client_id_cached()
-        track_info = await get_track_info(client_id=client_id, track_url=track_url)
-        await loading_state_message.edit_text("Downloading audio...")
 
-        # check if file name is safe for file system
-        title_safe = "".join(
-            c for c in track_info["title"] if c.isalnum() or c in " _-"
+async def _fetch_playlist_track(track_info: dict) -> tuple[str, File]:
+    url = await get_download_url(track=track_info)
+    lane = await pick_lane(source="soundcloud", track_id=track_info["id"])
+    # playlist window already limits how many tracks of one user are in progress
+    async with lane.slot():
+        return await get_sc_file(
+            track_id=track_info["id"],
+            url=url,
+            filename=_get_filename(track_info),
+            track_info=track_info,
         )
-        filename = f"{title_safe}.mp3"
 
-        if track_info.get("downloadable") and "download_url" in track_info:
-            download_url = f"{track_info['download_url']}?client_id={client_id}"
-            file_bytes = await get_sc_file(
-                track_id=track_info["id"],
-                url=download_url,
-                filename=filename,
-                track_info=track_info,
+
+async def process_sc_playlist(
+    message: Message, playlist: dict, loading_state_message: Message, quiet: bool
+) -> str:
+    """Returns handler result: playlist if any track was sent, playlist_<outcome> otherwise"""
+    tracks = await get_playlist_tracks(
+        playlist=playlist, max_tracks=PLAYLIST_MAX_TRACKS
+    )
+    if not tracks:
+        await loading_state_message.edit_text(
+            "This playlist has no available tracks :("
+        )
+        return "playlist_empty"
+    outcome = await send_playlist(
+        message=message,
+        status_message=loading_state_message,
+        source="soundcloud",
+        title=playlist.get("title") or "Playlist",
+        items=[PlaylistItem(track=track, track_id=track["id"]) for track in tracks],
+        fetch=_fetch_playlist_track,
+        quiet=quiet,
+    )
+    return "playlist" if outcome == "sent" else f"playlist_{outcome}"
+
+
+async def _get_known_track_id(link: Link) -> str | None:
+    """Track id of a link resolved before, without any request to SoundCloud"""
+    track_link = await get_track_link(link.url)
+    cache_lookups.inc(tier="link", result="miss" if track_link is None else "hit")
+    return track_link.track_id if track_link else None
+
+
+async def _save_links(link: Link, track_info: dict) -> None:
+    """Both the link user sent and the track permalink lead to the track next time"""
+    urls = [link.url]
+    permalink = canonical_link(track_info.get("permalink_url") or "")
+    if permalink is not None:
+        urls.append(permalink.url)
+    await save_track_links(urls=urls, source=SOURCE, track_id=track_info["id"])
+
+
+async def process_sc_track_url(
+    message: Message, link: Link, quiet: bool = False
+) -> str:
+    """
+    Send the track or playlist behind the link, returns result for metrics.
+    quiet link is a part of a batch: no status message and no error replies
+    """
+    started = time.perf_counter()
+    result = "error"
+    file_path = None
+    try:
+        # known link with a file in Telegram is answered without resolving it
+        known_track_id = None
+        if link.kind == "track":
+            known_track_id = await _get_known_track_id(link)
+        if known_track_id is not None:
+            cached_file = await get_file_by_track_id(
+                source=SOURCE, track_id=known_track_id
             )
-        else:
-            stream_url = await get_stream_url(track=track_info, client_id=client_id)
-            if stream_url:
-                file_bytes = await get_sc_file(
-                    track_id=track_info["id"],
-                    url=stream_url,
-                    filename=filename,
-                    track_info=track_info,
-                )
-            else:
+            if await reply_with_cached_audio(message=message, cached_file=cached_file):
+                result = "cached"
+                return result
+
+        loading_state_message = await answer_status(
+            message, "Checking your link...", quiet=quiet
+        )
+
+        with stage_timer("resolve", SOURCE):
+            track_url = await resolve_soundcloud_url(short_url=link.url)
+            track_info = await resolve_url(track_url)
+        if track_info.get("kind") == "playlist":
+            result = await process_sc_playlist(
+                message=message,
+                playlist=track_info,
+                loading_state_message=loading_state_message,
+                quiet=quiet,
+            )
+            return result
+        if track_info.get("kind") != "track":
+            raise ValueError("Provided URL does not resolve to a track")
+
+        if known_track_id != str(track_info["id"]):
+            await _save_links(link=link, track_info=track_info)
+            cached_file = await get_file_by_track_id(
+                source="soundcloud", track_id=track_info["id"]
+            )
+            if await reply_with_cached_audio(message=message, cached_file=cached_file):
+                result = "cached"
+                await loading_state_message.delete()
+                return result
+
+        with stage_timer("stream_url", SOURCE):
+            url = await get_download_url(track=track_info)
+        if not url:
+            result = "no_stream"
+            if not quiet:
                 await message.answer(
                     "Could not find a downloadable link for this track :("
                 )
-                await loading_state_message.delete()
-                return
+            await loading_state_message.delete()
+            return result
 
-        thumb = None
-        apic = get_cover(audio_bytes=file_bytes)
-        if apic:
-            thumb = BufferedInputFile(apic, filename="cover.jpg")
+        lane = await pick_lane(source="soundcloud", track_id=track_info["id"])
+        async with lane.slot(
+            user_id=get_user_id(message),
+            on_queued=queue_position_reporter(loading_state_message),
+        ):
+            await loading_state_message.edit_text("Downloading audio...")
+            file_path, record = await get_sc_file(
+                track_id=track_info["id"],
+                url=url,
+                filename=_get_filename(track_info),
+                track_info=track_info,
+            )
 
         await loading_state_message.edit_text("Done, sending your file ;)")
 
-        await message.reply_audio(
-            audio=BufferedInputFile(file=file_bytes, filename=filename), thumb=thumb
+        sent_message = await reply_with_audio_file(
+            message=message, path=file_path, record=record
         )
+        await remember_telegram_file(
+            source="soundcloud", track_id=track_info["id"], sent_message=sent_message
+        )
+        result = "sent"
         await loading_state_message.delete()
 
+    except (QueueFullError, UserLimitError) as e:
+        result = "rejected"
+        if not quiet:
+            await answer_scheduler_error(message=message, error=e)
+        await loading_state_message.delete()
     except Exception as e:
         logger.error("Error while downloading track: %s", e)
-        await message.answer(
-            f"Oops, failed to download track. Maybe the link is incorrect or the track does not have available audio. Try again or if the error persists another URL."
-        )
+        if not quiet:
+            await message.answer(
+                f"Oops, failed to download track. Maybe the link is incorrect or the track does not have available audio. Try again or if the error persists another URL."
+            )
+    finally:
+        remove_file(file_path)
+        record_request(SOURCE, result, started)
+    return result
@@ -1,39 +1,136 @@
-from aiogram.types import Message, BufferedInputFile
+import time
+
+from aiogram.types import Message
 
 from logging_config import get_app_logger
-from app.utils.api.api_integrations import get_yt_file
-from app.utils.helpers.track_metadata import get_cover
+from app.utils.api.api_integrations import get_yt_file, get_yt_metadata, pick_lane
+from app.utils.api.youtube import EXTRACT_TIMEOUT, extract_playlist
+from app.utils.database.models import File
+from app.utils.database.requests import get_file_by_track_id
+from app.utils.helpers.executors import run_transcode
+from app.utils.helpers.files import remove_file
+from app.utils.helpers.links import Link
+from app.utils.helpers.metrics import record_request
+from app.utils.helpers.playlist import PLAYLIST_MAX_TRACKS, PlaylistItem, send_playlist
+from app.utils.helpers.scheduler import QueueFullError, UserLimitError
+from app.utils.helpers.telegram import (
+    answer_scheduler_error,
+    answer_status,
+    get_user_id,
+    queue_position_reporter,
+    reply_with_audio_file,
+    reply_with_cached_audio,
+    remember_telegram_file,
+)
 
 logger = get_app_logger()
 
+SOURCE = "youtube"
+
+
+async def _fetch_playlist_track(entry: dict) -> tuple[str, File]:
+    lane = await pick_lane(source="youtube", track_id=entry["id"])
+    # playlist window already limits how many tracks of one user are in progress
+    async with lane.slot():
+        return await get_yt_file(url=entry["url"])
+
+
+async def process_yt_playlist(
+    message: Message, url: str, loading_state_message: Message, quiet: bool
+) -> str:
+    """Returns handler result: playlist if any video was sent, playlist_<outcome> otherwise"""
+    playlist = await run_transcode(
+        extract_playlist,
+        url=url,
+        max_entries=PLAYLIST_MAX_TRACKS,
+        timeout=EXTRACT_TIMEOUT,
+    )
+    if not playlist["entries"]:
+        await loading_state_message.edit_text(
+            "This playlist has no available videos :("
+        )
+        return "playlist_empty"
+    outcome = await send_playlist(
+        message=message,
+        status_message=loading_state_message,
+        source="youtube",
+        title=playlist["title"] or "Playlist",
+        items=[
+            PlaylistItem(track=entry, track_id=entry["id"])
+            for entry in playlist["entries"]
+        ],
+        fetch=_fetch_playlist_track,
+        quiet=quiet,
+    )
+    return "playlist" if outcome == "sent" else f"playlist_{outcome}"
 
-async def process_yt_track_url(message: Message):
-    if not message.text:
-        await message.answer("Link must be a string!")
-        return
+
+async def process_yt_track_url(
+    message: Message, link: Link, quiet: bool = False
+) -> str:
+    """
+    Send the video or playlist behind the link, returns result for metrics.
+    quiet link is a part of a batch: no status message and no error replies
+    """
+    started = time.perf_counter()
+    result = "error"
+    file_path = None
     try:
-        track_url_input = message.text
+        if link.kind == "playlist":
+            loading_state_message = await answer_status(
+                message, "Checking your link...", quiet=quiet
+            )
+            result = await process_yt_playlist(
+                message=message,
+                url=link.url,
+                loading_state_message=loading_state_message,
+                quiet=quiet,
+            )
+            return result
 
-        loading_state_message = await message.answer("Checking your link...")
+        # video id comes from the link itself, cache is checked before any extraction
+        cached_file = await get_file_by_track_id(
+            source="youtube", track_id=link.track_id
+        )
+        if await reply_with_cached_audio(message=message, cached_file=cached_file):
+            result = "cached"
+            return result
 
-        await loading_state_message.edit_text("Downloading audio...")
-        file_bytes, meta = await get_yt_file(url=track_url_input)
+        loading_state_message = await answer_status(
+            message, "Checking your link...", quiet=quiet
+        )
+        meta = await get_yt_metadata(url=link.url)
 
-        thumb = None
-        apic = get_cover(audio_bytes=file_bytes)
-        if apic:
-            thumb = BufferedInputFile(apic, filename="cover.jpg")
+        lane = await pick_lane(source="youtube", track_id=meta.get("id", ""))
+        async with lane.slot(
+            user_id=get_user_id(message),
+            on_queued=queue_position_reporter(loading_state_message),
+        ):
+            await loading_state_message.edit_text("Downloading audio...")
+            file_path, record = await get_yt_file(url=link.url, meta=meta)
 
         await loading_state_message.edit_text("Done! Sending your file...")
-        await message.reply_audio(
-            audio=BufferedInputFile(file=file_bytes, filename=meta.get("filename", "")),
-            duration=meta.get("duration", 0),
-            thumb=thumb,
+        sent_message = await reply_with_audio_file(
+            message=message, path=file_path, record=record
         )
-        loading_state_message.delete()
+        await remember_telegram_file(
+            source="youtube", track_id=meta["id"], sent_message=sent_message
+        )
+        result = "sent"
+        await loading_state_message.delete()
 
+    except (QueueFullError, UserLimitError) as e:
+        result = "rejected"
+        if not quiet:
+            await answer_scheduler_error(message=message, error=e)
+        await loading_state_message.delete()
     except Exception as e:
         logger.error("Error while downloading track: %s", e)
-        await message.answer(
-            f"Oops, failed to download track. Maybe the link is incorrect or the track does not have available audio. Try again or if the error persists another URL."
-        )
+        if not quiet:
+            await message.answer(
+                f"Oops, failed to download track. Maybe the link is incorrect or the track does not have available audio. Try again or if the error persists another URL."
+            )
+    finally:
+        remove_file(file_path)
+        record_request(SOURCE, result, started)
+    return result
@@ -1,79 +1,312 @@
+import asyncio
+import os
+from datetime import timedelta
 from os import getenv
 
-from app.utils.database.requests import get_file_by_track_id, set_file_by_track_id
-from app.utils.api.soundcloud import download_file
-from app.utils.api.youtube import download_yt_audio, get_video_metadata
-from app.utils.api.google_drive import download_file_from_drive, upload_file_to_drive
-from app.utils.helpers.track_metadata import add_metadata
+from cachetools import TTLCache
+from googleapiclient.errors import HttpError
+
+from app.utils.database.models import File
+from app.utils.database.requests import (
+    clear_drive_file_id,
+    get_file_by_track_id,
+    get_youtube_metadata,
+    set_file_by_track_id,
+    set_file_details,
+    set_youtube_metadata,
+)
+from app.utils.api.soundcloud import (
+    convert_to_mp3,
+    download_file,
+    needs_mp3_conversion,
+)
+from app.utils.api.youtube import (
+    EXTRACT_TIMEOUT,
+    build_metadata,
+    download_yt_audio,
+    extract_video_info,
+    parse_video_id,
+)
+from app.utils.api.artwork import fetch_artwork, make_thumbnail
+from app.utils.api.drive_outbox import enqueue_drive_upload, get_outbox_file
+from app.utils.api.google_drive import download_file_from_drive
+from app.utils.helpers.access_stats import record_cache_hit
+from app.utils.helpers.executors import run_cpu, run_io, run_transcode
+from app.utils.helpers.files import (
+    link_or_copy,
+    new_temp_dir,
+    new_temp_path,
+    remove_file,
+)
+from app.utils.helpers.metrics import bytes_total, cache_lookups, stage_timer
+from app.utils.helpers.scheduler import DownloadScheduler, cache_lane, download_lane
+from app.utils.helpers.single_flight import track_key, track_requests
+from app.utils.helpers.track_cache import (
+    checkout_track,
+    has_local_track,
+    is_local_track,
+    record_drive_lookup,
+    store_track,
+)
+from app.utils.helpers.track_metadata import (
+    add_metadata,
+    get_artwork_url,
+    get_audio_details,
+)
 from logging_config import get_app_logger
 
 logger = get_app_logger(name=__name__)
 
+YT_METADATA_TTL = int(getenv("YT_METADATA_TTL", str(24 * 60 * 60)))
+yt_metadata_cache: TTLCache = TTLCache(maxsize=10_000, ttl=YT_METADATA_TTL)
+# full info of recent extractions, download reuses it instead of extracting again.
+# Stream urls inside expire, so it is kept only for a short time
+yt_info_cache: TTLCache = TTLCache(maxsize=100, ttl=10 * 60)
+
+
+async def pick_lane(source: str, track_id: str) -> DownloadScheduler:
+    """Cache hits and requests joining an in-flight download go to the fast lane"""
+    key = track_key(source, track_id)
+    if key in track_requests or await is_local_track(key):
+        return cache_lane
+    cached_file = await get_file_by_track_id(source=source, track_id=track_id)
+    if cached_file and cached_file.drive_file_id:
+        return cache_lane
+    return download_lane
+
+
+async def _fetch_cached_file(source: str, track_id: str) -> bool:
+    """Check faster tiers first: disk, then Drive. Populate disk cache on Drive hit"""
+    key = track_key(source, track_id)
+    if await has_local_track(key):
+        logger.info(f"Serve file for {track_id} id from local cache")
+        record_cache_hit(source=source, track_id=track_id)
+        return True
+
+    cached_file = await get_file_by_track_id(source=source, track_id=track_id)
+    has_drive_copy = cached_file is not None and bool(cached_file.drive_file_id)
+    record_drive_lookup(hit=has_drive_copy)
+
+    path = new_temp_path()
+    try:
+        if has_drive_copy:
+            logger.info(f"Download file for {track_id} id from drive")
+            try:
+                with stage_timer("drive_download", source):
+                    await download_file_from_drive(cached_file.drive_file_id, path=path)
+            except Exception as e:
+                # e.g. deleted from drive by hand, the origin still has it
+                logger.error(
+                    "Failed to download %s from drive, fall back to origin: %s",
+                    track_id,
+                    e,
+                )
+                if isinstance(e, HttpError) and e.resp.status == 404:
+                    # download from origin uploads a new copy, later misses use it
+                    await clear_drive_file_id(source=source, track_id=track_id)
+                return False
+            bytes_total.inc(
+                os.path.getsize(path), source=source, direction="drive_download"
+            )
+        else:
+            # evicted from disk cache, but still waiting for upload to drive
+            outbox_path = await get_outbox_file(source=source, track_id=track_id)
+            cache_lookups.inc(
+                tier="outbox", result="miss" if outbox_path is None else "hit"
+            )
+            if outbox_path is None:
+                return False
+            logger.info(f"Serve file for {track_id} id from drive outbox")
+            await run_io(link_or_copy, outbox_path, path)
+        await store_track(key, path)
+    finally:
+        remove_file(path)
+    record_cache_hit(source=source, track_id=track_id)
+    return True
+
+
+async def _describe_file(path: str, thumb: bytes | None = None) -> dict:
+    """Duration, bitrate, size, tags and thumbnail of tagged file, stored with File row"""
+    try:
+        details = await run_io(get_audio_details, path)
+    except Exception as e:
+        logger.error("Failed to read audio details of %s: %s", path, e)
+        return {}
+    cover = details.pop("cover")
+    if thumb is None and cover:
+        thumb = await run_io(make_thumbnail, cover)
+    details["thumb"] = thumb
+    return details
+
+
+async def _get_file_record(source: str, track_id: str, path: str) -> File:
+    """File row for sending. Rows saved before details were stored are filled once here"""
+    record = await get_file_by_track_id(source=source, track_id=track_id)
+    if record is not None and record.duration is None:
+        details = await _describe_file(path)
+        await set_file_details(source=source, track_id=track_id, **details)
+        for column, value in details.items():
+            setattr(record, column, value)
+    return record
+
+
+async def _save_file(
+    source: str, track_id: str, path: str, filename: str, thumb: bytes | None = None
+) -> None:
+    """
+    Save tagged file in db and move it into the disk cache.
+    Upload to Drive is not on the user's critical path, it goes through the outbox
+    """
+    logger.info(f"Save file for {track_id} id in db")
+    with stage_timer("save", source):
+        details = await _describe_file(path, thumb=thumb)
+        await set_file_by_track_id(
+            source=source, filename=filename, track_id=track_id, **details
+        )
+        await enqueue_drive_upload(
+            source=source, track_id=track_id, path=path, filename=filename
+        )
+        await store_track(track_key(source, track_id), path)
+
+
+async def _fetch_artwork(
+    source: str, url: str | None
+) -> tuple[bytes | None, bytes | None]:
+    with stage_timer("artwork", source):
+        return await fetch_artwork(url)
+
 
 async def get_sc_file(
     track_id: str, url: str, filename: str, track_info: dict
-) -> bytes:
-    cached_file = await get_file_by_track_id(track_id=track_id)
-    if cached_file:
-        logger.info(f"Download file for {track_id} id from drive")
-        return await download_file_from_drive(cached_file.drive_file_id)
-
-    fh = await download_file(url=url)
-
-    audio_file = add_metadata(
-        audio_file=fh,
-        track_info=track_info,
-    )
-    if audio_file is None:
-        audio_file = fh
-
-    FOLDER_ID = getenv("FOLDER_ID")
-    if FOLDER_ID is None:
-        raise ValueError("FOLDER_ID env variable is not set")
-
-    uploaded_file_metadata = await upload_file_to_drive(
-        file=audio_file, filename=filename, folder_id=FOLDER_ID
-    )
-    logger.info(f"Save file for {track_id} id in db")
-    await set_file_by_track_id(
-        filename=filename, track_id=track_id, drive_file_id=uploaded_file_metadata["id"]
-    )
-    # upload file to drive reads audio_file, so after this func call audio_file.read() is empty. Manually set pointer to the start.
-    audio_file.seek(0)
+) -> tuple[str, File]:
+    """Return path to tagged track file and its db record. Caller owns the file and must remove it"""
+    key = track_key("soundcloud", track_id)
+    with stage_timer("get_file", "soundcloud"):
+        # concurrent requests for the same track share one download/upload,
+        # result is kept in the disk cache and every caller gets its own link to it
+        joined = key in track_requests
+        await track_requests.do(
+            key,
+            lambda: _fetch_sc_file(
+                track_id=track_id, url=url, filename=filename, track_info=track_info
+            ),
+        )
+        if joined:
+            # the flight records its own hit once, callers who joined it are hits too
+            record_cache_hit(source="soundcloud", track_id=track_id)
+        path = await checkout_track(key)
+        return path, await _get_file_record("soundcloud", track_id=track_id, path=path)
+
+
+async def _fetch_sc_file(
+    track_id: str, url: str, filename: str, track_info: dict
+) -> None:
+    if await _fetch_cached_file(source="soundcloud", track_id=track_id):
+        return
 
-    return audio_file.read()
+    path = new_temp_path()
+    try:
+        # artwork is fetched while audio is downloading, not after it
+        artwork = asyncio.create_task(
+            _fetch_artwork("soundcloud", get_artwork_url(track_info))
+        )
+        with stage_timer("origin_download", "soundcloud"):
+            await download_file(url=url, path=path)
+        bytes_total.inc(
+            os.path.getsize(path), source="soundcloud", direction="origin_download"
+        )
+        if needs_mp3_conversion(track_info):
+            with stage_timer("transcode", "soundcloud"):
+                await run_transcode(convert_to_mp3, path=path)
+        cover, thumb = await artwork
+        with stage_timer("tagging", "soundcloud"):
+            await run_cpu(
+                add_metadata, audio_path=path, track_info=track_info, cover_bytes=cover
+            )
+        await _save_file(
+            source="soundcloud",
+            track_id=track_id,
+            path=path,
+            filename=filename,
+            thumb=thumb,
+        )
+    finally:
+        remove_file(path)
 
 
-async def get_yt_file(url: str):
-    meta = get_video_metadata(url=url)
+async def get_yt_metadata(url: str) -> dict:
+    """Return video metadata, from memory or db cache when video id can be read from url"""
+    video_id = parse_video_id(url)
+    if video_id:
+        meta = yt_metadata_cache.get(video_id)
+        if meta is None:
+            meta = await get_youtube_metadata(
+                video_id=video_id, max_age=timedelta(seconds=YT_METADATA_TTL)
+            )
+            if meta is not None:
+                yt_metadata_cache[video_id] = meta
+        if meta is not None:
+            logger.info(f"Receive metadata for {video_id} from cache")
+            cache_lookups.inc(tier="yt_metadata", result="hit")
+            return meta
+
+    cache_lookups.inc(tier="yt_metadata", result="miss")
+    with stage_timer("metadata", "youtube"):
+        info = await run_transcode(extract_video_info, url=url, timeout=EXTRACT_TIMEOUT)
+    meta = build_metadata(info)
+    yt_info_cache[meta["id"]] = info
+    yt_metadata_cache[meta["id"]] = meta
+    await set_youtube_metadata(video_id=meta["id"], data=meta)
+    return meta
+
+
+async def get_yt_file(url: str, meta: dict | None = None) -> tuple[str, File]:
+    """Return path to tagged track file and its db record. Caller owns the file and must remove it"""
+    if meta is None:
+        meta = await get_yt_metadata(url=url)
     video_id = meta.get("id", "")
-    cached_file = await get_file_by_track_id(track_id=video_id)
-
-    if cached_file:
-        logger.info(f"Download file for {video_id} id from drive")
-        return await download_file_from_drive(cached_file.drive_file_id), meta
-
-    fh, meta = download_yt_audio(url=url)
-    audio_file = add_metadata(audio_file=fh, track_info=meta)
-    if audio_file is None:
-        audio_file = fh
-
-    FOLDER_ID = getenv("FOLDER_ID")
-    if FOLDER_ID is None:
-        raise ValueError("FOLDER_ID env variable is not set")
-
-    uploaded_file_metadata = await upload_file_to_drive(
-        file=audio_file,
-        filename=meta.get("title", ""),
-        folder_id=FOLDER_ID,
-    )
-    logger.info(f"Save file for {video_id} id in db")
-    await set_file_by_track_id(
-        filename=meta.get("title", ""),
-        track_id=video_id,
-        drive_file_id=uploaded_file_metadata["id"],
-    )
-    # upload file to drive reads audio_file, so after this func call audio_file.read() is empty. Manually set pointer to the start.
-    audio_file.seek(0)
-
-    return audio_file.read(), meta
+    key = track_key("youtube", video_id)
+    with stage_timer("get_file", "youtube"):
+        joined = key in track_requests
+        await track_requests.do(
+            key,
+            lambda: _fetch_yt_file(url=url, video_id=video_id, meta=meta),
+        )
+        if joined:
+            record_cache_hit(source="youtube", track_id=video_id)
+        path = await checkout_track(key)
+        return path, await _get_file_record("youtube", track_id=video_id, path=path)
+
+
+async def _fetch_yt_file(url: str, video_id: str, meta: dict) -> None:
+    if await _fetch_cached_file(source="youtube", track_id=video_id):
+        return
+
+    path = new_temp_path()
+    try:
+        artwork = asyncio.create_task(_fetch_artwork("youtube", get_artwork_url(meta)))
+        with stage_timer("origin_download", "youtube"), new_temp_dir() as work_dir:
+            meta = await run_transcode(
+                download_yt_audio,
+                url=url,
+                output_path=path,
+                work_dir=work_dir,
+                info=yt_info_cache.pop(video_id, None),
+            )
+        bytes_total.inc(
+            os.path.getsize(path), source="youtube", direction="origin_download"
+        )
+        cover, thumb = await artwork
+        with stage_timer("tagging", "youtube"):
+            await run_cpu(
+                add_metadata, audio_path=path, track_info=meta, cover_bytes=cover
+            )
+        await _save_file(
+            source="youtube",
+            track_id=video_id,
+            path=path,
+            filename=f"{meta.get('title', '')}.mp3",
+            thumb=thumb,
+        )
+    finally:
+        remove_file(path)
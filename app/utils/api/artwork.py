@@ -0,0 +1,73 @@
+import os
+from io import BytesIO
+
+from app.utils.api.http_client import get_http_session
+from app.utils.helpers.executors import run_io
+from app.utils.helpers.lru import ByteLRU
+from app.utils.helpers.single_flight import SingleFlight
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow a small enough cover is used as thumbnail
+    Image = None
+    logger.warning("Pillow is not installed, thumbnails won't be downscaled")
+
+ARTWORK_CACHE_MAX_BYTES = int(os.getenv("ARTWORK_CACHE_MAX_BYTES", str(32 * 1024**2)))
+# telegram thumbnail limits: jpeg, up to 320px side and 200 kB
+THUMB_SIZE = 320
+THUMB_MAX_BYTES = 200 * 1024
+
+# covers are often shared by all tracks of an artist/album
+cover_cache = ByteLRU(max_bytes=ARTWORK_CACHE_MAX_BYTES)
+thumb_cache = ByteLRU(max_bytes=ARTWORK_CACHE_MAX_BYTES // 4)
+artwork_requests = SingleFlight()
+
+
+def make_thumbnail(cover: bytes) -> bytes | None:
+    """Downscale cover to telegram thumbnail size"""
+    if Image is None:
+        return cover if len(cover) <= THUMB_MAX_BYTES else None
+    try:
+        with Image.open(BytesIO(cover)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            out = BytesIO()
+            image.save(out, format="JPEG", quality=85)
+            return out.getvalue()
+    except Exception as e:
+        logger.error("Failed to make thumbnail: %s", e)
+        return None
+
+
+async def _download_artwork(url: str) -> tuple[bytes | None, bytes | None]:
+    session = get_http_session()
+    async with session.get(url) as resp:
+        if resp.status != 200:
+            raise Exception(f"Failed to download artwork: HTTP {resp.status}")
+        cover = await resp.read()
+
+    # thumbnail is computed once at ingest, every send just reuses the bytes
+    thumb = await run_io(make_thumbnail, cover)
+    cover_cache.put(url, cover)
+    if thumb:
+        thumb_cache.put(url, thumb)
+    return cover, thumb
+
+
+async def fetch_artwork(url: str | None) -> tuple[bytes | None, bytes | None]:
+    """Return (cover, thumbnail) for artwork url. Errors are logged, track is tagged without cover"""
+    if not url:
+        return None, None
+
+    cover = cover_cache.get(url)
+    if cover is not None:
+        return cover, thumb_cache.get(url)
+
+    try:
+        return await artwork_requests.do(url, lambda: _download_artwork(url))
+    except Exception as e:
+        logger.error("Failed to fetch artwork %s: %s", url, e)
+        return None, None
@@ -0,0 +1,125 @@
+import asyncio
+import os
+
+from app.utils.api.google_drive import delete_file_from_drive, get_drive_file_size
+from app.utils.database.requests import (
+    clear_drive_file_id,
+    delete_file,
+    get_drive_files_without_size,
+    get_drive_usage,
+    get_eviction_candidates,
+    set_file_details,
+)
+from app.utils.helpers.access_stats import flush_access_stats
+from app.utils.helpers.single_flight import track_key
+from app.utils.helpers.track_cache import drop_track
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# Drive budget, 0 means no limit. Files over budget are deleted with their db rows
+DRIVE_MAX_BYTES = int(os.getenv("DRIVE_MAX_BYTES", "0"))
+DRIVE_MAX_FILES = int(os.getenv("DRIVE_MAX_FILES", "0"))
+# lru: least recently used go first, lfu: least hits go first
+DRIVE_EVICTION_POLICY = os.getenv("DRIVE_EVICTION_POLICY", "lru")
+DRIVE_EVICTION_INTERVAL = float(os.getenv("DRIVE_EVICTION_INTERVAL", str(60 * 60)))
+EVICTION_BATCH_SIZE = 100
+
+
+async def _forget_file(source: str, track_id: str) -> None:
+    await delete_file(source=source, track_id=track_id)
+    await drop_track(track_key(source, track_id))
+
+
+async def backfill_drive_sizes() -> int:
+    """
+    Ask Drive for the size of files saved without one, otherwise DRIVE_MAX_BYTES
+    doesn't see them. Files Drive answers 404 for lose their drive id. Returns number of updated rows
+    """
+    updated = 0
+    while files := await get_drive_files_without_size(limit=EVICTION_BATCH_SIZE):
+        for file in files:
+            try:
+                size = await get_drive_file_size(file.drive_file_id)
+            except Exception as e:
+                logger.error(
+                    "Failed to get drive size of %s, retry next time: %s",
+                    file.track_id,
+                    e,
+                )
+                return updated
+            if size is None:
+                logger.warning(f"Drive file of {file.track_id} is missing, forget it")
+                await clear_drive_file_id(source=file.source, track_id=file.track_id)
+            else:
+                await set_file_details(
+                    source=file.source, track_id=file.track_id, size=size
+                )
+            updated += 1
+    if updated:
+        logger.info(f"Backfilled size of {updated} drive files")
+    return updated
+
+
+async def evict_drive_files() -> tuple[int, int]:
+    """
+    Delete the least valuable Drive files until usage fits DRIVE_MAX_BYTES and DRIVE_MAX_FILES.
+    Returns number of deleted files and freed bytes
+    """
+    if not DRIVE_MAX_BYTES and not DRIVE_MAX_FILES:
+        return 0, 0
+    if DRIVE_MAX_BYTES:
+        await backfill_drive_sizes()
+    # order by up to date hits and access times
+    await flush_access_stats()
+    files, size = await get_drive_usage()
+
+    def over_budget() -> bool:
+        return bool(
+            (DRIVE_MAX_FILES and files > DRIVE_MAX_FILES)
+            or (DRIVE_MAX_BYTES and size > DRIVE_MAX_BYTES)
+        )
+
+    deleted, freed = 0, 0
+    while over_budget():
+        candidates = await get_eviction_candidates(
+            by_frequency=DRIVE_EVICTION_POLICY == "lfu", limit=EVICTION_BATCH_SIZE
+        )
+        if not candidates:
+            break
+        for candidate in candidates:
+            if not over_budget():
+                break
+            try:
+                # Drive first: a row without its file would only cost a download,
+                # a file without its row would take quota forever
+                await delete_file_from_drive(candidate.drive_file_id)
+            except Exception as e:
+                logger.error(
+                    "Failed to delete %s from drive, retry next time: %s",
+                    candidate.track_id,
+                    e,
+                )
+                return deleted, freed
+            await _forget_file(source=candidate.source, track_id=candidate.track_id)
+            files -= 1
+            size -= candidate.size or 0
+            deleted += 1
+            freed += candidate.size or 0
+
+    if deleted:
+        logger.info(f"Evicted {deleted} files ({freed} bytes) from drive")
+    return deleted, freed
+
+
+async def run_drive_eviction() -> None:
+    """Background task, keeps Drive usage within the budget"""
+    if not DRIVE_MAX_BYTES and not DRIVE_MAX_FILES:
+        logger.info("Drive budget is not set, eviction is disabled")
+        return
+    while True:
+        try:
+            await evict_drive_files()
+        except Exception as e:
+            logger.error("Drive eviction failed: %s", e)
+        await asyncio.sleep(DRIVE_EVICTION_INTERVAL)
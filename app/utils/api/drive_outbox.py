@@ -0,0 +1,132 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+from functools import partial
+
+from app.utils.api.google_drive import upload_file_to_drive
+from app.utils.database.requests import (
+    add_pending_upload,
+    complete_pending_upload,
+    delete_pending_upload,
+    get_due_uploads,
+    get_next_upload_time,
+    get_pending_upload,
+    postpone_pending_upload,
+    set_upload_uri,
+)
+from app.utils.helpers.executors import run_io
+from app.utils.helpers.files import link_or_copy, remove_file
+from app.utils.helpers.metrics import bytes_total, stage_timer
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# files waiting for upload are kept here, not in the disk cache, so eviction can't lose them
+OUTBOX_DIR = os.getenv("DRIVE_OUTBOX_DIR", os.path.join("downloads", "outbox"))
+UPLOAD_RETRY_BASE = float(os.getenv("DRIVE_UPLOAD_RETRY_BASE", "30"))
+UPLOAD_RETRY_MAX = float(os.getenv("DRIVE_UPLOAD_RETRY_MAX", str(60 * 60)))
+UPLOAD_BATCH_SIZE = 10
+# how long uploader sleeps when outbox is empty, enqueue wakes it up earlier
+IDLE_INTERVAL = 60
+
+_wakeup = asyncio.Event()
+
+
+def _outbox_path(source: str, track_id: str) -> str:
+    return os.path.join(OUTBOX_DIR, re.sub(r"[^\w.-]", "_", f"{source}_{track_id}.mp3"))
+
+
+async def enqueue_drive_upload(
+    source: str, track_id: str, path: str, filename: str
+) -> None:
+    """Keep a copy of the file in the outbox, background uploader sends it to Drive"""
+    os.makedirs(OUTBOX_DIR, exist_ok=True)
+    outbox_path = _outbox_path(source, str(track_id))
+    # a copy across filesystems would block the event loop
+    await run_io(link_or_copy, path, outbox_path)
+    await add_pending_upload(
+        source=source, track_id=track_id, filename=filename, path=outbox_path
+    )
+    _wakeup.set()
+
+
+async def get_outbox_file(source: str, track_id: str) -> str | None:
+    """Path to a file which is not uploaded to Drive yet"""
+    upload = await get_pending_upload(source=source, track_id=track_id)
+    if upload is None or not os.path.exists(upload.path):
+        return None
+    return upload.path
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(UPLOAD_RETRY_BASE * 2**attempts, UPLOAD_RETRY_MAX)
+
+
+async def _upload(upload, folder_id: str) -> None:
+    if not os.path.exists(upload.path):
+        logger.error(f"Outbox file for {upload.track_id} is missing, skip upload")
+        await delete_pending_upload(upload.id)
+        return
+    try:
+        with stage_timer("drive_upload", upload.source):
+            uploaded_file_metadata = await upload_file_to_drive(
+                path=upload.path,
+                filename=upload.filename,
+                folder_id=folder_id,
+                upload_uri=upload.upload_uri,
+                on_session=partial(set_upload_uri, upload.id),
+            )
+    except Exception as e:
+        delay = _retry_delay(upload.attempts)
+        logger.error(
+            "Failed to upload %s to drive (attempt %s), retry in %ss: %s",
+            upload.track_id,
+            upload.attempts + 1,
+            delay,
+            e,
+        )
+        await postpone_pending_upload(
+            upload.id,
+            next_attempt_at=datetime.now() + timedelta(seconds=delay),
+            error=str(e),
+        )
+        return
+
+    bytes_total.inc(
+        os.path.getsize(upload.path), source=upload.source, direction="drive_upload"
+    )
+    logger.info(f"Save file for {upload.track_id} id in db")
+    await complete_pending_upload(upload.id, drive_file_id=uploaded_file_metadata["id"])
+    remove_file(upload.path)
+
+
+async def run_drive_uploader() -> None:
+    """Background task, drains the upload outbox. Pending uploads survive restarts"""
+    FOLDER_ID = os.getenv("FOLDER_ID")
+    if FOLDER_ID is None:
+        raise ValueError("FOLDER_ID env variable is not set")
+
+    while True:
+        _wakeup.clear()
+        try:
+            uploads = await get_due_uploads(limit=UPLOAD_BATCH_SIZE)
+            for upload in uploads:
+                await _upload(upload, folder_id=FOLDER_ID)
+            if len(uploads) == UPLOAD_BATCH_SIZE:
+                continue
+
+            next_upload_at = await get_next_upload_time()
+        except Exception as e:
+            logger.error("Drive uploader failed: %s", e)
+            next_upload_at = None
+
+        timeout = IDLE_INTERVAL
+        if next_upload_at is not None:
+            timeout = min(
+                IDLE_INTERVAL, max(0, (next_upload_at - datetime.now()).total_seconds())
+            )
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -1,32 +1,205 @@
 import os, base64, json
-from io import BytesIO
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
 
+from app.utils.helpers.executors import run_drive
+from logging_config import get_app_logger
 
-def get_drive_service():
-    # full access to files created by the application
-    SCOPES = ["https://www.googleapis.com/auth/drive.file"]
-    CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS_B64")
-    if CREDENTIALS is None:
-        raise ValueError("Google Drive user is not authorized")
-
-    creds_json = json.loads(base64.b64decode(CREDENTIALS).decode("utf-8"))
-    creds = Credentials.from_authorized_user_info(creds_json, SCOPES)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
+logger = get_app_logger(name=__name__)
+
+
+# full access to files created by the application
+SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+# refresh access token this long before it expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# api root, only set to point the bot at a local Drive stand-in (see benchmarks/)
+DRIVE_API_URL = os.getenv("DRIVE_API_URL")
+# bytes per request of uploads and downloads, uploads need a multiple of 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+DRIVE_CHUNK_SIZE = max(
+    CHUNK_ALIGNMENT,
+    int(os.getenv("DRIVE_CHUNK_SIZE", str(8 * 1024**2)))
+    // CHUNK_ALIGNMENT
+    * CHUNK_ALIGNMENT,
+)
+# failed chunks in a row before a transfer gives up
+DRIVE_CHUNK_RETRIES = 5
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# set on shutdown, running transfers stop at the next chunk instead of holding the process
+_stopping = threading.Event()
+
+
+class TransferStoppedError(Exception):
+    pass
+
+
+def stop_drive_transfers() -> None:
+    """Uploads keep their session uri and are resumed after restart"""
+    _stopping.set()
+
+
+def _check_stopping() -> None:
+    if _stopping.is_set():
+        raise TransferStoppedError("Drive transfer stopped on shutdown")
+
+
+def _build_service(creds: Credentials):
+    if DRIVE_API_URL is None:
+        return build("drive", "v3", credentials=creds, cache_discovery=False)
+    document = json.loads(get_static_doc("drive", "v3"))
+    document["rootUrl"] = DRIVE_API_URL.rstrip("/") + "/"
+    return build_from_document(document, credentials=creds)
+
+
+def _utcnow() -> datetime:
+    # google-auth keeps expiry as naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class DriveClient:
+    """
+    Process-wide Drive credentials shared by all worker threads.
+    httplib2 is not thread-safe, so every thread builds its own service object once.
+    """
+
+    def __init__(self):
+        self._creds: Credentials | None = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.metrics = {"builds": 0, "refreshes": 0}
+
+    def _load_credentials(self) -> Credentials:
+        CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS_B64")
+        if CREDENTIALS is None:
+            raise ValueError("Google Drive user is not authorized")
+
+        creds_json = json.loads(base64.b64decode(CREDENTIALS).decode("utf-8"))
+        return Credentials.from_authorized_user_info(creds_json, SCOPES)
+
+    def _needs_refresh(self, creds: Credentials) -> bool:
+        if not creds.valid:
+            return True
+        return creds.expiry is not None and (
+            creds.expiry - _utcnow() < TOKEN_REFRESH_MARGIN
+        )
+
+    def _refresh(self, creds: Credentials) -> None:
+        if not creds.refresh_token:
             raise Exception("Google Drive refresh token expired.")
+        creds.refresh(Request())
+        self.metrics["refreshes"] += 1
+        logger.info("Google Drive access token refreshed")
+
+    def credentials(self) -> Credentials:
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials()
+            if self._needs_refresh(self._creds):
+                self._refresh(self._creds)
+            return self._creds
+
+    def refresh(self) -> None:
+        """Refresh access token in advance, so requests never wait for it"""
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials()
+            self._refresh(self._creds)
+
+    def seconds_until_refresh(self) -> float | None:
+        creds = self._creds
+        if creds is None or creds.expiry is None:
+            return None
+        left = creds.expiry - _utcnow() - TOKEN_REFRESH_MARGIN
+        return max(0.0, left.total_seconds())
+
+    def service(self):
+        creds = self.credentials()
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = _build_service(creds)
+            self._local.service = service
+            with self._lock:
+                self.metrics["builds"] += 1
+            logger.info(
+                f"Google Drive service built for {threading.current_thread().name}"
+            )
+        return service
+
+
+drive_client = DriveClient()
+
+
+def get_drive_service():
+    return drive_client.service()
 
-    return build("drive", "v3", credentials=creds)
 
+def get_drive_metrics() -> dict:
+    return dict(drive_client.metrics)
 
-async def upload_file_to_drive(file: BytesIO, filename: str, folder_id: str) -> dict:
-    """Upload file to Google Drive"""
+
+async def keep_drive_token_fresh(retry_interval: float = 60) -> None:
+    """Background task, refreshes Drive access token before it expires"""
+    while True:
+        delay = drive_client.seconds_until_refresh()
+        if delay is None:
+            # credentials are not loaded yet, load them on the first iteration
+            delay = 0
+        await asyncio.sleep(delay)
+        try:
+            await run_drive(drive_client.refresh)
+        except Exception as e:
+            logger.error("Failed to refresh Google Drive token: %s", e)
+            await asyncio.sleep(retry_interval)
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status in TRANSIENT_STATUSES
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+def _backoff(failures: int) -> None:
+    time.sleep(min(0.5 * 2 ** (failures - 1), 30))
+
+
+def _resume_upload(request, upload_uri: str, size: int) -> dict | None:
+    """
+    Continue a session of an earlier attempt from the offset Drive has committed.
+    Returns file metadata if the upload had already finished
+    """
+    headers = {"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+    resp, content = request.http.request(upload_uri, "PUT", headers=headers)
+    if resp.status in (200, 201):
+        return request.postproc(resp, content)
+    if resp.status != 308:
+        # session expired, start a new one
+        logger.info(f"Drive upload session is gone (HTTP {resp.status}), restart")
+        return None
+    request.resumable_uri = upload_uri
+    if "range" in resp:
+        request.resumable_progress = int(resp["range"].rsplit("-", 1)[1]) + 1
+    logger.info(f"Resume Drive upload at {request.resumable_progress} of {size}")
+    return None
+
+
+def _upload_file(
+    path: str,
+    filename: str,
+    folder_id: str,
+    upload_uri: str | None = None,
+    on_session: Callable[[str], None] | None = None,
+) -> dict:
     drive_service = get_drive_service()
 
     file_metadata = {
@@ -34,27 +207,157 @@ async def upload_file_to_drive(file: BytesIO, filename: str, folder_id: str) ->
         "parents": [folder_id],
     }
 
-    media = MediaIoBaseUpload(file, mimetype="audio/mpeg", resumable=True)
-
-    uploaded_file = (
-        drive_service.files()
-        .create(body=file_metadata, media_body=media, fields="id, name, webViewLink")
-        .execute()
+    # resumable upload reads the file chunk by chunk
+    media = MediaFileUpload(
+        path, mimetype="audio/mpeg", chunksize=DRIVE_CHUNK_SIZE, resumable=True
     )
+    request = drive_service.files().create(
+        body=file_metadata, media_body=media, fields="id, name, webViewLink"
+    )
+    if upload_uri:
+        uploaded_file = _resume_upload(request, upload_uri, media.size())
+        if uploaded_file is not None:
+            return uploaded_file
+
+    uploaded_file = None
+    failures = 0
+    while uploaded_file is None:
+        try:
+            _check_stopping()
+            _, uploaded_file = request.next_chunk()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            if not _is_transient(e) or failures > DRIVE_CHUNK_RETRIES:
+                raise
+            # next call asks Drive for the committed offset and continues from there
+            logger.warning(f"Drive upload chunk failed, resume: {e!r}")
+            _backoff(failures)
+        finally:
+            # saved even if the upload gives up, the next attempt resumes the session
+            if on_session is not None and request.resumable_uri not in (
+                None,
+                upload_uri,
+            ):
+                upload_uri = request.resumable_uri
+                on_session(upload_uri)
 
     return uploaded_file
 
 
-async def download_file_from_drive(file_id: str) -> bytes:
+def _get_range(request, start: int, end: int) -> tuple[bytes, int]:
+    """One chunk of get_media request, returns its content and the file size"""
+    headers = {**request.headers, "range": f"bytes={start}-{end}"}
+    resp, content = request.http.request(request.uri, "GET", headers=headers)
+    if resp.status == 416 and start == 0:
+        return b"", 0
+    if resp.status not in (200, 206):
+        raise HttpError(resp, content, uri=request.uri)
+    if resp.status == 200:
+        # no range support, whole file at once
+        return content, len(content)
+    return content, int(resp["content-range"].rsplit("/", 1)[1])
+
+
+def _download_file(file_id: str, path: str) -> str:
+    """Chunks are appended to the file as they arrive, a failed chunk is requested again from the same offset"""
     drive_service = get_drive_service()
     request = drive_service.files().get_media(fileId=file_id)
-    fh = BytesIO()
 
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
+    with open(path, "wb") as fh:
+        offset, total, failures = 0, None, 0
+        while total is None or offset < total:
+            _check_stopping()
+            try:
+                content, total = _get_range(
+                    request, offset, offset + DRIVE_CHUNK_SIZE - 1
+                )
+            except Exception as e:
+                failures += 1
+                if not _is_transient(e) or failures > DRIVE_CHUNK_RETRIES:
+                    raise
+                logger.warning(
+                    f"Drive download chunk failed, resume at {offset}: {e!r}"
+                )
+                _backoff(failures)
+                continue
+            failures = 0
+            fh.write(content)
+            offset += len(content)
+            if not content:
+                break
+
+    return path
+
+
+async def upload_file_to_drive(
+    path: str,
+    filename: str,
+    folder_id: str,
+    upload_uri: str | None = None,
+    on_session: Callable[[str], Awaitable[None]] | None = None,
+) -> dict:
+    """
+    Upload file to Google Drive. upload_uri of an earlier attempt resumes it,
+    on_session gets the uri of a new upload session so it can be saved
+    """
+    loop = asyncio.get_running_loop()
+
+    def log_error(future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(
+                "Failed to save Drive upload session: %s", future.exception()
+            )
+
+    def session_started(uri: str) -> None:
+        # called in the worker thread. It must not wait for the loop:
+        # on shutdown the loop itself waits for this thread
+        try:
+            asyncio.run_coroutine_threadsafe(on_session(uri), loop).add_done_callback(
+                log_error
+            )
+        except RuntimeError as e:
+            logger.warning("Failed to save Drive upload session: %s", e)
+
+    return await run_drive(
+        _upload_file,
+        path=path,
+        filename=filename,
+        folder_id=folder_id,
+        upload_uri=upload_uri,
+        on_session=session_started if on_session is not None else None,
+    )
+
+
+def _delete_file(file_id: str) -> None:
+    try:
+        get_drive_service().files().delete(fileId=file_id).execute()
+    except HttpError as e:
+        # already removed by hand, nothing to free
+        if e.resp.status != 404:
+            raise
+        logger.warning(f"Drive file {file_id} is already deleted")
+
+
+async def delete_file_from_drive(file_id: str) -> None:
+    await run_drive(_delete_file, file_id=file_id)
+
+
+def _get_file_size(file_id: str) -> int | None:
+    try:
+        file = get_drive_service().files().get(fileId=file_id, fields="size").execute()
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        return None
+    return int(file["size"])
+
+
+async def get_drive_file_size(file_id: str) -> int | None:
+    """Size of a Drive file in bytes, None if the file doesn't exist"""
+    return await run_drive(_get_file_size, file_id=file_id)
 
-    fh.seek(0)
 
-    return fh.read()
+async def download_file_from_drive(file_id: str, path: str) -> str:
+    """Download file from Google Drive to path"""
+    return await run_drive(_download_file, file_id=file_id, path=path)
@@ -0,0 +1,59 @@
+import os
+import aiohttp
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "600"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# read timeout between chunks, total is not limited because of long mixes
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+_session: aiohttp.ClientSession | None = None
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def init_http_session() -> aiohttp.ClientSession:
+    """Create application-scoped session, must be called inside running loop"""
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+        logger.info("HTTP session created")
+    return _session
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return shared session, so all requests reuse pooled keep-alive connections"""
+    global _session
+    if _session is None or _session.closed:
+        # fallback for scripts which don't call init_http_session
+        _session = create_http_session()
+    return _session
+
+
+async def close_http_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("HTTP session closed")
+    _session = None
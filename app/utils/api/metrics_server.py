@@ -0,0 +1,28 @@
+from aiohttp import web
+
+from app.utils.helpers import metrics
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=metrics.render_metrics(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    """Serve /metrics in Prometheus text format if METRICS_PORT is set"""
+    if not metrics.enabled:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, metrics.METRICS_HOST, int(metrics.METRICS_PORT))
+    await site.start()
+    logger.info(
+        f"Metrics are served on http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics"
+    )
+    return runner
@@ -1,58 +1,363 @@
-import aiohttp
-from io import BytesIO
+import asyncio
+import os
+import subprocess
+from collections import deque
+from dataclasses import dataclass
+from urllib.parse import urljoin, urlparse
+
+from app.utils.api.http_client import get_http_session
+from app.utils.api.soundcloud_client_id import client_ids, get_client_id
+from app.utils.api.youtube import FFMPEG_THREADS
+from app.utils.helpers.files import CHUNK_SIZE, remove_file
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+SOUNDCLOUD_API_URL = os.getenv("SOUNDCLOUD_API_URL", "https://api-v2.soundcloud.com")
+# short links redirect to the track page, full links can be resolved by the api right away
+SHORT_LINK_HOSTS = {"on.soundcloud.com", "snd.sc"}
+# /tracks endpoint accepts up to 50 ids
+TRACKS_BATCH_SIZE = 50
+# HLS segments downloaded at the same time, each one is a few seconds of audio
+HLS_WINDOW = int(os.getenv("HLS_WINDOW", "8"))
+HLS_SEGMENT_RETRIES = 3
+# files from servers with Range support are fetched in parts of this size over parallel connections
+DOWNLOAD_PART_SIZE = int(os.getenv("DOWNLOAD_PART_SIZE", str(4 * 1024**2)))
+DOWNLOAD_PARALLEL = int(os.getenv("DOWNLOAD_PARALLEL", "4"))
+DOWNLOAD_PART_RETRIES = 3
+# transcodings in order of preference. Only mp3 can be tagged and sent as is,
+# hls goes first because its segments are fetched in parallel.
+# Tracks without mp3 streams get AAC or Opus, converted to mp3 after download
+TRANSCODING_PREFERENCE = [
+    ("hls", "audio/mpeg"),
+    ("progressive", "audio/mpeg"),
+    ("hls", "audio/mp4"),
+    ("hls", "audio/ogg"),
+]
 
 
 async def resolve_soundcloud_url(short_url: str) -> str:
     """If user provides short url, resolve full url"""
+    if urlparse(short_url).hostname not in SHORT_LINK_HOSTS:
+        return short_url
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(short_url, allow_redirects=True) as resp:
-                return str(resp.url)
+        session = get_http_session()
+        async with session.get(short_url, allow_redirects=True) as resp:
+            return str(resp.url)
     except Exception as e:
         raise Exception(f"Failed to resolve track url, provided url: {short_url}")
 
 
-async def get_track_info(client_id: str, track_url: str) -> dict:
-    """Receive SoundCloud track info"""
-    api_url = (
-        f"https://api-v2.soundcloud.com/resolve?url={track_url}&client_id={client_id}"
-    )
-    async with aiohttp.ClientSession() as session:
-        async with session.get(api_url) as resp:
+async def _get_api_json(url: str, params: dict | None = None) -> dict | list:
+    """
+    GET SoundCloud api with current client_id.
+    On 401/403 client_id is refreshed immediately and request is retried once
+    """
+    session = get_http_session()
+    client_id = await get_client_id()
+    for attempt in range(2):
+        async with session.get(
+            url, params={**(params or {}), "client_id": client_id}
+        ) as resp:
+            if resp.status in (401, 403) and attempt == 0:
+                logger.warning(f"SoundCloud rejected client_id: HTTP {resp.status}")
+                client_id = await client_ids.refresh(rejected=client_id)
+                continue
             if resp.status != 200:
-                raise Exception(f"Failed to resolve track: HTTP {resp.status}")
-            response = await resp.json()
-            if response.get("kind") != "track":
-                raise ValueError("Provided URL does not resolve to a track")
-            return response
-
-
-async def get_stream_url(track: dict, client_id: str) -> str | None:
-    """Return progressive stream"""
-    for transcoding in track.get("media", {}).get("transcodings", []):
-        if transcoding["format"]["protocol"] == "progressive":
-            url = transcoding["url"] + f"?client_id={client_id}"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    data = await resp.json()
-                    return data.get("url")
-    raise Exception("No progressive stream url found")
-
-
-async def download_file(url: str) -> BytesIO:
-    """Download track with download url or stream url and return file (BytesIO)"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                raise Exception(f"Failed to download file: HTTP {resp.status}")
+                raise Exception(f"SoundCloud api request failed: HTTP {resp.status}")
+            return await resp.json()
+
+
+async def resolve_url(url: str) -> dict:
+    """Resolve SoundCloud page url to api resource: track, playlist, user..."""
+    return await _get_api_json(f"{SOUNDCLOUD_API_URL}/resolve", params={"url": url})
+
+
+async def get_tracks(ids: list) -> list[dict]:
+    """Full info of several tracks in one request"""
+    tracks = await _get_api_json(
+        f"{SOUNDCLOUD_API_URL}/tracks",
+        params={"ids": ",".join(str(track_id) for track_id in ids)},
+    )
+    by_id = {track["id"]: track for track in tracks}
+    return [by_id[track_id] for track_id in ids if track_id in by_id]
+
+
+async def get_playlist_tracks(playlist: dict, max_tracks: int) -> list[dict]:
+    """
+    Tracks of a resolved playlist in playlist order. Only the first few tracks
+    come with full info, the rest are stubs with id and are fetched in batches
+    """
+    tracks = playlist.get("tracks", [])[:max_tracks]
+    stub_ids = [track["id"] for track in tracks if "media" not in track]
+    batches = [
+        stub_ids[i : i + TRACKS_BATCH_SIZE]
+        for i in range(0, len(stub_ids), TRACKS_BATCH_SIZE)
+    ]
+    hydrated = {}
+    for batch in await asyncio.gather(*(get_tracks(ids) for ids in batches)):
+        hydrated.update((track["id"], track) for track in batch)
+    # tracks which are not available anymore are not returned by the api
+    return [
+        track if "media" in track else hydrated[track["id"]]
+        for track in tracks
+        if "media" in track or track["id"] in hydrated
+    ]
+
+
+def _mime_type(transcoding: dict) -> str:
+    # e.g. audio/mp4; codecs="mp4a.40.2"
+    return transcoding["format"]["mime_type"].split(";")[0].strip()
+
+
+def pick_transcoding(track: dict) -> dict | None:
+    """Best full-length transcoding of the track, previews of Go+ tracks are skipped"""
+    candidates = {
+        (t["format"]["protocol"], _mime_type(t)): t
+        for t in track.get("media", {}).get("transcodings", [])
+        if not t.get("snipped")
+    }
+    for kind in TRANSCODING_PREFERENCE:
+        if kind in candidates:
+            return candidates[kind]
+    return None
+
+
+def needs_mp3_conversion(track: dict) -> bool:
+    """Stream get_download_url picks for the track is AAC or Opus, not mp3"""
+    if track.get("downloadable") and "download_url" in track:
+        return False
+    transcoding = pick_transcoding(track)
+    return transcoding is not None and _mime_type(transcoding) != "audio/mpeg"
+
+
+def convert_to_mp3(path: str) -> None:
+    """Re-encode downloaded stream to mp3 in place, run it with run_transcode"""
+    mp3_path = f"{path}.mp3"
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-y",
+                "-i",
+                path,
+                "-vn",
+                "-c:a",
+                "libmp3lame",
+                "-q:a",
+                "2",
+                "-threads",
+                str(FFMPEG_THREADS),
+                mp3_path,
+            ],
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            error = result.stderr.decode(errors="replace").strip()[-500:]
+            raise Exception(f"Failed to convert stream to mp3: {error}")
+        os.replace(mp3_path, path)
+    finally:
+        remove_file(mp3_path)
+
+
+async def get_stream_url(track: dict) -> str | None:
+    """Return stream url: m3u8 playlist for hls, audio file for progressive"""
+    transcoding = pick_transcoding(track)
+    if transcoding is None:
+        raise Exception("No supported stream found")
+    data = await _get_api_json(transcoding["url"])
+    return data.get("url")
+
+
+async def get_download_url(track: dict) -> str:
+    """Original file if uploader allows downloads, best stream otherwise"""
+    if track.get("downloadable") and "download_url" in track:
+        return f"{track['download_url']}?client_id={await get_client_id()}"
+    return await get_stream_url(track=track)
+
+
+def is_hls_url(url: str) -> bool:
+    return urlparse(url).path.endswith(".m3u8")
+
+
+def parse_hls_playlist(text: str, base_url: str) -> list[str]:
+    """Segment urls of a media playlist, init segment first if there is one"""
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line:
+            raise Exception("Encrypted HLS streams are not supported")
+        if line.startswith("#EXT-X-MAP"):
+            uri = line.split('URI="', 1)[1].split('"', 1)[0]
+            segments.append(urljoin(base_url, uri))
+        elif line and not line.startswith("#"):
+            segments.append(urljoin(base_url, line))
+    if not segments:
+        raise Exception("HLS playlist has no segments")
+    return segments
+
+
+async def _fetch_segment(url: str) -> bytes:
+    session = get_http_session()
+    for attempt in range(HLS_SEGMENT_RETRIES + 1):
+        try:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    raise Exception(f"HTTP {resp.status}")
+                return await resp.read()
+        except Exception as e:
+            if attempt == HLS_SEGMENT_RETRIES:
+                raise Exception(f"Failed to download HLS segment: {e}") from e
+            logger.warning(f"Retry HLS segment after error: {e}")
+            await asyncio.sleep(0.25 * 2**attempt)
+
+
+async def download_hls(url: str, path: str) -> str:
+    """
+    Download HLS stream to one file. Up to HLS_WINDOW segments are fetched at once
+    and written in playlist order, so memory use is bounded by the window
+    """
+    session = get_http_session()
+    async with session.get(url) as resp:
+        if resp.status != 200:
+            raise Exception(f"Failed to get HLS playlist: HTTP {resp.status}")
+        segments = parse_hls_playlist(await resp.text(), base_url=str(resp.url))
+
+    pending: deque[asyncio.Task] = deque()
+    try:
+        with open(path, "wb") as f:
+            for segment_url in segments:
+                pending.append(asyncio.create_task(_fetch_segment(segment_url)))
+                if len(pending) >= HLS_WINDOW:
+                    f.write(await pending.popleft())
+            while pending:
+                f.write(await pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return path
+
+
+def _content_range_total(resp) -> int | None:
+    """Total size from Content-Range: bytes start-end/total"""
+    total = resp.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else None
+
+
+@dataclass
+class _Part:
+    start: int
+    end: int
+    # next byte to write, kept between attempts so a retry resumes the part
+    position: int
+
+
+async def _write_part(resp, path: str, part: _Part) -> None:
+    """Write response body to its place in the file"""
+    with open(path, "r+b") as f:
+        f.seek(part.position)
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            f.write(chunk)
+            part.position += len(chunk)
+
+
+async def _download_part(url: str, path: str, part: _Part) -> None:
+    """Fetch the rest of the part, a failed attempt is resumed from the last written byte"""
+    session = get_http_session()
+    for attempt in range(DOWNLOAD_PART_RETRIES + 1):
+        try:
+            headers = {"Range": f"bytes={part.position}-{part.end}"}
+            async with session.get(url, headers=headers) as resp:
+                if resp.status != 206:
+                    raise Exception(f"HTTP {resp.status}")
+                await _write_part(resp, path, part)
+            if part.position > part.end:
+                return
+            raise Exception("connection closed before the end of the part")
+        except Exception as e:
+            if attempt == DOWNLOAD_PART_RETRIES:
+                raise Exception(
+                    f"Failed to download bytes {part.start}-{part.end}: {e}"
+                ) from e
+            logger.warning(f"Resume bytes {part.position}-{part.end} after error: {e}")
+            await asyncio.sleep(0.25 * 2**attempt)
+
+
+async def _download_ranges(url: str, path: str, first_resp, total: int) -> None:
+    """
+    File is preallocated and split into DOWNLOAD_PART_SIZE parts, first_resp already
+    carries the first one. The rest are fetched by up to DOWNLOAD_PARALLEL connections
+    """
+    with open(path, "wb") as f:
+        f.truncate(total)
+    parts = [
+        _Part(start, min(start + DOWNLOAD_PART_SIZE, total) - 1, start)
+        for start in range(0, total, DOWNLOAD_PART_SIZE)
+    ]
+    slots = asyncio.Semaphore(max(1, DOWNLOAD_PARALLEL))
+
+    async def fetch(part: _Part) -> None:
+        async with slots:
+            await _download_part(url, path, part)
+
+    # first_resp takes one of the connections
+    await slots.acquire()
+    tasks = [asyncio.create_task(fetch(part)) for part in parts[1:]]
+    try:
+        first = parts[0]
+        try:
+            await _write_part(first_resp, path, first)
+        except Exception as e:
+            logger.warning(
+                f"Resume bytes {first.position}-{first.end} after error: {e}"
+            )
+        if first.position <= first.end:
+            await _download_part(url, path, first)
+        slots.release()
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _download_rest(url: str, f) -> None:
+    session = get_http_session()
+    async with session.get(url, headers={"Range": f"bytes={f.tell()}-"}) as resp:
+        # first part happened to end the file
+        if resp.status == 416:
+            return
+        if resp.status != 206:
+            raise Exception(f"Failed to download file: HTTP {resp.status}")
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            f.write(chunk)
+
 
-            fh = BytesIO()
-            while True:
-                chunk = await resp.content.read(8192)
-                if not chunk:
-                    break
-                fh.write(chunk)
+async def download_file(url: str, path: str) -> str:
+    """
+    Download track with download url or stream url to file, memory use doesn't depend on track size.
+    Servers with Range support get parallel ranged requests, others a single stream
+    """
+    if is_hls_url(url):
+        return await download_hls(url=url, path=path)
+    session = get_http_session()
+    # the first part is requested right away, the answer tells if ranges are supported
+    headers = {"Range": f"bytes=0-{DOWNLOAD_PART_SIZE - 1}"}
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 206 and (total := _content_range_total(resp)) is not None:
+            await _download_ranges(url, path, first_resp=resp, total=total)
+            return path
+        if resp.status not in (200, 206):
+            raise Exception(f"Failed to download file: HTTP {resp.status}")
 
-            fh.seek(0)
+        with open(path, "wb") as f:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                f.write(chunk)
+            # size is unknown (Content-Range total is *), the rest comes as a single stream
+            if resp.status == 206 and f.tell() >= DOWNLOAD_PART_SIZE:
+                await _download_rest(url, f)
 
-            return fh
+    return path
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+
+from app.utils.api.http_client import get_http_session
+from app.utils.database.requests import get_saved_client_id, save_client_id
+from app.utils.helpers.metrics import stage_timer
+from app.utils.helpers.single_flight import SingleFlight
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+CLIENT_ID_TTL = timedelta(hours=float(os.getenv("SC_CLIENT_ID_TTL_HOURS", "24")))
+# refresh client_id this long before it expires, a short TTL gets a part of it as margin
+CLIENT_ID_REFRESH_MARGIN = min(timedelta(hours=1), CLIENT_ID_TTL / 4)
+
+BUNDLE_URL_RE = re.compile(r'src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"')
+CLIENT_ID_RE = re.compile(r'client_id\s*:\s*"([a-zA-Z0-9]{32})"')
+
+
+async def _find_client_id_in_bundle(js_url: str) -> str | None:
+    session = get_http_session()
+    async with session.get(js_url) as resp:
+        if resp.status != 200:
+            return None
+        match = CLIENT_ID_RE.search(await resp.text())
+        return match.group(1) if match else None
+
+
+async def scrape_client_id() -> str:
+    """Parse SoundCloud main page and search its JS bundles for client_id concurrently"""
+    session = get_http_session()
+    async with session.get("https://soundcloud.com/") as resp:
+        js_urls = BUNDLE_URL_RE.findall(await resp.text())
+
+    tasks = [asyncio.create_task(_find_client_id_in_bundle(url)) for url in js_urls]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                client_id = await next_done
+            except Exception as e:
+                logger.warning("Failed to fetch SoundCloud bundle: %s", e)
+                continue
+            if client_id:
+                return client_id
+    finally:
+        # first match wins, the rest of bundles are not needed
+        for task in tasks:
+            task.cancel()
+    raise Exception("Client ID not found")
+
+
+class ClientIdManager:
+    """
+    Process-wide SoundCloud client_id served from memory.
+    Only one refresh runs at a time, concurrent callers wait for its result.
+    """
+
+    def __init__(self):
+        self._client_id: str | None = None
+        self._updated_at: datetime | None = None
+        self._refreshes = SingleFlight()
+        self.metrics = {"refreshes": 0, "invalidations": 0}
+
+    def _is_fresh(self, updated_at: datetime | None) -> bool:
+        return updated_at is not None and datetime.now() - updated_at < CLIENT_ID_TTL
+
+    async def _load(self) -> str:
+        row = await get_saved_client_id()
+        if row and self._is_fresh(row.updated_at):
+            logger.info("Receive client id from db")
+            self._client_id, self._updated_at = row.client_id, row.updated_at
+            return row.client_id
+        return await self._scrape()
+
+    async def _scrape(self) -> str:
+        logger.info("Update and save client id")
+        with stage_timer("client_id", "soundcloud"):
+            client_id = await scrape_client_id()
+        self._client_id, self._updated_at = client_id, datetime.now()
+        self.metrics["refreshes"] += 1
+        await save_client_id(client_id)
+        return client_id
+
+    async def get(self) -> str:
+        if self._client_id is not None:
+            return self._client_id
+        return await self._refreshes.do("client_id", self._load)
+
+    async def refresh(self, rejected: str | None = None) -> str:
+        """
+        Fetch new client_id. rejected is the id SoundCloud answered 401/403 to,
+        if it was already replaced by another request, the current one is returned.
+        """
+        if rejected is not None:
+            self.metrics["invalidations"] += 1
+            if self._client_id is not None and self._client_id != rejected:
+                return self._client_id
+        return await self._refreshes.do("client_id", self._scrape)
+
+    def seconds_until_refresh(self) -> float | None:
+        if self._updated_at is None:
+            return None
+        left = self._updated_at + CLIENT_ID_TTL - CLIENT_ID_REFRESH_MARGIN
+        return max(0.0, (left - datetime.now()).total_seconds())
+
+
+client_ids = ClientIdManager()
+
+
+async def get_client_id() -> str:
+    return await client_ids.get()
+
+
+async def keep_client_id_fresh(retry_interval: float = 60) -> None:
+    """Background task, refreshes client_id before it expires, so requests never wait for it"""
+    while True:
+        try:
+            await client_ids.get()
+            delay = client_ids.seconds_until_refresh() or 0
+            if delay > 0:
+                # checked again after waking, a rejected id may have been replaced meanwhile
+                await asyncio.sleep(delay)
+                continue
+            await client_ids.refresh()
+        except Exception as e:
+            logger.error("Failed to refresh SoundCloud client_id: %s", e)
+            await asyncio.sleep(retry_interval)
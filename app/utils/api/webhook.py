@@ -0,0 +1,40 @@
+import os
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+# public url Telegram sends updates to, the bot runs in webhook mode when it is set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# local address, usually behind a reverse proxy which terminates TLS
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def create_webhook_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = WEBHOOK_PATH,
+    secret: str | None = WEBHOOK_SECRET,
+) -> web.Application:
+    """
+    aiohttp app with aiogram webhook handler. Updates are answered right away
+    and handled in background, requests without the secret token are rejected
+    """
+    app = web.Application()
+    # for load balancer health checks
+    app.router.add_get("/health", _health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(
+        app, path=path
+    )
+    return app
+
+
+def get_webhook_url() -> str:
+    return f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}"
@@ -1,82 +1,113 @@
+import os
+import re
 import yt_dlp
-from io import BytesIO
 from pathlib import Path
-import tempfile
 
+from app.utils.helpers.files import move_file
 
-def get_video_metadata(url: str):
-    ydl_opts = {"quiet": True, "skip_download": True}
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        if info is None:
-            raise RuntimeError("Failed to download track")
+# ffmpeg threads per transcode worker, workers already run in parallel on all cores
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "1"))
+# info extraction only loads pages, it shouldn't take as long as a download
+EXTRACT_TIMEOUT = 120
+
+YDL_BASE_OPTS = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+}
+
+VIDEO_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)"
+    r"([A-Za-z0-9_-]{11})"
+)
 
-        fmt = (info.get("requested_downloads") or [None])[0] or {}
-        upload_date = info.get("upload_date")
-        year = upload_date[:4] if upload_date else None
-
-        metadata = {
-            "id": info.get("id"),
-            "title": info.get("title", "Untitled"),
-            "author": info.get("uploader", "Unknown"),
-            "thumbnail": info.get("thumbnail"),
-            "duration": info.get("duration"),
-            "bitrate": fmt.get("abr"),
-            "sample_rate": fmt.get("asr"),
-            "year": year,
-        }
-
-        return metadata
-
-
-def download_yt_audio(url: str):
-    buffer = BytesIO()
-    buffer.name = "audio.mp3"
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        outtmpl = str(Path(tmpdir) / "%(id)s.%(ext)s")
-
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "quiet": True,
-            "no_warnings": True,
-            "noprogress": True,
-            "outtmpl": outtmpl,
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "192",
-                }
-            ],
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            if info is None:
-                raise RuntimeError("Failed to download track")
 
-            mp3_path = Path(tmpdir) / f"{info['id']}.mp3"
-            if not mp3_path.exists():
-                raise FileNotFoundError("Finished MP3 not found after post processing")
+def parse_video_id(url: str) -> str | None:
+    """Get video id from url without any request to YouTube"""
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
 
-            with open(mp3_path, "rb") as f:
-                buffer.write(f.read())
-            buffer.seek(0)
 
+def build_metadata(info: dict) -> dict:
     fmt = (info.get("requested_downloads") or [None])[0] or {}
     upload_date = info.get("upload_date")
     year = upload_date[:4] if upload_date else None
 
-    metadata = {
+    return {
         "id": info.get("id"),
         "title": info.get("title", "Untitled"),
         "author": info.get("uploader", "Unknown"),
         "thumbnail": info.get("thumbnail"),
         "duration": info.get("duration"),
-        "bitrate": fmt.get("abr"),
-        "sample_rate": fmt.get("asr"),
+        "bitrate": fmt.get("abr") or info.get("abr"),
+        "sample_rate": fmt.get("asr") or info.get("asr"),
         "year": year,
     }
 
-    return buffer, metadata
+
+def extract_video_info(url: str) -> dict:
+    """Extract info once, it can be passed to download_yt_audio to skip second extraction"""
+    with yt_dlp.YoutubeDL({**YDL_BASE_OPTS, "skip_download": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if info is None:
+            raise RuntimeError("Failed to download track")
+        # plain json-like dict, so it can be sent between processes
+        return ydl.sanitize_info(info)
+
+
+def extract_playlist(url: str, max_entries: int) -> dict:
+    """Flat extraction: ids and titles of playlist videos, without visiting every video page"""
+    opts = {**YDL_BASE_OPTS, "extract_flat": "in_playlist", "playlistend": max_entries}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if info is None:
+            raise RuntimeError("Failed to get playlist")
+        entries = [
+            {
+                "id": entry["id"],
+                "title": entry.get("title"),
+                "url": f"https://www.youtube.com/watch?v={entry['id']}",
+            }
+            for entry in info.get("entries") or []
+            if entry and entry.get("id")
+        ]
+        return {"title": info.get("title"), "entries": entries}
+
+
+def download_yt_audio(
+    url: str, output_path: str, work_dir: str, info: dict | None = None
+) -> dict:
+    """
+    Download and convert audio to mp3 at output_path, return metadata.
+    Intermediate files go to work_dir, which the caller removes even if the job is killed
+    """
+    ydl_opts = {
+        **YDL_BASE_OPTS,
+        "outtmpl": str(Path(work_dir) / "%(id)s.%(ext)s"),
+        "postprocessors": [
+            {
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": "mp3",
+                "preferredquality": "192",
+            }
+        ],
+        "postprocessor_args": {"ffmpeg": ["-threads", str(FFMPEG_THREADS)]},
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if info is not None:
+            # reuse already extracted info instead of fetching the page again
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+        if info is None:
+            raise RuntimeError("Failed to download track")
+
+        mp3_path = Path(work_dir) / f"{info['id']}.mp3"
+        if not mp3_path.exists():
+            raise FileNotFoundError("Finished MP3 not found after post processing")
+
+        move_file(str(mp3_path), output_path)
+
+    return build_metadata(info)
@@ -0,0 +1,131 @@
+from typing import Callable
+
+from sqlalchemy import Connection, inspect, text
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+
+def _add_telegram_file_ids(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    for column in ("tg_file_id", "tg_thumb_file_id"):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE files ADD COLUMN {column} VARCHAR(255)"))
+
+
+def _add_source_unique_index(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    if "source" not in columns:
+        conn.execute(
+            text(
+                "ALTER TABLE files ADD COLUMN source VARCHAR(20) NOT NULL DEFAULT 'soundcloud'"
+            )
+        )
+    # soundcloud ids are numeric, everything else came from youtube
+    conn.execute(
+        text("UPDATE files SET source = 'youtube' WHERE track_id GLOB '*[^0-9]*'")
+    )
+    # keep the newest row of duplicates inserted by concurrent requests
+    conn.execute(
+        text(
+            "DELETE FROM files WHERE id NOT IN "
+            "(SELECT MAX(id) FROM files GROUP BY source, track_id)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_files_source_track_id "
+            "ON files (source, track_id)"
+        )
+    )
+
+
+def _make_drive_file_id_nullable(conn: Connection) -> None:
+    # sqlite can't alter column constraints, so the table is rebuilt
+    conn.execute(text("""
+            CREATE TABLE files_new (
+                id INTEGER NOT NULL PRIMARY KEY,
+                source VARCHAR(20) DEFAULT 'soundcloud' NOT NULL,
+                filename VARCHAR(120) NOT NULL,
+                track_id VARCHAR(120) NOT NULL,
+                drive_file_id VARCHAR(120),
+                tg_file_id VARCHAR(255),
+                tg_thumb_file_id VARCHAR(255),
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL
+            )
+            """))
+    conn.execute(text("""
+            INSERT INTO files_new (id, source, filename, track_id, drive_file_id,
+                tg_file_id, tg_thumb_file_id, updated_at)
+            SELECT id, source, filename, track_id, drive_file_id,
+                tg_file_id, tg_thumb_file_id, updated_at
+            FROM files
+            """))
+    conn.execute(text("DROP TABLE files"))
+    conn.execute(text("ALTER TABLE files_new RENAME TO files"))
+    conn.execute(
+        text("CREATE UNIQUE INDEX uq_files_source_track_id ON files (source, track_id)")
+    )
+
+
+def _add_audio_details(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    for column, column_type in (
+        ("title", "VARCHAR(255)"),
+        ("performer", "VARCHAR(255)"),
+        ("duration", "INTEGER"),
+        ("bitrate", "INTEGER"),
+        ("size", "INTEGER"),
+        ("thumb", "BLOB"),
+    ):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE files ADD COLUMN {column} {column_type}"))
+
+
+def _add_upload_uri(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("pending_uploads")}
+    if "upload_uri" not in columns:
+        conn.execute(
+            text("ALTER TABLE pending_uploads ADD COLUMN upload_uri VARCHAR(2048)")
+        )
+
+
+def _add_access_stats(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    for column, column_type in (
+        ("hits", "INTEGER NOT NULL DEFAULT 0"),
+        ("downloads", "INTEGER NOT NULL DEFAULT 1"),
+        ("last_accessed", "DATETIME"),
+    ):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE files ADD COLUMN {column} {column_type}"))
+
+
+# schema version is kept in sqlite user_version, migration N upgrades N-1 -> N
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _add_telegram_file_ids,
+    _add_source_unique_index,
+    _make_drive_file_id_nullable,
+    _add_audio_details,
+    _add_upload_uri,
+    _add_access_stats,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar_one()
+
+
+def set_schema_version(conn: Connection, version: int) -> None:
+    conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+
+def migrate(conn: Connection) -> None:
+    """Upgrade existing db.sqlite3 to the current schema"""
+    version = get_schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Apply db migration {number}: {migration.__name__}")
+        migration(conn)
+        set_schema_version(conn, number)
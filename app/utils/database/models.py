@@ -1,9 +1,31 @@
+import os
 from datetime import datetime
-from sqlalchemy import String, DateTime, func
+from sqlalchemy import JSON, Index, LargeBinary, String, DateTime, event, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 
-engine = create_async_engine(url="sqlite+aiosqlite:///db.sqlite3")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///db.sqlite3")
+# how long a writer waits for the lock held by another connection, seconds
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "15"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+
+engine = create_async_engine(
+    url=DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_SIZE,
+    connect_args={"timeout": DB_BUSY_TIMEOUT},
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers work while a writer commits, NORMAL sync is safe with WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    cursor.close()
+
 
 async_session = async_sessionmaker(engine)
 
@@ -26,13 +48,83 @@ class SoundCloud_Api_Settings(Base):
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        Index("uq_files_source_track_id", "source", "track_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
+    # soundcloud numeric ids and youtube video ids live in separate namespaces
+    source: Mapped[str] = mapped_column(String(20), server_default="soundcloud")
     filename: Mapped[str] = mapped_column(String(120))
     track_id: Mapped[str] = mapped_column(String(120))
-    drive_file_id: Mapped[str] = mapped_column(String(120))
+    # empty until background uploader stores the file in Google Drive
+    drive_file_id: Mapped[str | None] = mapped_column(String(120), nullable=True)
+    # audio already uploaded to Telegram can be resent by file_id without any transfer
+    tg_file_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    tg_thumb_file_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # computed once at ingest, so sending never parses the audio
+    title: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    performer: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    duration: Mapped[int | None] = mapped_column(nullable=True)
+    bitrate: Mapped[int | None] = mapped_column(nullable=True)
+    size: Mapped[int | None] = mapped_column(nullable=True)
+    thumb: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    # requests served from cache and from the origin, hits are written in batches
+    hits: Mapped[int] = mapped_column(default=0, server_default="0")
+    downloads: Mapped[int] = mapped_column(default=1, server_default="1")
+    last_accessed: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         server_default=func.now(),
         onupdate=func.now(),
     )
+
+
+class Pending_Upload(Base):
+    """Outbox of tagged files waiting for upload to Google Drive"""
+
+    __tablename__ = "pending_uploads"
+    __table_args__ = (
+        Index("uq_pending_uploads_source_track_id", "source", "track_id", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source: Mapped[str] = mapped_column(String(20))
+    track_id: Mapped[str] = mapped_column(String(120))
+    filename: Mapped[str] = mapped_column(String(120))
+    path: Mapped[str] = mapped_column(String(255))
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    last_error: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # resumable upload session, the next attempt continues from the committed offset
+    upload_uri: Mapped[str | None] = mapped_column(String(2048), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class YouTube_Metadata(Base):
+    __tablename__ = "youtube_metadata"
+
+    video_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    data: Mapped[dict] = mapped_column(JSON)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
+
+
+class Track_Link(Base):
+    """Canonical link already resolved to a track, it is served from cache without resolving again"""
+
+    __tablename__ = "track_links"
+
+    url: Mapped[str] = mapped_column(String(512), primary_key=True)
+    source: Mapped[str] = mapped_column(String(20))
+    track_id: Mapped[str] = mapped_column(String(120))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
@@ -1,86 +1,391 @@
-import re
-import aiohttp
 from datetime import datetime, timedelta
-from sqlalchemy import select
+from sqlalchemy import bindparam, case, delete, func, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert
 
 from app.utils.database.models import (
     Base,
     engine,
     SoundCloud_Api_Settings,
     File,
+    Pending_Upload,
+    Track_Link,
+    YouTube_Metadata,
     async_session,
     engine,
 )
+from app.utils.database.migrations import SCHEMA_VERSION, migrate, set_schema_version
 from logging_config import get_app_logger
 
 logger = get_app_logger(name=__name__)
-CACHE_EXPIRATION_HOURS = 24
 
 
-async def get_client_id() -> str:
-    """Parse SoundCloud main page and receive client_id"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get("https://soundcloud.com/") as resp:
-            html_text = await resp.text()
-            js_urls = re.findall(
-                r'src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"', html_text
-            )
-            for js_url in js_urls:
-                async with session.get(js_url) as js_resp:
-                    js_text = await js_resp.text()
-                    match = re.search(r'client_id\s*:\s*"([a-zA-Z0-9]{32})"', js_text)
-                    if match:
-                        return match.group(1)
-    raise Exception("Client ID not found")
+async def get_saved_client_id() -> SoundCloud_Api_Settings | None:
+    async with async_session() as session:
+        return await session.scalar(select(SoundCloud_Api_Settings).limit(1))
 
 
-async def get_client_id_cached():
+async def save_client_id(client_id: str) -> None:
+    """Persist client_id, so it survives restarts"""
     async with async_session() as session:
         async with session.begin():
-            result = await session.execute(select(SoundCloud_Api_Settings).limit(1))
-            row = result.scalar_one_or_none()
-
-            now = datetime.now()
-            if (
-                row
-                and row.updated_at
-                and (now - row.updated_at) < timedelta(hours=CACHE_EXPIRATION_HOURS)
-            ):
-                logger.info("Receive client id from cache")
-                return row.client_id
-
-            logger.info("Update and save client id in cache")
-            new_client_id = await get_client_id()
-
+            row = await session.scalar(select(SoundCloud_Api_Settings).limit(1))
             if row:
-                row.client_id = new_client_id
-                row.updated_at = now
+                row.client_id = client_id
+                row.updated_at = datetime.now()
             else:
                 session.add(
-                    SoundCloud_Api_Settings(client_id=new_client_id, updated_at=now)
+                    SoundCloud_Api_Settings(
+                        client_id=client_id, updated_at=datetime.now()
+                    )
                 )
 
-            return new_client_id
+
+def _file_filter(source: str, track_id: str):
+    return (File.source == source) & (File.track_id == str(track_id))
 
 
-async def get_file_by_track_id(track_id: str) -> File | None:
+async def get_file_by_track_id(source: str, track_id: str) -> File | None:
     async with async_session() as session:
-        return await session.scalar(select(File).where(File.track_id == track_id))
+        return await session.scalar(select(File).where(_file_filter(source, track_id)))
 
 
 async def set_file_by_track_id(
-    filename: str, track_id: str, drive_file_id: str
+    source: str,
+    filename: str,
+    track_id: str,
+    drive_file_id: str | None = None,
+    **details,
+) -> None:
+    """
+    Insert file or update existing row of the same track, called after every origin download.
+    details are File columns (title, duration, thumb...), known values are never reset to empty
+    """
+    async with async_session() as session:
+        async with session.begin():
+            stmt = insert(File).values(
+                source=source,
+                filename=filename,
+                track_id=str(track_id),
+                drive_file_id=drive_file_id,
+                last_accessed=datetime.now(),
+                **details,
+            )
+            keep_known = {
+                column: func.coalesce(stmt.excluded[column], File.__table__.c[column])
+                for column in ("drive_file_id", *details)
+            }
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[File.source, File.track_id],
+                    set_={
+                        "filename": stmt.excluded.filename,
+                        **keep_known,
+                        "downloads": File.downloads + 1,
+                        "last_accessed": stmt.excluded.last_accessed,
+                        "updated_at": func.now(),
+                    },
+                )
+            )
+
+
+async def set_file_details(source: str, track_id: str, **details) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(File).where(_file_filter(source, track_id)).values(**details)
+            )
+
+
+async def set_telegram_file_ids(
+    source: str, track_id: str, tg_file_id: str, tg_thumb_file_id: str | None = None
+) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(File)
+                .where(_file_filter(source, track_id))
+                .values(tg_file_id=tg_file_id, tg_thumb_file_id=tg_thumb_file_id)
+            )
+
+
+async def clear_telegram_file_ids(source: str, track_id: str) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(File)
+                .where(_file_filter(source, track_id))
+                .values(tg_file_id=None, tg_thumb_file_id=None)
+            )
+
+
+async def clear_drive_file_id(source: str, track_id: str) -> None:
+    """Drive copy is gone, the next origin download uploads a new one"""
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(File)
+                .where(_file_filter(source, track_id))
+                .values(drive_file_id=None)
+            )
+
+
+async def add_file_hits(hits: list[dict]) -> None:
+    """Apply buffered cache hits in one transaction, dicts have source, track_id, hits, last_accessed"""
+    if not hits:
+        return
+    files = File.__table__
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(files)
+                .where(
+                    (files.c.source == bindparam("b_source"))
+                    & (files.c.track_id == bindparam("b_track_id"))
+                )
+                .values(
+                    hits=files.c.hits + bindparam("b_hits"),
+                    last_accessed=bindparam("b_last_accessed"),
+                ),
+                [{f"b_{key}": value for key, value in hit.items()} for hit in hits],
+            )
+
+
+async def get_drive_usage() -> tuple[int, int]:
+    """Files stored in Drive and their total size in bytes"""
+    async with async_session() as session:
+        row = await session.execute(
+            select(func.count(), func.coalesce(func.sum(File.size), 0)).where(
+                File.drive_file_id.is_not(None)
+            )
+        )
+        return tuple(row.one())
+
+
+def _no_pending_upload():
+    # the outbox sets drive_file_id of the row when its upload finishes
+    return ~(
+        select(Pending_Upload.id)
+        .where(
+            (Pending_Upload.source == File.source)
+            & (Pending_Upload.track_id == File.track_id)
+        )
+        .exists()
+    )
+
+
+async def get_eviction_candidates(by_frequency: bool, limit: int) -> list:
+    """
+    Drive files from the least valuable: least recently used, or least
+    frequently used with recency as a tie-breaker
+    """
+    last_used = func.coalesce(File.last_accessed, File.updated_at)
+    order = (File.hits, last_used) if by_frequency else (last_used,)
+    async with async_session() as session:
+        result = await session.execute(
+            select(File.source, File.track_id, File.drive_file_id, File.size)
+            .where(File.drive_file_id.is_not(None) & _no_pending_upload())
+            .order_by(*order)
+            .limit(limit)
+        )
+        return list(result)
+
+
+async def get_drive_files_without_size(limit: int) -> list:
+    """Drive files saved before sizes were stored, their size is unknown to the budget"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(File.source, File.track_id, File.drive_file_id)
+            .where(
+                File.drive_file_id.is_not(None)
+                & File.size.is_(None)
+                & _no_pending_upload()
+            )
+            .limit(limit)
+        )
+        return list(result)
+
+
+async def delete_file(source: str, track_id: str) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(delete(File).where(_file_filter(source, track_id)))
+
+
+async def get_cache_report() -> list[dict]:
+    """Per source: cached files, Drive usage, hits, origin downloads and bytes served from cache"""
+    size = func.coalesce(File.size, 0)
+    async with async_session() as session:
+        result = await session.execute(
+            select(
+                File.source,
+                func.count().label("files"),
+                func.count(File.drive_file_id).label("drive_files"),
+                func.sum(case((File.drive_file_id.is_not(None), size), else_=0)).label(
+                    "drive_bytes"
+                ),
+                func.sum(File.hits).label("hits"),
+                func.sum(File.downloads).label("downloads"),
+                func.sum(File.hits * size).label("bytes_saved"),
+            )
+            .group_by(File.source)
+            .order_by(File.source)
+        )
+        return [row._asdict() for row in result]
+
+
+async def add_pending_upload(
+    source: str, track_id: str, filename: str, path: str
+) -> None:
+    """Add file to the upload outbox, one entry per track"""
+    async with async_session() as session:
+        async with session.begin():
+            stmt = insert(Pending_Upload).values(
+                source=source,
+                track_id=str(track_id),
+                filename=filename,
+                path=path,
+                attempts=0,
+                next_attempt_at=datetime.now(),
+            )
+            await session.execute(
+                stmt.on_conflict_do_nothing(
+                    index_elements=[Pending_Upload.source, Pending_Upload.track_id]
+                )
+            )
+
+
+async def get_pending_upload(source: str, track_id: str) -> Pending_Upload | None:
+    async with async_session() as session:
+        return await session.scalar(
+            select(Pending_Upload).where(
+                (Pending_Upload.source == source)
+                & (Pending_Upload.track_id == str(track_id))
+            )
+        )
+
+
+async def get_due_uploads(limit: int) -> list[Pending_Upload]:
+    async with async_session() as session:
+        result = await session.scalars(
+            select(Pending_Upload)
+            .where(Pending_Upload.next_attempt_at <= datetime.now())
+            .order_by(Pending_Upload.next_attempt_at)
+            .limit(limit)
+        )
+        return list(result)
+
+
+async def get_next_upload_time() -> datetime | None:
+    async with async_session() as session:
+        return await session.scalar(select(func.min(Pending_Upload.next_attempt_at)))
+
+
+async def complete_pending_upload(upload_id: int, drive_file_id: str) -> None:
+    """Save drive id of uploaded file and remove it from the outbox in one transaction"""
+    async with async_session() as session:
+        async with session.begin():
+            upload = await session.get(Pending_Upload, upload_id)
+            if upload is None:
+                return
+            await session.execute(
+                update(File)
+                .where(_file_filter(upload.source, upload.track_id))
+                .values(drive_file_id=drive_file_id)
+            )
+            await session.delete(upload)
+
+
+async def delete_pending_upload(upload_id: int) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            upload = await session.get(Pending_Upload, upload_id)
+            if upload is not None:
+                await session.delete(upload)
+
+
+async def postpone_pending_upload(
+    upload_id: int, next_attempt_at: datetime, error: str
 ) -> None:
     async with async_session() as session:
         async with session.begin():
-            new_file = File(
-                filename=filename, track_id=track_id, drive_file_id=drive_file_id
+            await session.execute(
+                update(Pending_Upload)
+                .where(Pending_Upload.id == upload_id)
+                .values(
+                    attempts=Pending_Upload.attempts + 1,
+                    next_attempt_at=next_attempt_at,
+                    last_error=error[:255],
+                )
+            )
+
+
+async def set_upload_uri(upload_id: int, upload_uri: str) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Pending_Upload)
+                .where(Pending_Upload.id == upload_id)
+                .values(upload_uri=upload_uri)
             )
-            session.add(new_file)
-            await session.commit()
+
+
+async def get_youtube_metadata(video_id: str, max_age: timedelta) -> dict | None:
+    async with async_session() as session:
+        row = await session.get(YouTube_Metadata, video_id)
+        if row is None or datetime.now() - row.updated_at > max_age:
+            return None
+        return row.data
+
+
+async def set_youtube_metadata(video_id: str, data: dict) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            stmt = insert(YouTube_Metadata).values(
+                video_id=video_id, data=data, updated_at=datetime.now()
+            )
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[YouTube_Metadata.video_id],
+                    set_={"data": stmt.excluded.data, "updated_at": datetime.now()},
+                )
+            )
+
+
+async def get_track_link(url: str) -> Track_Link | None:
+    async with async_session() as session:
+        return await session.get(Track_Link, url)
+
+
+async def save_track_links(urls: list[str], source: str, track_id: str) -> None:
+    """Remember which track the links point to, a renamed permalink is moved to the new track"""
+    async with async_session() as session:
+        async with session.begin():
+            for url in dict.fromkeys(urls):
+                stmt = insert(Track_Link).values(
+                    url=url, source=source, track_id=str(track_id)
+                )
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[Track_Link.url],
+                        set_={
+                            "source": stmt.excluded.source,
+                            "track_id": stmt.excluded.track_id,
+                        },
+                    )
+                )
+
+
+def _create_schema(conn) -> None:
+    is_new_db = not inspect(conn).has_table(File.__tablename__)
+    Base.metadata.create_all(conn)
+    if is_new_db:
+        # fresh tables already have the latest schema
+        set_schema_version(conn, SCHEMA_VERSION)
+    else:
+        migrate(conn)
 
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_schema)
         logger.info("Database alive")
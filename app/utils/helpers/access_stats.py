@@ -0,0 +1,68 @@
+import asyncio
+import os
+from datetime import datetime
+
+from app.utils.database.requests import add_file_hits
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# cache hits are counted in memory and written to the db once per interval
+ACCESS_FLUSH_INTERVAL = float(os.getenv("ACCESS_FLUSH_INTERVAL", "30"))
+
+
+class AccessStats:
+    """Hits per track since the last flush, so a hit costs no db write"""
+
+    def __init__(self):
+        self._pending: dict[tuple[str, str], dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record_hit(self, source: str, track_id: str) -> None:
+        key = (source, str(track_id))
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {
+                "source": source,
+                "track_id": str(track_id),
+                "hits": 0,
+            }
+        entry["hits"] += 1
+        entry["last_accessed"] = datetime.now()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await add_file_hits(list(pending.values()))
+        except Exception:
+            # keep the counts for the next flush
+            for key, entry in pending.items():
+                current = self._pending.setdefault(key, entry)
+                if current is not entry:
+                    current["hits"] += entry["hits"]
+            raise
+
+
+access_stats = AccessStats()
+
+
+def record_cache_hit(source: str, track_id: str) -> None:
+    access_stats.record_hit(source=source, track_id=track_id)
+
+
+async def flush_access_stats() -> None:
+    try:
+        await access_stats.flush()
+    except Exception as e:
+        logger.error("Failed to save cache hits: %s", e)
+
+
+async def run_access_stats_writer() -> None:
+    """Background task, writes buffered hits. Call flush_access_stats once more on shutdown"""
+    while True:
+        await asyncio.sleep(ACCESS_FLUSH_INTERVAL)
+        await flush_access_stats()
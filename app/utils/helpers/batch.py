@@ -0,0 +1,69 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from aiogram.types import Message
+
+from app.utils.helpers.links import Link
+from app.utils.helpers.playlist import PlaylistProgress
+from app.utils.helpers.scheduler import DOWNLOAD_USER_LIMIT
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# links of one message processed at the same time, more would hit the per-user download cap
+LINK_BATCH_WINDOW = int(os.getenv("LINK_BATCH_WINDOW", str(DOWNLOAD_USER_LIMIT)))
+LINK_BATCH_MAX = int(os.getenv("LINK_BATCH_MAX", "20"))
+# results of the link handlers which mean the user got the audio
+SENT_RESULTS = {"sent", "cached", "playlist"}
+
+ProcessLink = Callable[[Link], Awaitable[str]]
+
+
+class LinkBatchProgress(PlaylistProgress):
+    def __init__(self, status_message: Message, total: int, skipped: int = 0):
+        super().__init__(status_message, title="Your links", total=total)
+        self.skipped = skipped
+        self.failed_links: list[str] = []
+
+    def text(self) -> str:
+        text = f"{self.title}: done {self.sent} of {self.total}"
+        if self.failed_links:
+            text += f", {len(self.failed_links)} failed:\n" + "\n".join(
+                self.failed_links
+            )
+        if self.skipped:
+            text += f"\nOnly the first {self.total} links are processed, {self.skipped} skipped"
+        return text
+
+
+async def process_links(
+    message: Message, links: list[Link], process: ProcessLink
+) -> None:
+    """
+    Process links of one message, up to LINK_BATCH_WINDOW at once through the usual link handlers.
+    Every result is sent as soon as it is ready, one status message shows the progress.
+    process(link) returns the handler result, like process_sc_track_url
+    """
+    batch = links[:LINK_BATCH_MAX]
+    status_message = await message.answer(f"Found {len(batch)} links, working on it...")
+    progress = LinkBatchProgress(
+        status_message, total=len(batch), skipped=len(links) - len(batch)
+    )
+    window = asyncio.Semaphore(max(1, LINK_BATCH_WINDOW))
+
+    async def run(link: Link) -> None:
+        try:
+            async with window:
+                result = await process(link)
+        except Exception as e:
+            logger.error("Failed to process %s: %s", link.url, e)
+            result = "error"
+        if result in SENT_RESULTS:
+            progress.sent += 1
+        else:
+            progress.failed_links.append(link.url)
+        await progress.update()
+
+    await asyncio.gather(*(run(link) for link in batch))
+    await progress.update(force=True)
@@ -0,0 +1,138 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.helpers.files import link_or_copy, move_file, remove_file
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+INDEX_FILENAME = "index.json"
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """Write to temp file in the same directory and rename, readers never see partial file"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache of files on local disk.
+    The index (key -> size, last access) is persisted, so the cache survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        # ordered from least to most recently used
+        self._index: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", key) + ".mp3")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILENAME)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = {}
+        try:
+            with open(self._index_path(), "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.error("Disk cache index is broken, start with empty cache: %s", e)
+
+        for key, entry in sorted(entries.items(), key=lambda i: i[1]["last_access"]):
+            # skip entries which files were removed outside of the bot
+            if os.path.exists(self._path(key)):
+                self._index[key] = entry
+                self.size += entry["size"]
+        self._loaded = True
+        logger.info(f"Disk cache loaded: {len(self._index)} files, {self.size} bytes")
+
+    def _save_index(self) -> None:
+        _atomic_write(self._index_path(), json.dumps(self._index).encode("utf-8"))
+
+    def _evict(self, keep: str) -> None:
+        while self.size > self.max_bytes and len(self._index) > 1:
+            key = next(iter(self._index))
+            if key == keep:
+                break
+            entry = self._index.pop(key)
+            self.size -= entry["size"]
+            remove_file(self._path(key))
+            logger.info(f"Evict {key} from disk cache")
+
+    def _touch(self, key: str) -> bool:
+        entry = self._index.get(key)
+        if entry is None:
+            return False
+        if not os.path.exists(self._path(key)):
+            self.size -= self._index.pop(key)["size"]
+            return False
+        entry["last_access"] = time.time()
+        self._index.move_to_end(key)
+        return True
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            return self._touch(key)
+
+    def link_to(self, key: str, dst: str) -> bool:
+        """Give caller its own link to the cached file, so eviction can't remove it mid-send"""
+        with self._lock:
+            self._load()
+            if not self._touch(key):
+                return False
+            link_or_copy(self._path(key), dst)
+            return True
+
+    def put_file(self, key: str, src: str) -> None:
+        """Move finished file into the cache. The newest file is never evicted by its own put"""
+        with self._lock:
+            self._load()
+            size = os.path.getsize(src)
+            move_file(src, self._path(key))
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.size -= old["size"]
+            self._index[key] = {"size": size, "last_access": time.time()}
+            self.size += size
+            self._evict(keep=key)
+            self._save_index()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._load()
+            entry = self._index.pop(key, None)
+            if entry is None:
+                return
+            self.size -= entry["size"]
+            remove_file(self._path(key))
+            self._save_index()
+
+    def flush(self) -> None:
+        """Persist last access times, called on shutdown"""
+        with self._lock:
+            if self._loaded:
+                self._save_index()
@@ -0,0 +1,301 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+T = TypeVar("T")
+
+# thread pool for short blocking I/O (file access, disk cache, thumbnails)
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# own threads for Google Drive calls: chunked transfers and their retry backoff
+# hold a thread for long, cache hits on the io pool must not wait behind them
+DRIVE_WORKERS = int(os.getenv("DRIVE_WORKERS", "4"))
+# process pool for CPU-heavy work (yt-dlp + ffmpeg, mp3 tagging)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 2)))
+# dedicated processes for yt-dlp downloads and ffmpeg transcodes, one job per process at a time
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 2)))
+# a job running longer than this is killed together with its ffmpeg
+TRANSCODE_TIMEOUT = float(os.getenv("TRANSCODE_TIMEOUT", "900"))
+
+
+class WorkerPool:
+    """Lazily created executor with a size limit and queue depth accounting"""
+
+    def __init__(self, name: str, factory: Callable[[int], Executor], size: int):
+        self.name = name
+        self.size = max(1, size)
+        self._factory = factory
+        self._executor: Executor | None = None
+        self.in_flight = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            logger.info(f"Start {self.name} pool with {self.size} workers")
+            self._executor = self._factory(self.size)
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run func in the pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(
+                self.executor, partial(func, *args, **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "in_flight": self.in_flight,
+            # jobs submitted to the pool but still waiting for a free worker
+            "queued": max(0, self.in_flight - self.size),
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+def _thread_pool(size: int, prefix: str = "io-worker") -> Executor:
+    return ThreadPoolExecutor(max_workers=size, thread_name_prefix=prefix)
+
+
+def _process_pool(size: int) -> Executor:
+    # spawn instead of fork: the bot process runs an event loop and threads
+    return ProcessPoolExecutor(
+        max_workers=size, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+class JobTimeoutError(Exception):
+    def __init__(self, timeout: float):
+        super().__init__(f"Job didn't finish in {timeout}s, worker was killed")
+        self.timeout = timeout
+
+
+class WorkerCrashedError(Exception):
+    def __init__(self, exitcode: int | None):
+        super().__init__(f"Worker process died with exit code {exitcode}")
+        self.exitcode = exitcode
+
+
+def _job_worker(conn) -> None:
+    """Worker process loop: receive (func, args, kwargs), send back (ok, result or exception)"""
+    if hasattr(os, "setsid"):
+        # own process group, so subprocesses of a job (ffmpeg) are killed with the worker
+        os.setsid()
+    while True:
+        try:
+            func, args, kwargs = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            reply = (True, func(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # result or exception can't be pickled
+            conn.send((False, RuntimeError(f"Failed to send job result: {e!r}")))
+
+
+class _JobWorker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_job_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, job: tuple) -> tuple[bool, Any]:
+        """Blocking: send job and wait for its result, EOFError if the worker dies"""
+        self.conn.send(job)
+        return self.conn.recv()
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            # no process groups or the worker didn't call setsid yet
+            self.process.kill()
+        self.process.join(timeout=5)
+
+    def close(self) -> None:
+        self.kill()
+        self.conn.close()
+
+
+class JobWorkerPool:
+    """
+    Worker processes which run one job at a time and talk to the bot over a pipe.
+    Unlike ProcessPoolExecutor a job can be timed out or cancelled: its worker is
+    killed and replaced, and a crashed worker doesn't break the rest of the pool.
+    Jobs should return file paths and metadata, not file contents
+    """
+
+    def __init__(self, name: str, size: int, timeout: float):
+        self.name = name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._slots: asyncio.Semaphore | None = None
+        self._idle: list[_JobWorker] = []
+        self._workers: set[_JobWorker] = set()
+        # a thread per worker waits for its reply
+        self._waiters: ThreadPoolExecutor | None = None
+        self.in_flight = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.cancelled = 0
+
+    def _get_worker(self) -> _JobWorker:
+        if self._idle:
+            return self._idle.pop()
+        if self._waiters is None:
+            logger.info(f"Start {self.name} pool with {self.size} workers")
+            self._waiters = ThreadPoolExecutor(
+                max_workers=self.size, thread_name_prefix=f"{self.name}-waiter"
+            )
+        worker = _JobWorker(self._ctx)
+        self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker: _JobWorker) -> None:
+        self._workers.discard(worker)
+        worker.close()
+
+    async def run(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        timeout: float | None = None,
+        **kwargs: Any,
+    ) -> T:
+        """Run func in a worker process, kill it after timeout or when the caller is cancelled"""
+        timeout = timeout or self.timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            async with self._slots:
+                worker = self._get_worker()
+                reply = loop.run_in_executor(
+                    self._waiters, worker.call, (func, args, kwargs)
+                )
+                try:
+                    ok, result = await asyncio.wait_for(asyncio.shield(reply), timeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                    # waiter thread gets EOFError once the worker is dead
+                    worker.kill()
+                    await asyncio.gather(reply, return_exceptions=True)
+                    self._discard(worker)
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.timeouts += 1
+                        logger.warning(f"{func.__name__} timed out after {timeout}s")
+                        raise JobTimeoutError(timeout) from None
+                    self.cancelled += 1
+                    raise
+                except (EOFError, OSError):
+                    self.crashes += 1
+                    self._discard(worker)
+                    raise WorkerCrashedError(worker.process.exitcode) from None
+                except BaseException:
+                    # e.g. job can't be pickled, the pipe state is unknown
+                    self._discard(worker)
+                    raise
+                self._idle.append(worker)
+        finally:
+            self.in_flight -= 1
+        if not ok:
+            raise result
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.size),
+            "processes": len(self._workers),
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "cancelled": self.cancelled,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        for worker in list(self._workers):
+            self._discard(worker)
+        self._idle.clear()
+        if self._waiters is not None:
+            self._waiters.shutdown(wait=wait)
+            self._waiters = None
+
+
+io_pool = WorkerPool(name="io", factory=_thread_pool, size=IO_WORKERS)
+drive_pool = WorkerPool(
+    name="drive",
+    factory=partial(_thread_pool, prefix="drive-worker"),
+    size=DRIVE_WORKERS,
+)
+cpu_pool = WorkerPool(name="cpu", factory=_process_pool, size=CPU_WORKERS)
+transcode_pool = JobWorkerPool(
+    name="transcode", size=TRANSCODE_WORKERS, timeout=TRANSCODE_TIMEOUT
+)
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking I/O-bound function in the thread pool"""
+    return await io_pool.run(func, *args, **kwargs)
+
+
+async def run_drive(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking Google Drive call in its own thread pool"""
+    return await drive_pool.run(func, *args, **kwargs)
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run CPU-heavy function in the process pool. func and args must be picklable"""
+    return await cpu_pool.run(func, *args, **kwargs)
+
+
+async def run_transcode(
+    func: Callable[..., T], *args: Any, timeout: float | None = None, **kwargs: Any
+) -> T:
+    """Run yt-dlp/ffmpeg job in a transcode worker, JobTimeoutError after timeout (TRANSCODE_TIMEOUT by default)"""
+    return await transcode_pool.run(func, *args, timeout=timeout, **kwargs)
+
+
+def get_executor_stats() -> dict:
+    return {
+        pool.name: pool.stats()
+        for pool in (io_pool, drive_pool, cpu_pool, transcode_pool)
+    }
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    for pool in (io_pool, drive_pool, cpu_pool, transcode_pool):
+        pool.shutdown(wait=wait)
+
+
+async def watch_loop_lag(interval: float = 1.0, threshold: float = 0.25) -> None:
+    """Warn when something blocks the event loop, i.e. dispatcher stops answering"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - started - interval
+        if lag > threshold:
+            logger.warning(
+                "Event loop was blocked for %.2fs, pools: %s", lag, get_executor_stats()
+            )
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+# job files live next to the disk cache, so moving them into the cache is a rename
+DOWNLOAD_TMP_DIR = os.getenv("DOWNLOAD_TMP_DIR", os.path.join("downloads", "tmp"))
+CHUNK_SIZE = 64 * 1024
+
+
+def new_temp_path(suffix: str = ".mp3") -> str:
+    """Create empty temp file for a job and return its path. Caller must remove it"""
+    os.makedirs(DOWNLOAD_TMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=DOWNLOAD_TMP_DIR, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def new_temp_dir() -> tempfile.TemporaryDirectory:
+    os.makedirs(DOWNLOAD_TMP_DIR, exist_ok=True)
+    return tempfile.TemporaryDirectory(dir=DOWNLOAD_TMP_DIR)
+
+
+def remove_file(path: str | None) -> None:
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard link src to dst (no data copied), fall back to copy across file systems"""
+    remove_file(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def move_file(src: str, dst: str) -> None:
+    """Atomically replace dst with src"""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # different file systems: copy next to dst first, then rename
+        tmp_path = dst + ".tmp"
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+        remove_file(src)
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+
+class InFlightUpdates(BaseMiddleware):
+    """Outer middleware counting updates being handled, so shutdown can wait for running downloads"""
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until all updates are handled. Returns False if some are still running after timeout"""
+        if self.count:
+            logger.info(f"Waiting for {self.count} updates in progress...")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.count} updates were not finished in {timeout}s")
+            return False
@@ -0,0 +1,129 @@
+import re
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from aiogram.types import MessageEntity
+
+# links are also recognized without scheme, e.g. "youtu.be/dQw4w9WgXcQ"
+URL_RE = re.compile(
+    r"(?<![\w@.-])(?:https?://)?(?:[\w-]+\.)*"
+    r"(?:soundcloud\.com|snd\.sc|youtube\.com|youtube-nocookie\.com|youtu\.be)"
+    r"(?![\w-])(?:/[^\s<>\"']*)?",
+    re.IGNORECASE,
+)
+YOUTUBE_HOSTS = {
+    "youtube.com",
+    "www.youtube.com",
+    "m.youtube.com",
+    "music.youtube.com",
+    "youtube-nocookie.com",
+    "www.youtube-nocookie.com",
+}
+YOUTUBE_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+YOUTUBE_PLAYLIST_ID_RE = re.compile(r"[A-Za-z0-9_-]+")
+# path prefixes followed by video id: youtube.com/shorts/<id>
+YOUTUBE_ID_PATHS = {"shorts", "embed", "live", "v"}
+SOUNDCLOUD_HOSTS = {"soundcloud.com", "www.soundcloud.com", "m.soundcloud.com"}
+# short links are random codes, the track behind them is known only after a redirect
+SOUNDCLOUD_SHORT_HOSTS = {"on.soundcloud.com", "snd.sc"}
+# pages under these paths are not tracks or playlists
+SOUNDCLOUD_RESERVED_PATHS = {"discover", "search", "stream", "upload", "you"}
+
+
+@dataclass(frozen=True)
+class Link:
+    source: str
+    # the same track has the same url whatever form the user sent
+    url: str
+    kind: str = "track"
+    # known without any request, e.g. youtube video id
+    track_id: str | None = None
+
+
+def _youtube_link(host: str, path: str, query: dict) -> Link | None:
+    segments = [s for s in path.split("/") if s]
+    video_id = None
+    if host == "youtu.be":
+        video_id = segments[0] if segments else None
+    elif segments == ["watch"]:
+        video_id = query.get("v", [None])[0]
+    elif len(segments) >= 2 and segments[0] in YOUTUBE_ID_PATHS:
+        video_id = segments[1]
+    if video_id and YOUTUBE_ID_RE.fullmatch(video_id):
+        return Link(
+            source="youtube",
+            url=f"https://www.youtube.com/watch?v={video_id}",
+            track_id=video_id,
+        )
+
+    playlist_id = query.get("list", [None])[0]
+    if playlist_id and YOUTUBE_PLAYLIST_ID_RE.fullmatch(playlist_id):
+        return Link(
+            source="youtube",
+            url=f"https://www.youtube.com/playlist?{urlencode({'list': playlist_id})}",
+            kind="playlist",
+        )
+    return None
+
+
+def _soundcloud_link(host: str, path: str, query: dict) -> Link | None:
+    segments = [s for s in path.split("/") if s]
+    if not segments:
+        return None
+    if host in SOUNDCLOUD_SHORT_HOSTS:
+        # codes are case sensitive, only the host is normalized
+        return Link(source="soundcloud", url=f"https://{host}/{segments[0]}")
+    if segments[0].lower() in SOUNDCLOUD_RESERVED_PATHS or len(segments) < 2:
+        return None
+
+    # permalinks are lowercase, secret tokens of private tracks are not
+    segments = [s if s.startswith("s-") else s.lower() for s in segments]
+    url = "https://soundcloud.com/" + "/".join(segments)
+    # private tracks shared with ?secret_token=, every other parameter is tracking
+    if "secret_token" in query:
+        url += "?" + urlencode({"secret_token": query["secret_token"][0]})
+    kind = "playlist" if "sets" in segments[1:2] else "track"
+    return Link(source="soundcloud", url=url, kind=kind)
+
+
+def canonical_link(url: str) -> Link | None:
+    """
+    Canonical form of a YouTube or SoundCloud link, without any request.
+    Tracking parameters, m./www. hosts and alternative YouTube forms are normalized
+    """
+    if "://" not in url:
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    query = parse_qs(parts.query)
+    if host in YOUTUBE_HOSTS or host == "youtu.be":
+        return _youtube_link(host, parts.path, query)
+    if host in SOUNDCLOUD_HOSTS or host in SOUNDCLOUD_SHORT_HOSTS:
+        return _soundcloud_link(host, parts.path, query)
+    return None
+
+
+def find_links(text: str, entities: list[MessageEntity] | None = None) -> list[Link]:
+    """
+    Supported links of a message in the order they appear, including urls hidden
+    behind text links. Different forms of the same link are returned once
+    """
+    found = [
+        (match.start(), match.group(0).rstrip(".,;:!?)]"))
+        for match in URL_RE.finditer(text)
+    ]
+    # entity offsets are in UTF-16 units, close enough to keep the order
+    found += [
+        (entity.offset, entity.url)
+        for entity in entities or []
+        if entity.type == "text_link" and entity.url
+    ]
+    links: dict[str, Link] = {}
+    for _, url in sorted(found, key=lambda item: item[0]):
+        link = canonical_link(url)
+        if link is not None:
+            links.setdefault(link.url, link)
+    return list(links.values())
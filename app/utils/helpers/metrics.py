@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable
+
+# metrics are collected only when the endpoint is enabled, otherwise every call is a no-op
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+enabled = METRICS_PORT is not None
+
+STAGE_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not enabled:
+            return
+        self._values[tuple(labels[name] for name in self.labels)] += amount
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # per label set: counts per bucket (last one is +Inf), sum
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels) -> None:
+        if not enabled:
+            return
+        key = tuple(labels[name] for name in self.labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {self._sums[key]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "bot_stage_seconds", "Duration of request pipeline stages", ("stage", "source")
+)
+stage_errors = Counter(
+    "bot_stage_errors_total", "Stages which raised an exception", ("stage", "source")
+)
+requests_total = Counter(
+    "bot_requests_total", "Handled links by outcome", ("source", "result")
+)
+cache_lookups = Counter(
+    "bot_cache_lookups_total", "Cache lookups per tier", ("tier", "result")
+)
+bytes_total = Counter("bot_bytes_total", "Bytes transferred", ("source", "direction"))
+
+_metrics = [stage_seconds, stage_errors, requests_total, cache_lookups, bytes_total]
+# name -> (label, stats function returning {label value: {field: number}})
+_gauges: dict[str, tuple[str, Callable[[], dict]]] = {}
+
+
+class _StageTimer:
+    __slots__ = ("stage", "source", "started")
+
+    def __init__(self, stage: str, source: str):
+        self.stage = stage
+        self.source = source
+
+    def __enter__(self) -> "_StageTimer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        stage_seconds.observe(
+            time.perf_counter() - self.started, stage=self.stage, source=self.source
+        )
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            stage_errors.inc(stage=self.stage, source=self.source)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_noop_timer = _NoopTimer()
+
+
+def stage_timer(stage: str, source: str) -> _StageTimer | _NoopTimer:
+    """Time a block of a request pipeline, an exception inside counts as stage error"""
+    if not enabled:
+        return _noop_timer
+    return _StageTimer(stage, source)
+
+
+def record_request(source: str, result: str, started: float) -> None:
+    """Outcome and total duration of one handled link, started is time.perf_counter()"""
+    requests_total.inc(source=source, result=result)
+    stage_seconds.observe(time.perf_counter() - started, stage="request", source=source)
+
+
+def register_gauges(name: str, label: str, stats: Callable[[], dict]) -> None:
+    """Export numbers of an existing stats function, read on every scrape"""
+    _gauges[name] = (label, stats)
+
+
+def _collect_gauges(name: str, label: str, stats: dict) -> list[str]:
+    series = defaultdict(list)
+    for label_value, fields in stats.items():
+        for field, value in fields.items():
+            if isinstance(value, (int, float)):
+                series[field].append(
+                    f'{name}_{field}{{{label}="{_escape(label_value)}"}} {value}'
+                )
+    lines = []
+    for field, samples in series.items():
+        lines.append(f"# TYPE {name}_{field} gauge")
+        lines.extend(samples)
+    return lines
+
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    for name, (label, stats) in _gauges.items():
+        lines.extend(_collect_gauges(name, label, stats()))
+    return "\n".join(lines) + "\n"
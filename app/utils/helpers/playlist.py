@@ -0,0 +1,164 @@
+import asyncio
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from aiogram.types import Message
+
+from app.utils.database.models import File
+from app.utils.database.requests import get_file_by_track_id
+from app.utils.helpers.files import remove_file
+from app.utils.helpers.telegram import (
+    get_user_id,
+    remember_telegram_file,
+    reply_with_audio_file,
+    reply_with_cached_audio,
+)
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# tracks of one playlist prepared at the same time, it also works as per-user cap for playlists
+PLAYLIST_WINDOW = int(os.getenv("PLAYLIST_WINDOW", "3"))
+PLAYLIST_MAX_TRACKS = int(os.getenv("PLAYLIST_MAX_TRACKS", "50"))
+# telegram limits how often a message can be edited
+PROGRESS_EDIT_INTERVAL = 1.0
+
+FetchTrack = Callable[[Any], Awaitable[tuple[str, File]]]
+
+_active_users: set[int] = set()
+
+
+@dataclass
+class PlaylistItem:
+    track: Any
+    track_id: str
+
+
+@dataclass
+class _PreparedTrack:
+    record: File | None
+    path: str | None = None
+
+
+class PlaylistProgress:
+    """One status message edited as tracks are sent, instead of a message per track"""
+
+    def __init__(self, status_message: Message, title: str, total: int):
+        self.status_message = status_message
+        self.title = title
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self._edited_at = 0.0
+
+    def text(self) -> str:
+        text = f"{self.title}: sent {self.sent} of {self.total} tracks"
+        if self.failed:
+            text += f", {self.failed} failed"
+        return text
+
+    async def update(self, force: bool = False) -> None:
+        now = asyncio.get_running_loop().time()
+        if not force and now - self._edited_at < PROGRESS_EDIT_INTERVAL:
+            return
+        self._edited_at = now
+        try:
+            await self.status_message.edit_text(self.text())
+        except Exception as e:
+            logger.warning("Failed to update playlist progress: %s", e)
+
+
+async def _prepare(source: str, item: PlaylistItem, fetch: FetchTrack):
+    record = await get_file_by_track_id(source=source, track_id=item.track_id)
+    if record is not None and record.tg_file_id:
+        return _PreparedTrack(record=record)
+    path, record = await fetch(item.track)
+    return _PreparedTrack(record=record, path=path)
+
+
+async def _send(
+    message: Message,
+    source: str,
+    item: PlaylistItem,
+    prepared: _PreparedTrack,
+    fetch: FetchTrack,
+) -> None:
+    if prepared.path is None:
+        if await reply_with_cached_audio(message=message, cached_file=prepared.record):
+            return
+        # telegram rejected file_id, upload the file itself
+        prepared.path, prepared.record = await fetch(item.track)
+    sent_message = await reply_with_audio_file(
+        message=message, path=prepared.path, record=prepared.record
+    )
+    await remember_telegram_file(
+        source=source, track_id=item.track_id, sent_message=sent_message
+    )
+
+
+async def _discard(tasks: list[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, _PreparedTrack):
+            remove_file(result.path)
+
+
+async def send_playlist(
+    message: Message,
+    status_message: Message,
+    source: str,
+    title: str,
+    items: list[PlaylistItem],
+    fetch: FetchTrack,
+    quiet: bool = False,
+) -> str:
+    """
+    Prepare up to PLAYLIST_WINDOW tracks at once through the usual cache/download path
+    and send them in playlist order, each one as soon as it and all tracks before it are ready.
+    fetch(track) returns (path, record) like get_sc_file/get_yt_file.
+    Returns "sent" if any track was sent, "failed" if none, "rejected" if the user has a playlist in progress
+    """
+    user_id = get_user_id(message)
+    if user_id in _active_users:
+        if not quiet:
+            await message.answer(
+                "You already have a playlist in progress. Please wait until it finishes ⏳"
+            )
+        await status_message.delete()
+        return "rejected"
+
+    _active_users.add(user_id)
+    progress = PlaylistProgress(status_message, title=title, total=len(items))
+    pending: deque[tuple[PlaylistItem, asyncio.Task]] = deque()
+
+    async def send_next() -> None:
+        item, task = pending.popleft()
+        prepared = None
+        try:
+            prepared = await task
+            await _send(message, source, item, prepared, fetch)
+            progress.sent += 1
+        except Exception as e:
+            logger.error("Failed to send playlist track %s: %s", item.track_id, e)
+            progress.failed += 1
+        finally:
+            if prepared is not None:
+                remove_file(prepared.path)
+        await progress.update()
+
+    try:
+        await progress.update(force=True)
+        for item in items:
+            pending.append((item, asyncio.create_task(_prepare(source, item, fetch))))
+            if len(pending) >= PLAYLIST_WINDOW:
+                await send_next()
+        while pending:
+            await send_next()
+        await progress.update(force=True)
+    finally:
+        _active_users.discard(user_id)
+        await _discard([task for _, task in pending])
+    return "sent" if progress.sent else "failed"
@@ -0,0 +1,151 @@
+import asyncio
+import os
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+# enough for every transcode worker to be busy
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", str(max(4, os.cpu_count() or 1))))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "50"))
+DOWNLOAD_USER_LIMIT = int(os.getenv("DOWNLOAD_USER_LIMIT", "3"))
+CACHE_WORKERS = int(os.getenv("CACHE_WORKERS", "16"))
+
+
+class QueueFullError(Exception):
+    def __init__(self, queued: int):
+        super().__init__(f"Download queue is full, {queued} jobs are waiting")
+        self.queued = queued
+
+
+class UserLimitError(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"User already has {limit} jobs in progress")
+        self.limit = limit
+
+
+class DownloadScheduler:
+    """
+    FIFO job queue with a bounded number of workers, per-user caps and a queue depth limit.
+    Jobs are not accepted when the queue is full, so a burst of links can't pile up unbounded.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int, per_user: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.busy = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._user_jobs: Counter = Counter()
+        self.jobs_done = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # slot is handed over directly, busy count stays the same
+                waiter.set_result(None)
+                return
+        self.busy -= 1
+
+    async def _acquire(self, on_queued: Callable[[int], Awaitable] | None) -> None:
+        if self.busy < self.workers and not self._waiters:
+            self.busy += 1
+            return
+
+        if self.queued >= self.max_queue:
+            raise QueueFullError(queued=self.queued)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(self.queued)
+                except Exception as e:
+                    logger.error("Failed to report queue position: %s", e)
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # slot was already handed to us, pass it on
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: int | None = None,
+        on_queued: Callable[[int], Awaitable] | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        Wait for a free worker. on_queued is called with queue position when job has to wait.
+        Raises UserLimitError or QueueFullError instead of accepting more work.
+        """
+        if user_id is not None and self._user_jobs[user_id] >= self.per_user:
+            raise UserLimitError(limit=self.per_user)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self._user_jobs[user_id] += 1
+        try:
+            await self._acquire(on_queued)
+            waited = loop.time() - started
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited > 1:
+                logger.info(f"Job waited {waited:.1f}s in {self.name} queue")
+            try:
+                yield
+            finally:
+                self.jobs_done += 1
+                self._release()
+        finally:
+            self._user_jobs[user_id] -= 1
+            if self._user_jobs[user_id] <= 0:
+                del self._user_jobs[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "occupancy": self.busy / self.workers,
+            "queued": self.queued,
+            "jobs_done": self.jobs_done,
+            "wait_avg": self.wait_total / self.jobs_done if self.jobs_done else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+# cold downloads/transcodes and cache hits have separate lanes,
+# so hits are never stuck behind slow youtube transcodes
+download_lane = DownloadScheduler(
+    name="download",
+    workers=DOWNLOAD_WORKERS,
+    max_queue=DOWNLOAD_QUEUE_SIZE,
+    per_user=DOWNLOAD_USER_LIMIT,
+)
+cache_lane = DownloadScheduler(
+    name="cache",
+    workers=CACHE_WORKERS,
+    max_queue=DOWNLOAD_QUEUE_SIZE * 4,
+    per_user=DOWNLOAD_USER_LIMIT * 4,
+)
+
+
+def get_scheduler_stats() -> dict:
+    return {lane.name: lane.stats() for lane in (download_lane, cache_lane)}
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Awaitable, Callable, TypeVar
+
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution"""
+
+    def __init__(self):
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._in_flight
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        First caller for key runs func, every concurrent caller awaits its result.
+        Entry is removed as soon as func finishes, so the registry only holds running calls.
+        If the first caller is cancelled, a waiting caller takes over and runs func itself.
+        """
+        while (future := self._in_flight.get(key)) is not None:
+            logger.info(f"Join in-flight request for {key}")
+            try:
+                # shield: cancelling one waiter must not cancel the result for the others
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # only the first caller was cancelled, not this one: run func again
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark exception as retrieved, the first caller re-raises it below
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+
+track_requests: SingleFlight = SingleFlight()
+
+
+def track_key(source: str, track_id: Any) -> str:
+    return f"{source}:{track_id}"
@@ -0,0 +1,120 @@
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, FSInputFile, Message
+
+from app.utils.database.models import File
+from app.utils.database.requests import clear_telegram_file_ids, set_telegram_file_ids
+from app.utils.helpers.access_stats import record_cache_hit
+from app.utils.helpers.metrics import bytes_total, cache_lookups, stage_timer
+from app.utils.helpers.scheduler import QueueFullError, UserLimitError
+from logging_config import get_app_logger
+
+logger = get_app_logger(name=__name__)
+
+
+async def reply_with_cached_audio(message: Message, cached_file: File | None) -> bool:
+    """
+    Resend audio which was already uploaded to Telegram by its file_id.
+    Returns False if there is no file_id or Telegram rejected it, so caller should send the file itself.
+    """
+    if cached_file is None or not cached_file.tg_file_id:
+        cache_lookups.inc(tier="telegram", result="miss")
+        return False
+    try:
+        with stage_timer("telegram_send", cached_file.source):
+            await message.reply_audio(audio=cached_file.tg_file_id)
+        logger.info(f"Sent {cached_file.track_id} by telegram file_id")
+        cache_lookups.inc(tier="telegram", result="hit")
+        record_cache_hit(source=cached_file.source, track_id=cached_file.track_id)
+        return True
+    except TelegramBadRequest as e:
+        logger.warning("Telegram rejected file_id for %s: %s", cached_file.track_id, e)
+        cache_lookups.inc(tier="telegram", result="rejected")
+        await clear_telegram_file_ids(
+            source=cached_file.source, track_id=cached_file.track_id
+        )
+        return False
+
+
+async def reply_with_audio_file(message: Message, path: str, record: File) -> Message:
+    """
+    Upload audio file to Telegram. Thumbnail, duration and tags come from the db record,
+    so the mp3 itself is never parsed on send
+    """
+    thumbnail = None
+    if record.thumb:
+        thumbnail = BufferedInputFile(record.thumb, filename="cover.jpg")
+    with stage_timer("telegram_upload", record.source):
+        sent_message = await message.reply_audio(
+            audio=FSInputFile(path=path, filename=record.filename),
+            thumbnail=thumbnail,
+            duration=record.duration,
+            performer=record.performer,
+            title=record.title,
+        )
+    bytes_total.inc(record.size or 0, source=record.source, direction="telegram_upload")
+    return sent_message
+
+
+async def remember_telegram_file(
+    source: str, track_id: str, sent_message: Message
+) -> None:
+    """Save file_id of sent audio, so next time it can be resent without upload"""
+    audio = sent_message.audio
+    if audio is None:
+        return
+    thumb_file_id = audio.thumbnail.file_id if audio.thumbnail else None
+    await set_telegram_file_ids(
+        source=source,
+        track_id=track_id,
+        tg_file_id=audio.file_id,
+        tg_thumb_file_id=thumb_file_id,
+    )
+
+
+class _SilentStatus:
+    """Status of one link in a batch, the batch shows its own progress message"""
+
+    async def edit_text(self, text: str, **kwargs) -> None:
+        pass
+
+    async def delete(self, **kwargs) -> None:
+        pass
+
+
+async def answer_status(
+    message: Message, text: str, quiet: bool = False
+) -> Message | _SilentStatus:
+    """Status message which is edited while the link is processed"""
+    if quiet:
+        return _SilentStatus()
+    return await message.answer(text)
+
+
+def get_user_id(message: Message) -> int:
+    return message.from_user.id if message.from_user else message.chat.id
+
+
+def queue_position_reporter(
+    status_message: Message,
+) -> Callable[[int], Awaitable]:
+    async def report(position: int) -> None:
+        await status_message.edit_text(
+            f"Your track is in the queue, position {position}. Please wait..."
+        )
+
+    return report
+
+
+async def answer_scheduler_error(
+    message: Message, error: QueueFullError | UserLimitError
+) -> None:
+    if isinstance(error, UserLimitError):
+        await message.answer(
+            f"You already have {error.limit} downloads in progress. Please wait until they finish ⏳"
+        )
+    else:
+        await message.answer(
+            f"Download queue is full right now ({error.queued} tracks waiting). Please try again in a minute ⏳"
+        )
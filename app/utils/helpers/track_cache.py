@@ -0,0 +1,63 @@
+import os
+
+from app.utils.helpers.disk_cache import DiskCache
+from app.utils.helpers.executors import run_io
+from app.utils.helpers.files import new_temp_path, remove_file
+from app.utils.helpers.metrics import cache_lookups
+
+DISK_CACHE_DIR = os.getenv("DISK_CACHE_DIR", os.path.join("downloads", "cache"))
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(5 * 1024**3)))
+
+disk_tier = DiskCache(directory=DISK_CACHE_DIR, max_bytes=DISK_CACHE_MAX_BYTES)
+
+tier_stats = {tier: {"hits": 0, "misses": 0} for tier in ("disk", "drive")}
+
+
+def _count(tier: str, hit: bool) -> None:
+    tier_stats[tier]["hits" if hit else "misses"] += 1
+    cache_lookups.inc(tier=tier, result="hit" if hit else "miss")
+
+
+async def has_local_track(key: str) -> bool:
+    found = await run_io(disk_tier.contains, key)
+    _count("disk", found)
+    return found
+
+
+async def is_local_track(key: str) -> bool:
+    """Same as has_local_track, but doesn't count as a cache lookup"""
+    return await run_io(disk_tier.contains, key)
+
+
+async def store_track(key: str, path: str) -> None:
+    """Move finished track file into the disk cache"""
+    await run_io(disk_tier.put_file, key, path)
+
+
+async def checkout_track(key: str) -> str:
+    """Return path to a private copy (hard link) of cached track. Caller must remove it"""
+    path = new_temp_path()
+    if not await run_io(disk_tier.link_to, key, path):
+        remove_file(path)
+        raise FileNotFoundError(f"{key} is not in the disk cache")
+    return path
+
+
+async def drop_track(key: str) -> None:
+    """Remove track from the disk cache, e.g. when its db row is deleted"""
+    await run_io(disk_tier.discard, key)
+
+
+def record_drive_lookup(hit: bool) -> None:
+    _count("drive", hit)
+
+
+def get_cache_stats() -> dict:
+    return {
+        "tiers": {tier: dict(counts) for tier, counts in tier_stats.items()},
+        "disk_bytes": disk_tier.size,
+    }
+
+
+def flush_track_cache() -> None:
+    disk_tier.flush()
@@ -1,6 +1,5 @@
-import requests
+import os
 from datetime import datetime
-from io import BytesIO
 from mutagen.id3._frames import TIT2, TPE1, TALB, TYER, APIC, TCON
 from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4, MP4Cover
@@ -10,10 +9,16 @@ from logging_config import get_app_logger
 logger = get_app_logger(name=__name__)
 
 
+def get_artwork_url(track_info: dict) -> str:
+    return track_info.get("artwork_url", "") or track_info.get("thumbnail", "") or ""
+
+
 def add_metadata(
-    audio_file: BytesIO,
+    audio_path: str,
     track_info: dict,
-) -> BytesIO | None:
+    cover_bytes: bytes | None = None,
+) -> bool:
+    """Write tags and already downloaded cover to mp3 file in place"""
     try:
         title = track_info.get("title", "") or ""
         genre = track_info.get("genre", "") or ""
@@ -33,26 +38,12 @@ def add_metadata(
         except ValueError:
             year = track_info.get("year", "") or ""
 
-        artwork_url = (
-            track_info.get("artwork_url", "") or track_info.get("thumbnail", "") or ""
-        )
-
-        cover_bytes = None
-        if artwork_url:
-            # download cover
-            response = requests.get(artwork_url)
-            response.raise_for_status()
-
-            cover_bytes = BytesIO(response.content).read()
-
-        audio_file.seek(0)
-
-        mp3 = MP3(fileobj=audio_file)
+        mp3 = MP3(audio_path)
         if mp3.tags is None:
             mp3.add_tags()
 
         if mp3.tags is None:
-            return
+            return False
 
         mp3.tags.add(TIT2(encoding=3, text=title))
         mp3.tags.add(TPE1(encoding=3, text=artist))
@@ -71,21 +62,26 @@ def add_metadata(
                 )
             )
 
-        mp3.save(fileobj=audio_file)
-        audio_file.seek(0)
-        return audio_file
+        mp3.save()
+        return True
     except Exception as e:
         logger.error("Failed to add metadata: %s", e)
-
-
-def get_cover(audio_bytes: bytes) -> bytes | None:
-    try:
-        audio_file = BytesIO(audio_bytes)
-        mp3 = MP3(fileobj=audio_file)
-        if mp3.tags is None:
-            return
-        apic = mp3.tags.get("APIC:Cover")
-
-        return apic.data if apic else None
-    except Exception as e:
-        logger.error("(mp3) Failed to get cover: %s", e)
+        return False
+
+
+def get_audio_details(audio_path: str) -> dict:
+    """Read everything needed to send the file once at ingest, so sends never parse mp3"""
+    mp3 = MP3(audio_path)
+    tags = mp3.tags or {}
+    title = tags.get("TIT2")
+    performer = tags.get("TPE1")
+    apic = tags.get("APIC:Cover")
+
+    return {
+        "title": str(title) if title else None,
+        "performer": str(performer) if performer else None,
+        "duration": int(round(mp3.info.length)),
+        "bitrate": int(mp3.info.bitrate // 1000),
+        "size": os.path.getsize(audio_path),
+        "cover": apic.data if apic else None,
+    }
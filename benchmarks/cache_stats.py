@@ -0,0 +1,148 @@
+"""
+Cost of recording cache hits with a commit per hit vs buffered hits written
+in one batch, then Drive eviction: tracks are downloaded and uploaded to the
+Drive stub, requested again with a skewed (Zipf) popularity, and the Drive
+folder is cut to --budget files. Reports which share of the hits the kept
+files had and prints the cache report.
+
+    python -m benchmarks.cache_stats --rows 100000 --hits 2000 --tracks 40 --budget 20
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.e2e import Bench, configure_env, track_url
+from benchmarks.stubs import start_stubs
+
+WORKDIR = tempfile.mkdtemp(prefix="bench-stats-")
+
+
+def fill(rows: int) -> None:
+    conn = sqlite3.connect(f"{WORKDIR}/db.sqlite3")
+    conn.executemany(
+        "INSERT INTO files (source, filename, track_id, hits, downloads) VALUES (?, ?, ?, 0, 1)",
+        (("bench", f"{i}.mp3", str(i)) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def measure_hit_writes(args: argparse.Namespace) -> None:
+    from datetime import datetime
+
+    from app.utils.database.requests import add_file_hits
+    from app.utils.helpers.access_stats import access_stats
+
+    fill(args.rows)
+    track_ids = [str(random.randrange(args.rows)) for _ in range(args.hits)]
+
+    started = time.perf_counter()
+    for track_id in track_ids:
+        await add_file_hits(
+            [
+                {
+                    "source": "bench",
+                    "track_id": track_id,
+                    "hits": 1,
+                    "last_accessed": datetime.now(),
+                }
+            ]
+        )
+    per_hit = (time.perf_counter() - started) / len(track_ids)
+
+    started = time.perf_counter()
+    for track_id in track_ids:
+        access_stats.record_hit(source="bench", track_id=track_id)
+    await access_stats.flush()
+    batched = (time.perf_counter() - started) / len(track_ids)
+    print(
+        f"commit per hit {per_hit * 1e6:8.0f} us/hit"
+        f"  batched {batched * 1e6:6.1f} us/hit  {per_hit / batched:6.0f}x cheaper"
+    )
+
+    conn = sqlite3.connect(f"{WORKDIR}/db.sqlite3")
+    conn.execute("DELETE FROM files WHERE source = 'bench'")
+    conn.commit()
+    conn.close()
+
+
+async def measure_eviction(bench: Bench, args: argparse.Namespace) -> None:
+    from app.utils.api import drive_eviction
+    from app.utils.database.requests import get_cache_report, get_file_by_track_id
+    from app.utils.helpers.access_stats import flush_access_stats
+    from cache_report import print_report
+
+    track_ids = list(range(1, args.tracks + 1))
+    await bench.replay("cold", [track_url(i) for i in track_ids], concurrency=8)
+    await bench.wait_for_uploads()
+
+    # a few popular tracks get most of the requests
+    weights = [1 / rank**args.zipf for rank in track_ids]
+    picks = random.choices(track_ids, weights=weights, k=args.requests)
+    await bench.replay("hot", [track_url(i) for i in picks], concurrency=8)
+    await flush_access_stats()
+    print()
+    print_report(await get_cache_report())
+
+    hits = {i: picks.count(i) for i in track_ids}
+    drive_eviction.DRIVE_MAX_FILES = args.budget
+    drive_eviction.DRIVE_EVICTION_POLICY = args.policy
+    started = time.perf_counter()
+    deleted, freed = await drive_eviction.evict_drive_files()
+    elapsed = time.perf_counter() - started
+
+    kept = [
+        i
+        for i in track_ids
+        if await get_file_by_track_id(source="soundcloud", track_id=str(i))
+    ]
+    stubs = await bench.stub_stats()
+    kept_share = sum(hits[i] for i in kept) / max(1, sum(hits.values()))
+    best_share = sum(sorted(hits.values(), reverse=True)[: args.budget]) / max(
+        1, sum(hits.values())
+    )
+    print(
+        f"\n{args.policy}: evicted {deleted} files ({freed / 1024**2:.1f} MB) in {elapsed:.2f}s,"
+        f" {stubs['drive_files']} left in drive"
+        f"\nkept files had {kept_share:.0%} of hits, the best {args.budget} had {best_share:.0%}"
+    )
+    print()
+    print_report(await get_cache_report())
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--hits", type=int, default=2000)
+    parser.add_argument("--tracks", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--zipf", type=float, default=1.0)
+    parser.add_argument("--budget", type=int, default=20, help="Drive files to keep")
+    parser.add_argument("--policy", choices=["lru", "lfu"], default="lfu")
+    parser.add_argument("--size-mb", type=float, default=1)
+    args = parser.parse_args()
+
+    stubs, base = start_stubs(
+        size=int(args.size_mb * 1024**2), large_size=int(args.size_mb * 1024**2)
+    )
+    configure_env(base, WORKDIR)
+    bench = Bench(base, args)
+    await bench.start()
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith(("app.", "aiogram")):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    try:
+        await measure_hit_writes(args)
+        await measure_eviction(bench, args)
+    finally:
+        await bench.stop()
+        stubs.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
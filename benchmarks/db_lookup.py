@@ -0,0 +1,82 @@
+"""
+Cache lookups by (source, track_id) in a files table with many rows,
+with and without the unique index.
+
+    python -m benchmarks.db_lookup --rows 1000000 --lookups 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench-db-"), "db.sqlite3")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from app.utils.database.models import engine
+from app.utils.database.requests import get_file_by_track_id, init_db
+
+
+def fill(rows: int) -> None:
+    conn = sqlite3.connect(DB_PATH)
+    batch = []
+    for i in range(rows):
+        source, track_id = (
+            ("soundcloud", str(i)) if i % 2 else ("youtube", f"v{i:010d}")
+        )
+        batch.append((source, f"{track_id}.mp3", track_id, f"drive-{i}"))
+        if len(batch) == 50_000:
+            conn.executemany(
+                "INSERT INTO files (source, filename, track_id, drive_file_id) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            batch.clear()
+    if batch:
+        conn.executemany(
+            "INSERT INTO files (source, filename, track_id, drive_file_id) VALUES (?, ?, ?, ?)",
+            batch,
+        )
+    conn.commit()
+    conn.close()
+
+
+async def measure(name: str, keys: list[tuple[str, str]]) -> None:
+    started = time.perf_counter()
+    for source, track_id in keys:
+        await get_file_by_track_id(source=source, track_id=track_id)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>10}: {elapsed / len(keys) * 1e6:,.0f} us/lookup")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    await init_db()
+    fill(args.rows)
+    print(f"{args.rows:,} rows in {DB_PATH}")
+
+    rng = random.Random(0)
+    keys = []
+    for _ in range(args.lookups):
+        i = rng.randrange(args.rows)
+        keys.append(("soundcloud", str(i)) if i % 2 else ("youtube", f"v{i:010d}"))
+
+    await measure("indexed", keys)
+
+    await engine.dispose()
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("DROP INDEX uq_files_source_track_id")
+    conn.close()
+    # full scans are slow, a few of them are enough
+    await measure("no index", keys[: max(1, args.lookups // 100)])
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
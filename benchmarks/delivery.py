@@ -0,0 +1,229 @@
+"""
+Update-to-handler latency of long polling vs webhook delivery. A local
+Telegram Bot API stub queues updates for getUpdates, in webhook mode the
+same updates are POSTed to the bot's webhook app like Telegram does. Every
+update carries the time it "arrived at Telegram", the handler records how
+long it took to reach it. --latency-ms delays every stub response and every
+webhook request to simulate the network between Telegram and the bot.
+
+    python -m benchmarks.delivery --updates 2000 --rate 200 --latency-ms 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import ClientSession, web
+
+from app.utils.api.webhook import create_webhook_app
+
+TOKEN = "42:benchmark"
+SECRET = "benchmark-secret"
+WEBHOOK_PATH = "/webhook"
+BOT_USER = {
+    "id": 42,
+    "is_bot": True,
+    "first_name": "Benchmark",
+    "username": "bench_bot",
+}
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "text": repr(time.perf_counter()),
+        },
+    }
+
+
+class TelegramStub:
+    """getMe, getUpdates with long polling and webhook methods"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.updates: list[dict] = []
+        self.new_updates = asyncio.Event()
+        self.get_updates_calls = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, update: dict) -> None:
+        self.updates.append(update)
+        self.new_updates.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields = dict(await request.post())
+        if method == "getUpdates":
+            result = await self.get_updates(
+                int(fields.get("offset", 0)), float(fields.get("timeout", 0))
+            )
+        elif method == "getMe":
+            result = BOT_USER
+        else:
+            result = True
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_updates(self, offset: int, timeout: float) -> list[dict]:
+        self.get_updates_calls += 1
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+
+class Recorder:
+    def __init__(self, expected: int, work: float):
+        self.expected = expected
+        self.work = work
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+
+    def dispatcher(self) -> Dispatcher:
+        router = Router()
+
+        @router.message()
+        async def record(message: Message) -> None:
+            self.latencies.append(time.perf_counter() - float(message.text))
+            if self.work:
+                # handler keeps running, delivery of the next updates must not wait for it
+                await asyncio.sleep(self.work)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        return dp
+
+
+async def serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def produce(count: int, rate: float, deliver) -> None:
+    started = time.perf_counter()
+    for update_id in range(1, count + 1):
+        delay = started + update_id / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        deliver(make_update(update_id))
+
+
+async def run_polling(args, recorder: Recorder) -> dict:
+    stub = TelegramStub(args.latency_ms / 1000)
+    runner, base = await serve(stub.app())
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    dp = recorder.dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    try:
+        started = time.perf_counter()
+        await produce(args.updates, args.rate, stub.push)
+        await asyncio.wait_for(recorder.done.wait(), timeout=60)
+        elapsed = time.perf_counter() - started
+    finally:
+        await dp.stop_polling()
+        await polling
+        await runner.cleanup()
+    return {"elapsed": elapsed, "get_updates_calls": stub.get_updates_calls}
+
+
+async def run_webhook(args, recorder: Recorder) -> dict:
+    stub = TelegramStub(args.latency_ms / 1000)
+    stub_runner, base = await serve(stub.app())
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    dp = recorder.dispatcher()
+    runner, webhook_base = await serve(
+        create_webhook_app(dp, bot, path=WEBHOOK_PATH, secret=SECRET)
+    )
+    url = f"{webhook_base}{WEBHOOK_PATH}"
+    latency = args.latency_ms / 1000
+    posts: set[asyncio.Task] = set()
+
+    async with ClientSession() as client:
+        async with client.post(url, json=make_update(0)) as response:
+            rejected = response.status
+
+        async def post(update: dict) -> None:
+            if latency:
+                await asyncio.sleep(latency)
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            async with client.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+
+        def deliver(update: dict) -> None:
+            task = asyncio.create_task(post(update))
+            posts.add(task)
+            task.add_done_callback(posts.discard)
+
+        try:
+            started = time.perf_counter()
+            await produce(args.updates, args.rate, deliver)
+            await asyncio.wait_for(recorder.done.wait(), timeout=60)
+            elapsed = time.perf_counter() - started
+            await asyncio.gather(*posts)
+        finally:
+            await runner.cleanup()
+            await stub_runner.cleanup()
+    return {"elapsed": elapsed, "status_without_secret": rejected}
+
+
+def summarize(mode: str, recorder: Recorder, extra: dict) -> None:
+    ordered = sorted(recorder.latencies)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    print(
+        f"{mode:8} {len(ordered) / extra.pop('elapsed'):8.1f} upd/s"
+        f"  mean {statistics.fmean(ordered) * 1000:7.2f} ms"
+        f"  p50 {pick(0.50):7.2f}  p95 {pick(0.95):7.2f}  p99 {pick(0.99):7.2f} ms"
+        f"  {' '.join(f'{k}={v}' for k, v in extra.items())}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="updates per second")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument(
+        "--work-ms", type=float, default=50, help="time each handler keeps running"
+    )
+    parser.add_argument(
+        "--mode", choices=("polling", "webhook", "both"), default="both"
+    )
+    args = parser.parse_args()
+
+    modes = {"polling": run_polling, "webhook": run_webhook}
+    for mode, run in modes.items():
+        if args.mode not in (mode, "both"):
+            continue
+        recorder = Recorder(args.updates, args.work_ms / 1000)
+        summarize(mode, recorder, await run(args, recorder))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""
+Google Drive upload and download throughput at several chunk sizes against
+the Drive stub. The stub fails one chunk of every transfer, so each run also
+resumes from the committed offset. At the end an upload is interrupted after
+its first chunk and continued with the saved session uri.
+
+    python -m benchmarks.drive_transfer --size-mb 100 --chunk-mb 0.25 1 8 32
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+from benchmarks.e2e import configure_env
+from benchmarks.stubs import start_stubs
+
+WORKDIR = tempfile.mkdtemp(prefix="bench-drive-")
+
+
+def file_md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Interrupted(Exception):
+    pass
+
+
+async def run(args, base: str) -> None:
+    import aiohttp
+
+    from app.utils.api import google_drive
+    from app.utils.helpers.executors import run_io, shutdown_executors
+
+    source = os.path.join(WORKDIR, "source.mp3")
+    with open(source, "wb") as f:
+        f.write(os.urandom(int(args.size_mb * 1024**2)))
+    expected_md5 = file_md5(source)
+    size_mb = os.path.getsize(source) / 1024**2
+    target = os.path.join(WORKDIR, "target.mp3")
+
+    async with aiohttp.ClientSession() as session:
+
+        async def stats() -> dict:
+            async with session.get(f"{base}/stats") as resp:
+                return await resp.json()
+
+        try:
+            for chunk_mb in args.chunk_mb:
+                google_drive.DRIVE_CHUNK_SIZE = int(chunk_mb * 1024**2)
+                async with session.post(f"{base}/stats/reset"):
+                    pass
+
+                started = time.perf_counter()
+                uploaded = await google_drive.upload_file_to_drive(
+                    path=source, filename="bench.mp3", folder_id="bench"
+                )
+                upload_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                await google_drive.download_file_from_drive(
+                    file_id=uploaded["id"], path=target
+                )
+                download_time = time.perf_counter() - started
+                assert file_md5(target) == expected_md5, "downloaded file is corrupted"
+
+                counters = await stats()
+                print(
+                    f"chunk {chunk_mb:6} MB"
+                    f"  upload {size_mb / upload_time:7.1f} MB/s"
+                    f" ({counters.get('drive_upload_chunk', 0)} requests)"
+                    f"  download {size_mb / download_time:7.1f} MB/s"
+                    f" ({counters.get('drive_get_media', 0)} requests)"
+                    f"  resumed after {counters.get('drive_upload_errors', 0)}"
+                    f"+{counters.get('drive_download_errors', 0)} errors"
+                )
+
+            # interrupted upload: the first attempt stops once the session exists
+            google_drive.DRIVE_CHUNK_SIZE = int(args.chunk_mb[0] * 1024**2)
+            sessions = []
+
+            def stop_after_first_chunk(uri: str) -> None:
+                sessions.append(uri)
+                raise Interrupted()
+
+            async with session.post(f"{base}/stats/reset"):
+                pass
+            try:
+                await run_io(
+                    google_drive._upload_file,
+                    path=source,
+                    filename="bench.mp3",
+                    folder_id="bench",
+                    on_session=stop_after_first_chunk,
+                )
+            except Interrupted:
+                pass
+            await google_drive.upload_file_to_drive(
+                path=source,
+                filename="bench.mp3",
+                folder_id="bench",
+                upload_uri=sessions[0],
+            )
+            sent = (await stats()).get("drive_upload_received", 0) / 1024**2
+            print(f"interrupted upload resumed, {sent - size_mb:.2f} MB sent twice")
+        finally:
+            shutdown_executors()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=100)
+    parser.add_argument("--chunk-mb", type=float, nargs="+", default=[0.25, 1, 8, 32])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    process, base = start_stubs(
+        size=1024**2,
+        large_size=1024**2,
+        latency=args.latency_ms / 1000,
+        flaky=True,
+    )
+    configure_env(base, WORKDIR)
+    try:
+        asyncio.run(run(args, base))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+End-to-end benchmark: Telegram updates are fed through the bot's router and
+handlers, while SoundCloud, Google Drive and Telegram are local stubs
+(benchmarks/stubs.py) running in a separate process.
+
+Workloads, run in the given order against one bot instance:
+
+- cold   every request is a new track: resolve, download, tag, send, Drive upload
+- hot    the same tracks again, answered by Telegram file_id
+- disk   file_ids forgotten, tracks are sent from the local disk cache
+- drive  file_ids and disk cache dropped, tracks are fetched from Drive
+- burst  many users send the same new track at once
+- large  new tracks of --large-mb size
+- lost   Drive copies deleted by hand: tracks come from the origin once,
+         misses before the new upload finishes are served from the outbox
+
+YouTube is not covered: yt-dlp needs the real site.
+Reports throughput, p50/p95/p99 latency per request and per stage, peak RSS,
+and writes everything as JSON, so runs can be compared.
+
+    python -m benchmarks.e2e --tracks 50 --concurrency 8 --output results.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import count
+
+import aiohttp
+
+from benchmarks.stubs import LARGE_TRACK_ID, start_stubs
+
+WORKLOADS = ("cold", "hot", "disk", "drive", "burst", "large", "lost")
+
+timings: dict[str, list[float]] = defaultdict(list)
+update_ids = count(1)
+
+
+def configure_env(base: str, workdir: str) -> None:
+    """Point the bot at the stubs, must run before app modules are imported"""
+    # google-auth always refreshes against the real token endpoint,
+    # so the access token is made valid for the whole run
+    credentials = {
+        "client_id": "bench",
+        "client_secret": "bench",
+        "refresh_token": "bench",
+        "token": "bench",
+        "expiry": (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    os.environ.update(
+        {
+            "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/db.sqlite3",
+            "DISK_CACHE_DIR": os.path.join(workdir, "cache"),
+            "DOWNLOAD_TMP_DIR": os.path.join(workdir, "tmp"),
+            "DRIVE_OUTBOX_DIR": os.path.join(workdir, "outbox"),
+            "SOUNDCLOUD_API_URL": f"{base}/sc",
+            "DRIVE_API_URL": f"{base}/drive",
+            "FOLDER_ID": "bench",
+            "GOOGLE_CREDENTIALS_B64": base64.b64encode(
+                json.dumps(credentials).encode()
+            ).decode(),
+        }
+    )
+
+
+def timed(stage: str, func):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings[stage].append(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument() -> None:
+    """Wrap the functions every request goes through to time pipeline stages"""
+    import app.handlers.sc_download.commands as sc_commands
+    import app.utils.api.api_integrations as api_integrations
+    import app.utils.api.drive_outbox as drive_outbox
+
+    stages = [
+        (sc_commands, "resolve_url", "sc_resolve"),
+        (sc_commands, "get_download_url", "sc_stream_url"),
+        (sc_commands, "get_sc_file", "get_file"),
+        (sc_commands, "reply_with_cached_audio", "tg_send_cached"),
+        (sc_commands, "reply_with_audio_file", "tg_send_file"),
+        (api_integrations, "download_file", "sc_download"),
+        (api_integrations, "fetch_artwork", "artwork"),
+        (api_integrations, "run_cpu", "tagging"),
+        (api_integrations, "_save_file", "save"),
+        (api_integrations, "download_file_from_drive", "drive_download"),
+        (drive_outbox, "upload_file_to_drive", "drive_upload"),
+    ]
+    for module, name, stage in stages:
+        setattr(module, name, timed(stage, getattr(module, name)))
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def make_update(user_id: int, text: str):
+    from aiogram.types import Update
+
+    update_id = next(update_ids)
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+                "text": text,
+            },
+        }
+    )
+
+
+def track_url(track_id: int) -> str:
+    return f"https://soundcloud.com/bench/track-{track_id}"
+
+
+class Bench:
+    def __init__(self, base: str, args: argparse.Namespace):
+        self.base = base
+        self.args = args
+        self.user_ids = count(1)
+        self.http: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        from aiogram import Bot, Dispatcher
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        from app.handlers.index import router
+        from app.utils.api.drive_outbox import run_drive_uploader
+        from app.utils.api.http_client import init_http_session
+        from app.utils.database.requests import init_db, save_client_id
+
+        await init_db()
+        await init_http_session()
+        # client_id scraping needs the real soundcloud.com, the manager loads it from db
+        await save_client_id("b" * 32)
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f"{self.base}/tg"))
+        self.bot = Bot(token="123456:bench", session=session)
+        self.dp = Dispatcher()
+        self.dp.include_routers(router)
+        self.uploader = asyncio.create_task(run_drive_uploader())
+        self.http = aiohttp.ClientSession()
+
+    async def stop(self) -> None:
+        from app.utils.api.http_client import close_http_session
+        from app.utils.helpers.executors import shutdown_executors
+
+        self.uploader.cancel()
+        await self.bot.session.close()
+        await self.http.close()
+        await close_http_session()
+        shutdown_executors()
+
+    async def stub_stats(self, reset: bool = False) -> dict:
+        async with self.http.get(f"{self.base}/stats") as resp:
+            stats = await resp.json()
+        if reset:
+            async with self.http.post(f"{self.base}/stats/reset") as resp:
+                await resp.read()
+        return stats
+
+    async def send(self, text: str, latencies: list[float]) -> None:
+        update = make_update(next(self.user_ids), text)
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    async def replay(self, name: str, texts: list[str], concurrency: int) -> dict:
+        await self.stub_stats(reset=True)
+        timings.clear()
+        latencies: list[float] = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(text: str) -> None:
+            async with semaphore:
+                await self.send(text, latencies)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(text) for text in texts))
+        elapsed = time.perf_counter() - started
+
+        stubs = await self.stub_stats()
+        result = {
+            "requests": len(texts),
+            "sent": stubs.get("tg_sendAudio", 0),
+            "errors": stubs.get("tg_errors", 0),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(texts) / elapsed if elapsed else 0.0,
+            "latency": percentiles(latencies),
+            "stages": {stage: percentiles(values) for stage, values in timings.items()},
+            "stubs": stubs,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        print_result(name, result)
+        return result
+
+    async def wait_for_uploads(self, timeout: float = 600) -> None:
+        from app.utils.database.requests import get_next_upload_time
+
+        deadline = time.monotonic() + timeout
+        while await get_next_upload_time() is not None:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Drive outbox was not drained")
+            await asyncio.sleep(0.2)
+
+    async def forget_telegram_ids(self, track_ids: list[int]) -> None:
+        from app.utils.database.requests import clear_telegram_file_ids
+
+        for track_id in track_ids:
+            await clear_telegram_file_ids(source="soundcloud", track_id=track_id)
+
+    async def delete_drive_files(self, track_ids: list[int]) -> None:
+        """Delete Drive copies behind the bot's back, db rows keep their ids"""
+        from app.utils.api.google_drive import delete_file_from_drive
+        from app.utils.database.requests import get_file_by_track_id
+
+        for track_id in track_ids:
+            record = await get_file_by_track_id(source="soundcloud", track_id=track_id)
+            if record is not None and record.drive_file_id:
+                await delete_file_from_drive(record.drive_file_id)
+
+    def drop_disk_cache(self) -> None:
+        from app.utils.helpers import track_cache
+        from app.utils.helpers.disk_cache import DiskCache
+
+        track_cache.disk_tier = DiskCache(
+            directory=tempfile.mkdtemp(dir=os.path.dirname(track_cache.DISK_CACHE_DIR)),
+            max_bytes=track_cache.DISK_CACHE_MAX_BYTES,
+        )
+
+    async def run(self, workloads: list[str]) -> dict:
+        args = self.args
+        track_ids = list(range(1, args.tracks + 1))
+        urls = [track_url(track_id) for track_id in track_ids]
+        results = {}
+
+        for name in workloads:
+            if name == "cold":
+                results[name] = await self.replay(name, urls, args.concurrency)
+            elif name == "hot":
+                results[name] = await self.replay(name, urls, args.concurrency)
+            elif name == "disk":
+                await self.forget_telegram_ids(track_ids)
+                results[name] = await self.replay(name, urls, args.concurrency)
+            elif name == "drive":
+                await self.wait_for_uploads()
+                await self.forget_telegram_ids(track_ids)
+                self.drop_disk_cache()
+                results[name] = await self.replay(name, urls, args.concurrency)
+            elif name == "burst":
+                burst_url = track_url(LARGE_TRACK_ID - 1)
+                results[name] = await self.replay(
+                    name, [burst_url] * args.burst, args.burst
+                )
+            elif name == "large":
+                large_urls = [
+                    track_url(LARGE_TRACK_ID + i) for i in range(args.large_tracks)
+                ]
+                results[name] = await self.replay(name, large_urls, args.concurrency)
+            elif name == "lost":
+                await self.wait_for_uploads()
+                await self.delete_drive_files(track_ids)
+                # new copies stay in the outbox until the uploader is back
+                self.uploader.cancel()
+                for pass_name in (name, "lost_again"):
+                    await self.forget_telegram_ids(track_ids)
+                    self.drop_disk_cache()
+                    results[pass_name] = await self.replay(
+                        pass_name, urls, args.concurrency
+                    )
+                # stale Drive ids were cleared, the second pass doesn't try them again
+                stubs = results["lost_again"]["stubs"]
+                assert stubs.get("drive_not_found", 0) == 0, stubs
+                assert stubs.get("sc_audio", 0) == 0, stubs
+                from app.utils.api.drive_outbox import run_drive_uploader
+
+                self.uploader = asyncio.create_task(run_drive_uploader())
+                await self.wait_for_uploads()
+        return results
+
+
+def print_result(name: str, result: dict) -> None:
+    latency = result["latency"]
+    print(
+        f"\n{name}: {result['requests']} requests, {result['sent']} audio sent, "
+        f"{result['errors']} errors, {result['throughput_rps']:.1f} req/s, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    rows = [("request", latency)] + sorted(result["stages"].items())
+    for stage, stats in rows:
+        if not stats["count"]:
+            continue
+        print(
+            f"  {stage:>15}: n={stats['count']:<5} p50 {stats['p50_ms']:8.1f} ms"
+            f"  p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms"
+        )
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--tracks", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--large-tracks", type=int, default=3)
+    parser.add_argument("--large-mb", type=float, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep bot logs")
+    args = parser.parse_args()
+    workloads = [name for name in args.workloads.split(",") if name]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    stubs, base = start_stubs(
+        size=int(args.size_mb * 1024**2),
+        large_size=int(args.large_mb * 1024**2),
+        latency=args.latency_ms / 1000,
+    )
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    configure_env(base, workdir)
+    instrument()
+    if not args.verbose:
+        for name in list(logging.root.manager.loggerDict):
+            if name.startswith(("app.", "aiogram")):
+                logging.getLogger(name).setLevel(logging.WARNING)
+
+    bench = Bench(base, args)
+    await bench.start()
+    try:
+        results = await bench.run(workloads)
+    finally:
+        await bench.stop()
+        stubs.terminate()
+
+    report = {
+        "revision": git_revision(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "workloads": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
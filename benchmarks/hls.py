@@ -0,0 +1,140 @@
+"""
+Download time of a long mix as one progressive stream vs HLS segments
+fetched in parallel. The stub CDN limits every connection to --rate-mbps
+like a real CDN does, every 50th segment fails once and has to be retried.
+Then a track with only an AAC HLS stream is downloaded and converted to mp3.
+
+    python -m benchmarks.hls --minutes 60 --rate-mbps 8 --latency-ms 30
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.stubs import AAC_TRACK_IDS, LARGE_TRACK_ID, start_stubs
+
+WORKDIR = tempfile.mkdtemp(prefix="bench-hls-")
+# 128 kbps mp3
+BYTES_PER_MINUTE = 128_000 // 8 * 60
+
+
+async def run(args, base: str) -> None:
+    from app.utils.api import soundcloud
+    from app.utils.api.http_client import close_http_session
+    from app.utils.database.requests import init_db, save_client_id
+
+    await init_db()
+    await save_client_id("b" * 32)
+    track = await soundcloud.resolve_url(
+        f"https://soundcloud.com/bench/track-{LARGE_TRACK_ID}"
+    )
+    print(f"picked transcoding: {soundcloud.pick_transcoding(track)['format']}")
+    progressive = {
+        "media": {
+            "transcodings": [
+                t
+                for t in track["media"]["transcodings"]
+                if t["format"]["protocol"] == "progressive"
+            ]
+        }
+    }
+
+    session = soundcloud.get_http_session()
+    retries = 0
+
+    async def timed(url: str) -> tuple[float, int]:
+        nonlocal retries
+        # failing segments fail again in every run
+        async with session.post(f"{base}/stats/reset"):
+            pass
+        path = os.path.join(WORKDIR, "track.mp3")
+        started = time.perf_counter()
+        await soundcloud.download_file(url=url, path=path)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+        os.unlink(path)
+        async with session.get(f"{base}/stats") as resp:
+            retries += (await resp.json()).get("sc_hls_segment_errors", 0)
+        return elapsed, size
+
+    try:
+        elapsed, expected = await timed(await soundcloud.get_stream_url(progressive))
+        print(
+            f"progressive       {elapsed:6.2f}s  {expected / elapsed / 1024**2:6.2f} MB/s"
+        )
+        for window in args.windows:
+            soundcloud.HLS_WINDOW = window
+            hls_elapsed, size = await timed(await soundcloud.get_stream_url(track))
+            assert size == expected, f"HLS file has {size} bytes, expected {expected}"
+            print(
+                f"hls window {window:3}    {hls_elapsed:6.2f}s"
+                f"  {size / hls_elapsed / 1024**2:6.2f} MB/s"
+                f"  {elapsed / hls_elapsed:5.2f}x faster"
+            )
+        print(f"segment retries: {retries}")
+        await convert_aac(soundcloud)
+    finally:
+        await close_http_session()
+
+
+async def convert_aac(soundcloud) -> None:
+    """Tracks without mp3 streams used to fail with "No supported stream found" """
+    from mutagen.mp3 import MP3
+
+    from app.utils.helpers.executors import run_transcode, shutdown_executors
+
+    track = await soundcloud.resolve_url(
+        f"https://soundcloud.com/bench/track-{AAC_TRACK_IDS[0]}"
+    )
+    picked = soundcloud.pick_transcoding(track)["format"]
+    assert soundcloud.needs_mp3_conversion(track), picked
+    path = os.path.join(WORKDIR, "aac.mp3")
+    await soundcloud.download_file(
+        url=await soundcloud.get_stream_url(track), path=path
+    )
+    started = time.perf_counter()
+    try:
+        await run_transcode(soundcloud.convert_to_mp3, path=path)
+    finally:
+        shutdown_executors()
+    elapsed = time.perf_counter() - started
+    length = MP3(path).info.length
+    os.unlink(path)
+    print(
+        f"aac only track: picked {picked}, converted {length:.0f}s of audio in {elapsed:.2f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60, help="mix length")
+    parser.add_argument("--rate-mbps", type=float, default=8, help="per connection")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    process, base = start_stubs(
+        size=1024**2,
+        large_size=int(args.minutes * BYTES_PER_MINUTE),
+        latency=args.latency_ms / 1000,
+        rate=args.rate_mbps * 1024**2 / 8,
+        flaky=True,
+        hls=True,
+    )
+    os.environ.update(
+        {
+            "SOUNDCLOUD_API_URL": f"{base}/sc",
+            "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'db.sqlite3')}",
+            "DOWNLOAD_TMP_DIR": WORKDIR,
+        }
+    )
+    try:
+        asyncio.run(run(args, base))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
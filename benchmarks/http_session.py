@@ -0,0 +1,95 @@
+"""
+Compare a fresh aiohttp.ClientSession per request (old behaviour) with the
+shared application session against a local stub server.
+
+Each "track" does the same amount of requests as a SoundCloud link:
+resolve, client_id, track info, stream url and audio download.
+
+    python -m benchmarks.http_session --tracks 200 --size 512000
+"""
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from app.utils.api.http_client import close_http_session, init_http_session
+from app.utils.api.soundcloud import download_file, resolve_soundcloud_url
+from app.utils.helpers.files import new_temp_path, remove_file
+
+REQUESTS_PER_TRACK = 5
+
+
+async def start_stub(size: int) -> tuple[web.AppRunner, str]:
+    body = b"\xff" * size
+
+    async def small(request: web.Request) -> web.Response:
+        return web.json_response({"url": str(request.url)})
+
+    async def audio(request: web.Request) -> web.Response:
+        return web.Response(body=body, content_type="audio/mpeg")
+
+    app = web.Application()
+    app.router.add_get("/json", small)
+    app.router.add_get("/audio.mp3", audio)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def fresh_session_track(base: str) -> None:
+    for _ in range(REQUESTS_PER_TRACK - 1):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{base}/json") as resp:
+                await resp.read()
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base}/audio.mp3") as resp:
+            await resp.read()
+
+
+async def shared_session_track(base: str) -> None:
+    for _ in range(REQUESTS_PER_TRACK - 1):
+        await resolve_soundcloud_url(short_url=f"{base}/json")
+    path = new_temp_path()
+    try:
+        await download_file(url=f"{base}/audio.mp3", path=path)
+    finally:
+        remove_file(path)
+
+
+async def measure(name: str, func, base: str, tracks: int) -> float:
+    started = time.perf_counter()
+    for _ in range(tracks):
+        await func(base)
+    elapsed = time.perf_counter() - started
+    per_track = elapsed / tracks * 1000
+    print(f"{name:>15}: {elapsed:.2f}s total, {per_track:.2f} ms/track")
+    return per_track
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=200)
+    parser.add_argument("--size", type=int, default=512 * 1024)
+    args = parser.parse_args()
+
+    runner, base = await start_stub(args.size)
+    await init_http_session()
+    try:
+        fresh = await measure("fresh session", fresh_session_track, base, args.tracks)
+        shared = await measure(
+            "shared session", shared_session_track, base, args.tracks
+        )
+        print(f"{'saved':>15}: {fresh - shared:.2f} ms/track")
+    finally:
+        await close_http_session()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Wall time of a message with several new SoundCloud links vs sending the
+same number of links one message at a time. The stub CDN limits every
+connection to --rate-mbps, so each track takes a while to download.
+Also reports how often the batch status message was edited.
+
+    python -m benchmarks.link_batch --links 5 --window 5 --size-mb 5 --rate-mbps 16
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.e2e import Bench, configure_env, track_url
+from benchmarks.stubs import start_stubs
+
+
+async def run(bench: Bench, args: argparse.Namespace) -> None:
+    sequential_ids = range(1, args.links + 1)
+    batch_ids = range(args.links + 1, 2 * args.links + 1)
+
+    await bench.stub_stats(reset=True)
+    latencies: list[float] = []
+    for track_id in sequential_ids:
+        await bench.send(track_url(track_id), latencies)
+    print(
+        f"one per message  {sum(latencies):6.2f}s"
+        f"  slowest {max(latencies):5.2f}s"
+        f"  audio sent {(await bench.stub_stats())['tg_sendAudio']}"
+    )
+
+    await bench.stub_stats(reset=True)
+    text = "check these out:\n" + "\n".join(
+        f"{i}. {track_url(track_id)}" for i, track_id in enumerate(batch_ids, 1)
+    )
+    started = time.perf_counter()
+    await bench.send(text, [])
+    elapsed = time.perf_counter() - started
+    stubs = await bench.stub_stats()
+    print(
+        f"one message      {elapsed:6.2f}s"
+        f"  {sum(latencies) / elapsed:5.2f}x faster"
+        f"  audio sent {stubs.get('tg_sendAudio', 0)}"
+        f"  status edits {stubs.get('tg_editMessageText', 0)}"
+        f"  errors {stubs.get('tg_errors', 0)}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=5)
+    parser.add_argument("--window", type=int, default=5)
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--rate-mbps", type=float, default=16, help="per connection")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    stubs, base = start_stubs(
+        size=int(args.size_mb * 1024**2),
+        large_size=int(args.size_mb * 1024**2),
+        latency=args.latency_ms / 1000,
+        rate=args.rate_mbps * 1024**2 / 8,
+    )
+    configure_env(base, tempfile.mkdtemp(prefix="bench-batch-"))
+    # the per-user cap would otherwise limit the batch window
+    os.environ["LINK_BATCH_WINDOW"] = str(args.window)
+    os.environ["DOWNLOAD_USER_LIMIT"] = str(args.window)
+    os.environ["DOWNLOAD_WORKERS"] = str(max(args.window, os.cpu_count() or 1))
+
+    bench = Bench(base, args)
+    await bench.start()
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith(("app.", "aiogram")):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    try:
+        await run(bench, args)
+    finally:
+        await bench.stop()
+        stubs.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
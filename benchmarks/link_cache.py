@@ -0,0 +1,94 @@
+"""
+Cache hit path of a SoundCloud link that was sent before: tracks are
+downloaded once, then the same links are sent again in another form
+(m. host, tracking parameters). "resolve" forgets the links of a track
+before its request, so each hit resolves the link with SoundCloud first,
+as it did before the link index. "index" answers from the link index.
+Reports latency and the requests made to SoundCloud and Telegram per hit.
+
+    python -m benchmarks.link_cache --tracks 50 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+
+from benchmarks.e2e import Bench, configure_env, percentiles, track_url
+from benchmarks.stubs import start_stubs
+
+
+def shared_url(track_id: int) -> str:
+    """Link as it comes from the share menu of the mobile app"""
+    return (
+        track_url(track_id).replace("://", "://m.")
+        + "?utm_source=clipboard&utm_medium=text&utm_campaign=social_sharing"
+    )
+
+
+async def forget_links(track_id: int) -> None:
+    from sqlalchemy import delete
+
+    from app.utils.database.models import Track_Link, async_session
+
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                delete(Track_Link).where(Track_Link.track_id == str(track_id))
+            )
+
+
+async def run(bench: Bench, args: argparse.Namespace) -> None:
+    track_ids = list(range(1, args.tracks + 1))
+    await bench.replay("cold", [track_url(i) for i in track_ids], concurrency=8)
+
+    for mode in ("resolve", "index"):
+        await bench.stub_stats(reset=True)
+        latencies: list[float] = []
+        for track_id in track_ids:
+            if mode == "resolve":
+                await forget_links(track_id)
+            await bench.send(shared_url(track_id), latencies)
+        stubs = await bench.stub_stats()
+        soundcloud = sum(v for k, v in stubs.items() if k.startswith("sc_"))
+        telegram = sum(
+            v for k, v in stubs.items() if k.startswith("tg_") and k != "tg_errors"
+        )
+        latency = percentiles(latencies)
+        print(
+            f"{mode:>8}: p50 {latency['p50_ms']:7.1f} ms  p95 {latency['p95_ms']:7.1f} ms"
+            f"  soundcloud {soundcloud / len(track_ids):.1f} req/hit"
+            f"  telegram {telegram / len(track_ids):.1f} req/hit"
+            f"  audio sent {stubs.get('tg_sendAudio', 0)}"
+            f"  errors {stubs.get('tg_errors', 0)}"
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=50)
+    parser.add_argument("--size-mb", type=float, default=1)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    stubs, base = start_stubs(
+        size=int(args.size_mb * 1024**2),
+        large_size=int(args.size_mb * 1024**2),
+        latency=args.latency_ms / 1000,
+    )
+    configure_env(base, tempfile.mkdtemp(prefix="bench-links-"))
+
+    bench = Bench(base, args)
+    await bench.start()
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith(("app.", "aiogram")):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    try:
+        await run(bench, args)
+    finally:
+        await bench.stop()
+        stubs.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Peak Python memory of one track job: download from a local stub, tag,
+move into the disk cache and check out a copy for sending.
+
+The old pipeline kept several full copies of the track in memory
+(download buffer, tagged buffer, bytes for Drive and Telegram), the file
+based one should stay flat whatever the track size is.
+
+    python -m benchmarks.memory_pipeline --sizes 10 50 200
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+# keep benchmark files out of the real cache
+os.environ.setdefault("DISK_CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+
+from aiohttp import web
+
+from app.utils.api.http_client import close_http_session, init_http_session
+from app.utils.api.soundcloud import download_file
+from app.utils.helpers.files import new_temp_path, remove_file
+from app.utils.helpers.track_cache import checkout_track, store_track
+from app.utils.helpers.track_metadata import add_metadata
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz frame without padding is 417 bytes long
+MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+TRACK_INFO = {"title": "Benchmark", "author": "Benchmark"}
+
+
+def fake_mp3(size: int) -> bytes:
+    return MP3_FRAME * (size // len(MP3_FRAME))
+
+
+async def start_stub(body: bytes) -> tuple[web.AppRunner, str]:
+    async def audio(request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        resp.content_length = len(body)
+        await resp.prepare(request)
+        view = memoryview(body)
+        for start in range(0, len(body), 256 * 1024):
+            await resp.write(view[start : start + 256 * 1024])
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/audio.mp3", audio)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}/audio.mp3"
+
+
+async def in_memory_job(url: str) -> None:
+    """Copies made by the old BytesIO pipeline"""
+    from app.utils.api.http_client import get_http_session
+
+    async with get_http_session().get(url) as resp:
+        fh = BytesIO(await resp.read())
+    tagged = BytesIO(fh.getvalue())
+    file_bytes = tagged.read()
+    cover_buffer = BytesIO(file_bytes)
+    telegram_copy = bytes(file_bytes)
+    del fh, tagged, file_bytes, cover_buffer, telegram_copy
+
+
+async def file_job(url: str, key: str) -> None:
+    path = new_temp_path()
+    try:
+        await download_file(url=url, path=path)
+        add_metadata(audio_path=path, track_info=TRACK_INFO)
+        await store_track(key, path)
+    finally:
+        remove_file(path)
+    sent_path = await checkout_track(key)
+    remove_file(sent_path)
+
+
+async def peak(job) -> int:
+    tracemalloc.start()
+    try:
+        await job
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    args = parser.parse_args()
+
+    await init_http_session()
+    try:
+        print(f"{'track MB':>9} {'in-memory MB':>13} {'file MB':>8}")
+        for size_mb in args.sizes:
+            runner, url = await start_stub(fake_mp3(size_mb * 1024**2))
+            try:
+                old = await peak(in_memory_job(url))
+                new = await peak(file_job(url, key=f"benchmark:{size_mb}"))
+            finally:
+                await runner.cleanup()
+            print(f"{size_mb:>9} {old / 1024**2:>13.1f} {new / 1024**2:>8.1f}")
+    finally:
+        await close_http_session()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
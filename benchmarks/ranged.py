@@ -0,0 +1,93 @@
+"""
+Download time of a large file as a single stream vs parallel Range requests
+with different part sizes and connection counts. The stub CDN limits every
+connection to --rate-mbps and drops the third range request of every run
+halfway, so resuming a part is part of the measurement.
+
+    python -m benchmarks.ranged --size-mb 100 --rate-mbps 16 --parallel 1 4 8
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+from benchmarks.stubs import LARGE_TRACK_ID, MP3_FRAME, start_stubs
+
+WORKDIR = tempfile.mkdtemp(prefix="bench-ranged-")
+os.environ["DOWNLOAD_TMP_DIR"] = WORKDIR
+
+
+def file_md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def run(args, base: str, expected_md5: str) -> None:
+    from app.utils.api import soundcloud
+    from app.utils.api.http_client import close_http_session
+
+    session = soundcloud.get_http_session()
+    url = f"{base}/sc/cdn/{LARGE_TRACK_ID}.mp3"
+    path = os.path.join(WORKDIR, "track.mp3")
+
+    async def timed(url: str) -> tuple[float, dict]:
+        async with session.post(f"{base}/stats/reset"):
+            pass
+        started = time.perf_counter()
+        await soundcloud.download_file(url=url, path=path)
+        elapsed = time.perf_counter() - started
+        assert file_md5(path) == expected_md5, "downloaded file is corrupted"
+        os.unlink(path)
+        async with session.get(f"{base}/stats") as resp:
+            return elapsed, await resp.json()
+
+    try:
+        single, _ = await timed(f"{url}?noranges=1")
+        print(f"single stream              {single:6.2f}s")
+        for part_mb in args.part_mb:
+            soundcloud.DOWNLOAD_PART_SIZE = int(part_mb * 1024**2)
+            for parallel in args.parallel:
+                soundcloud.DOWNLOAD_PARALLEL = parallel
+                elapsed, stats = await timed(url)
+                print(
+                    f"part {part_mb:4} MB parallel {parallel:3}"
+                    f"  {elapsed:6.2f}s  {single / elapsed:5.2f}x faster"
+                    f"  requests {stats.get('sc_audio_ranges', 0)}"
+                    f"  dropped {stats.get('sc_audio_cut', 0)}"
+                )
+    finally:
+        await close_http_session()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=100)
+    parser.add_argument("--rate-mbps", type=float, default=16, help="per connection")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--part-mb", type=float, nargs="+", default=[4])
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024**2) // len(MP3_FRAME) * len(MP3_FRAME)
+    expected_md5 = hashlib.md5(MP3_FRAME * (size // len(MP3_FRAME))).hexdigest()
+    process, base = start_stubs(
+        size=1024**2,
+        large_size=size,
+        latency=args.latency_ms / 1000,
+        rate=args.rate_mbps * 1024**2 / 8,
+        flaky=True,
+    )
+    try:
+        asyncio.run(run(args, base, expected_md5))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Per-send work for a track that is already cached. The files row is read on
+every send anyway, the old way additionally parsed the mp3 for its cover
+and duration, now they are precomputed at ingest and stored in the row.
+
+    python -m benchmarks.send_cost --size 10 --sends 500
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench-send-"), "db.sqlite3")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from mutagen.mp3 import MP3
+
+from app.utils.database.models import engine
+from app.utils.database.requests import (
+    get_file_by_track_id,
+    init_db,
+    set_file_by_track_id,
+)
+from app.utils.helpers.files import new_temp_path, remove_file
+from app.utils.helpers.track_metadata import add_metadata, get_audio_details
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz frame without padding is 417 bytes long
+MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+COVER = b"\xff\xd8\xff\xe0" + os.urandom(150 * 1024)
+TRACK_INFO = {"title": "Benchmark", "author": "Benchmark"}
+
+
+def parse_for_send(path: str) -> tuple[bytes | None, int]:
+    """What every send did before: read the cover and the duration from the mp3"""
+    tags = MP3(path).tags
+    apic = tags.get("APIC:Cover") if tags is not None else None
+    cover = apic.data if apic else None
+    return cover, int(MP3(path).info.length)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10, help="track size, MB")
+    parser.add_argument("--sends", type=int, default=500)
+    args = parser.parse_args()
+
+    path = new_temp_path(".mp3")
+    with open(path, "wb") as f:
+        f.write(MP3_FRAME * (args.size * 1024**2 // len(MP3_FRAME)))
+    add_metadata(path, TRACK_INFO, cover_bytes=COVER)
+
+    await init_db()
+    details = get_audio_details(path)
+    details["thumb"] = details.pop("cover")
+    await set_file_by_track_id(
+        source="soundcloud", filename="bench.mp3", track_id="1", **details
+    )
+
+    try:
+        started = time.perf_counter()
+        for _ in range(args.sends):
+            await get_file_by_track_id(source="soundcloud", track_id="1")
+            parse_for_send(path)
+        parsed = (time.perf_counter() - started) / args.sends
+
+        started = time.perf_counter()
+        for _ in range(args.sends):
+            record = await get_file_by_track_id(source="soundcloud", track_id="1")
+            record.thumb, record.duration
+        stored = (time.perf_counter() - started) / args.sends
+
+        print(f"{'row + parse mp3':>16}: {parsed * 1e6:,.0f} us/send")
+        print(f"{'row only':>16}: {stored * 1e6:,.0f} us/send")
+    finally:
+        remove_file(path)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,467 @@
+"""
+Local stand-ins for the services the bot talks to, used by benchmarks.e2e:
+
+- SoundCloud api (/resolve, /tracks, transcodings) and CDN with MP3 bodies
+  and Range support (off with ?noranges=1), optionally as HLS playlists.
+  Tracks with id in AAC_TRACK_IDS only have an AAC HLS stream
+- Google Drive (resumable upload, get_media with ranges)
+- Telegram Bot API (sendMessage, editMessageText, deleteMessage, sendAudio)
+
+Stubs run in a separate process, so their memory doesn't show up in the
+bot's peak RSS. Every response can be delayed to simulate network latency
+and audio bodies can be sent at a limited rate per connection, like a CDN.
+With flaky some requests fail once, so clients have to retry and resume.
+
+    python -m benchmarks.stubs --port 8081
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import re
+import time
+from collections import Counter
+from io import BytesIO
+from itertools import count
+
+from aiohttp import web
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz frame without padding is 417 bytes long
+MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+FRAMES_PER_CHUNK = 160
+# tracks with id from this one on are served with large_size
+LARGE_TRACK_ID = 1_000_000
+# tracks with these ids only have an AAC HLS transcoding, like some SoundCloud
+# tracks. Segments are still mp3 frames, ffmpeg finds that out by itself
+AAC_TRACK_IDS = range(500_000, 600_000)
+AAC_MIME_TYPE = 'audio/mp4; codecs="mp4a.40.2"'
+# about 10 seconds of audio per HLS segment
+HLS_SEGMENT_FRAMES = 383
+
+TRACK_URL_RE = re.compile(r"/bench/track-(\d+)")
+
+
+def _make_artwork() -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + b"\x00" * 60 * 1024
+    out = BytesIO()
+    Image.new("RGB", (500, 500), (200, 80, 40)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+class Stubs:
+    def __init__(
+        self,
+        size: int,
+        large_size: int,
+        latency: float,
+        rate: float = 0,
+        hls: bool = False,
+        flaky: bool = False,
+    ):
+        self.size = size
+        self.large_size = large_size
+        self.latency = latency
+        # bytes per second per response, 0 is unlimited
+        self.rate = rate
+        self.hls = hls
+        # drop some requests once, so clients have to retry and resume
+        self.flaky = flaky
+        self.failed_requests: set[str] = set()
+        # a chunk can start at any offset inside a frame
+        self.frames = MP3_FRAME * (FRAMES_PER_CHUNK + 1)
+        self.range_requests: Counter = Counter()
+        self.artwork = _make_artwork()
+        self.stats: Counter = Counter()
+        self.drive_files: dict[str, bytes] = {}
+        self.uploads: dict[str, dict] = {}
+        self.ids = count(1)
+
+    def track_size(self, track_id: int) -> int:
+        return self.large_size if track_id >= LARGE_TRACK_ID else self.size
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware], client_max_size=1024**3)
+        app.router.add_get("/stats", self.get_stats)
+        app.router.add_post("/stats/reset", self.reset_stats)
+        # soundcloud
+        app.router.add_get("/sc/resolve", self.sc_resolve)
+        app.router.add_get("/sc/tracks", self.sc_tracks)
+        app.router.add_get("/sc/media/{track_id}", self.sc_transcoding)
+        app.router.add_get("/sc/cdn/{track_id}.mp3", self.sc_audio)
+        app.router.add_get("/sc/hls-media/{track_id}", self.sc_hls_transcoding)
+        app.router.add_get("/sc/hls/{track_id}/playlist.m3u8", self.sc_hls_playlist)
+        app.router.add_get("/sc/hls/{track_id}/{segment}.mp3", self.sc_hls_segment)
+        app.router.add_get("/sc/artwork/{track_id}.jpg", self.sc_artwork)
+        # google drive
+        app.router.add_post("/drive/upload/drive/v3/files", self.drive_start_upload)
+        app.router.add_put("/drive/upload/drive/v3/files", self.drive_upload_chunk)
+        app.router.add_get("/drive/drive/v3/files/{file_id}", self.drive_get_media)
+        app.router.add_delete("/drive/drive/v3/files/{file_id}", self.drive_delete)
+        # telegram
+        app.router.add_post("/tg/bot{token}/{method}", self.telegram)
+        return app
+
+    def _fail_once(self, key: str) -> bool:
+        if not self.flaky or key in self.failed_requests:
+            return False
+        self.failed_requests.add(key)
+        return True
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        if self.latency and not request.path.startswith("/stats"):
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "drive_files": len(self.drive_files)})
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.stats.clear()
+        self.failed_requests.clear()
+        self.range_requests.clear()
+        return web.json_response({})
+
+    # soundcloud
+
+    def _track(self, request: web.Request, track_id: int) -> dict:
+        base = f"{request.scheme}://{request.host}/sc"
+        transcodings = [
+            {
+                "url": f"{base}/media/{track_id}",
+                "snipped": False,
+                "format": {"protocol": "progressive", "mime_type": "audio/mpeg"},
+            }
+        ]
+        if track_id in AAC_TRACK_IDS:
+            transcodings = [
+                {
+                    "url": f"{base}/hls-media/{track_id}",
+                    "snipped": False,
+                    "format": {"protocol": "hls", "mime_type": AAC_MIME_TYPE},
+                }
+            ]
+        elif self.hls:
+            transcodings.insert(
+                0,
+                {
+                    "url": f"{base}/hls-media/{track_id}",
+                    "snipped": False,
+                    "format": {"protocol": "hls", "mime_type": "audio/mpeg"},
+                },
+            )
+        return {
+            "kind": "track",
+            "id": track_id,
+            "title": f"Benchmark track {track_id}",
+            "genre": "Benchmark",
+            "display_date": "2024-01-01T00:00:00Z",
+            "artwork_url": f"{base}/artwork/{track_id}.jpg",
+            "publisher_metadata": {"artist": "Benchmark"},
+            "downloadable": False,
+            "media": {"transcodings": transcodings},
+        }
+
+    async def sc_resolve(self, request: web.Request) -> web.Response:
+        self.stats["sc_resolve"] += 1
+        match = TRACK_URL_RE.search(request.query.get("url", ""))
+        if match is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response(self._track(request, int(match.group(1))))
+
+    async def sc_tracks(self, request: web.Request) -> web.Response:
+        self.stats["sc_tracks"] += 1
+        ids = [int(i) for i in request.query.get("ids", "").split(",") if i]
+        return web.json_response([self._track(request, i) for i in ids])
+
+    async def sc_transcoding(self, request: web.Request) -> web.Response:
+        self.stats["sc_transcoding"] += 1
+        track_id = request.match_info["track_id"]
+        base = f"{request.scheme}://{request.host}/sc"
+        return web.json_response({"url": f"{base}/cdn/{track_id}.mp3"})
+
+    async def _write_bytes(
+        self,
+        request: web.Request,
+        start: int,
+        end: int,
+        status: int = 200,
+        headers: dict | None = None,
+        cut: bool = False,
+    ) -> web.StreamResponse:
+        """Bytes start..end of an endless row of mp3 frames, cut drops the connection halfway"""
+        response = web.StreamResponse(
+            status=status, headers={"Content-Type": "audio/mpeg", **(headers or {})}
+        )
+        response.content_length = end - start + 1
+        await response.prepare(request)
+        stop = start + response.content_length // 2 if cut else end + 1
+        position = start
+        while position < stop:
+            offset = position % len(MP3_FRAME)
+            size = min(len(MP3_FRAME) * FRAMES_PER_CHUNK, stop - position)
+            await response.write(self.frames[offset : offset + size])
+            position += size
+            if self.rate:
+                await asyncio.sleep(size / self.rate)
+        if cut:
+            self.stats["sc_audio_cut"] += 1
+            request.transport.close()
+        self.stats["sc_audio_bytes"] += position - start
+        return response
+
+    async def sc_audio(self, request: web.Request) -> web.StreamResponse:
+        self.stats["sc_audio"] += 1
+        frames = self.track_size(int(request.match_info["track_id"])) // len(MP3_FRAME)
+        size = frames * len(MP3_FRAME)
+        if "noranges" in request.query:
+            return await self._write_bytes(request, 0, size - 1)
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match is None:
+            return await self._write_bytes(
+                request, 0, size - 1, headers={"Accept-Ranges": "bytes"}
+            )
+        self.stats["sc_audio_ranges"] += 1
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        # third range request of a track is dropped halfway
+        self.range_requests[request.path] += 1
+        return await self._write_bytes(
+            request,
+            start,
+            end,
+            status=206,
+            headers={
+                "Accept-Ranges": "bytes",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+            },
+            cut=self.range_requests[request.path] == 3
+            and self._fail_once(request.path),
+        )
+
+    async def sc_hls_transcoding(self, request: web.Request) -> web.Response:
+        self.stats["sc_transcoding"] += 1
+        track_id = request.match_info["track_id"]
+        base = f"{request.scheme}://{request.host}/sc"
+        return web.json_response({"url": f"{base}/hls/{track_id}/playlist.m3u8"})
+
+    async def sc_hls_playlist(self, request: web.Request) -> web.Response:
+        self.stats["sc_hls_playlist"] += 1
+        frames = self.track_size(int(request.match_info["track_id"])) // len(MP3_FRAME)
+        segments = -(-frames // HLS_SEGMENT_FRAMES)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10"]
+        for segment in range(segments):
+            lines += ["#EXTINF:10.0,", f"{segment}.mp3"]
+        lines.append("#EXT-X-ENDLIST")
+        return web.Response(
+            text="\n".join(lines), content_type="application/vnd.apple.mpegurl"
+        )
+
+    async def sc_hls_segment(self, request: web.Request) -> web.StreamResponse:
+        self.stats["sc_hls_segment"] += 1
+        segment = int(request.match_info["segment"])
+        # every 50th segment fails once
+        if segment % 50 == 25 and self._fail_once(request.path):
+            self.stats["sc_hls_segment_errors"] += 1
+            return web.Response(status=503)
+        frames = self.track_size(int(request.match_info["track_id"])) // len(MP3_FRAME)
+        start = segment * HLS_SEGMENT_FRAMES
+        count = max(0, min(HLS_SEGMENT_FRAMES, frames - start))
+        return await self._write_bytes(
+            request,
+            start * len(MP3_FRAME),
+            (start + count) * len(MP3_FRAME) - 1,
+        )
+
+    async def sc_artwork(self, request: web.Request) -> web.Response:
+        self.stats["sc_artwork"] += 1
+        return web.Response(body=self.artwork, content_type="image/jpeg")
+
+    # google drive
+
+    async def drive_start_upload(self, request: web.Request) -> web.Response:
+        self.stats["drive_upload_start"] += 1
+        metadata = await request.json()
+        upload_id = str(next(self.ids))
+        self.uploads[upload_id] = {"name": metadata.get("name"), "data": bytearray()}
+        location = (
+            f"{request.url.with_query(uploadType='resumable', upload_id=upload_id)}"
+        )
+        return web.Response(headers={"Location": location})
+
+    async def drive_upload_chunk(self, request: web.Request) -> web.Response:
+        self.stats["drive_upload_chunk"] += 1
+        upload_id = request.query.get("upload_id", "")
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return web.json_response({"error": "unknown upload"}, status=404)
+        body = await request.read()
+        if "file" in upload:
+            return web.json_response(upload["file"])
+        # Content-Range: bytes start-end/total or bytes */total to ask for the offset
+        match = re.match(
+            r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)",
+            request.headers.get("Content-Range", ""),
+        )
+        if match is None:
+            return web.json_response({"error": "bad Content-Range"}, status=400)
+        start, total = match.groups()
+        # second chunk of every upload fails once
+        if start and int(start) > 0 and self._fail_once(f"upload-{upload_id}"):
+            self.stats["drive_upload_errors"] += 1
+            return web.Response(status=503)
+        self.stats["drive_upload_received"] += len(body)
+        if start is not None:
+            # a resent chunk overwrites what came after its offset
+            del upload["data"][int(start) :]
+            upload["data"] += body
+        received = len(upload["data"])
+        if total == "*" or received < int(total):
+            headers = {"Range": f"bytes=0-{received - 1}"} if received else {}
+            return web.Response(status=308, headers=headers)
+        file_id = f"drive-{next(self.ids)}"
+        self.drive_files[file_id] = bytes(upload.pop("data"))
+        upload["file"] = {"id": file_id, "name": upload["name"]}
+        self.stats["drive_upload_bytes"] += received
+        return web.json_response(upload["file"])
+
+    async def drive_get_media(self, request: web.Request) -> web.Response:
+        file_id = request.match_info["file_id"]
+        data = self.drive_files.get(file_id)
+        if data is None:
+            self.stats["drive_not_found"] += 1
+            return web.json_response({"error": "not found"}, status=404)
+        if request.query.get("alt") != "media":
+            self.stats["drive_get_metadata"] += 1
+            return web.json_response({"id": file_id, "size": str(len(data))})
+        self.stats["drive_get_media"] += 1
+        start, end = 0, len(data) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+        # second chunk of every file fails once
+        if start > 0 and self._fail_once(f"download-{file_id}"):
+            self.stats["drive_download_errors"] += 1
+            return web.Response(status=503)
+        status = 206 if match else 200
+        self.stats["drive_download_bytes"] += end - start + 1
+        return web.Response(
+            status=status,
+            body=data[start : end + 1],
+            headers={"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+        )
+
+    async def drive_delete(self, request: web.Request) -> web.Response:
+        self.stats["drive_delete"] += 1
+        if self.drive_files.pop(request.match_info["file_id"], None) is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.Response(status=204)
+
+    # telegram
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.stats[f"tg_{method}"] += 1
+        if request.content_type.startswith("multipart/"):
+            fields = {}
+            reader = await request.multipart()
+            async for part in reader:
+                data = await part.read()
+                if part.filename:
+                    self.stats["tg_upload_bytes"] += len(data)
+                else:
+                    fields[part.name] = data.decode()
+        else:
+            fields = dict(await request.post())
+
+        if method == "deleteMessage":
+            return web.json_response({"ok": True, "result": True})
+
+        message_id = next(self.ids)
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(fields.get("chat_id", 0)), "type": "private"},
+        }
+        if method == "sendAudio":
+            result["audio"] = {
+                "file_id": f"audio-{message_id}",
+                "file_unique_id": f"unique-{message_id}",
+                "duration": int(fields.get("duration") or 0),
+            }
+        else:
+            text = fields.get("text", "")
+            if text.startswith("Oops"):
+                self.stats["tg_errors"] += 1
+            result["text"] = text
+        return web.json_response({"ok": True, "result": result})
+
+
+def _serve(
+    port: int,
+    size: int,
+    large_size: int,
+    latency: float,
+    ready,
+    rate: float = 0,
+    hls: bool = False,
+    flaky: bool = False,
+) -> None:
+    async def main() -> None:
+        stubs = Stubs(size, large_size, latency, rate, hls, flaky)
+        runner = web.AppRunner(stubs.app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        await site.start()
+        ready.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def start_stubs(
+    size: int,
+    large_size: int,
+    latency: float = 0.0,
+    port: int = 0,
+    rate: float = 0,
+    hls: bool = False,
+    flaky: bool = False,
+) -> tuple[multiprocessing.Process, str]:
+    """Run stubs in a child process, return it and base url"""
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    process = ctx.Process(
+        target=_serve,
+        args=(port, size, large_size, latency, ready, rate, hls, flaky),
+        daemon=True,
+    )
+    process.start()
+    port = ready.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--size", type=int, default=5 * 1024**2)
+    parser.add_argument("--large-size", type=int, default=100 * 1024**2)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-mbps", type=float, default=0, help="per connection")
+    parser.add_argument("--hls", action="store_true")
+    parser.add_argument("--flaky", action="store_true")
+    args = parser.parse_args()
+    _serve(
+        args.port,
+        args.size,
+        args.large_size,
+        args.latency_ms / 1000,
+        multiprocessing.Queue(),
+        args.rate_mbps * 1024**2 / 8,
+        args.hls,
+        args.flaky,
+    )
@@ -0,0 +1,184 @@
+"""
+Throughput of the transcode worker pool with a growing number of workers.
+The yt job runs the real download_yt_audio (yt-dlp + ffmpeg mp3 encode)
+against a WAV file served locally, the cpu job just keeps a core busy and
+doesn't need ffmpeg. Afterwards a hanging and a crashing job check that
+the worker is killed/replaced and the pool keeps working.
+
+    python -m benchmarks.transcode --job yt --jobs 32 --seconds 60
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from app.utils.api.youtube import download_yt_audio
+from app.utils.helpers.executors import (
+    JobTimeoutError,
+    JobWorkerPool,
+    WorkerCrashedError,
+)
+
+SAMPLE_RATE = 44100
+
+
+def write_wav(path: str, seconds: float) -> None:
+    """Stereo 16-bit noise, so the encoder has real work to do"""
+    data = os.urandom(int(seconds * SAMPLE_RATE) * 4)
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + len(data),
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        2,
+        SAMPLE_RATE,
+        SAMPLE_RATE * 4,
+        4,
+        16,
+        b"data",
+        len(data),
+    )
+    with open(path, "wb") as f:
+        f.write(header + data)
+
+
+class _WavHandler(SimpleHTTPRequestHandler):
+    """Every path returns the same file, so each job has its own url and video id"""
+
+    def translate_path(self, path: str) -> str:
+        return self.server.wav_path
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve_wav(wav_path: str) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _WavHandler)
+    server.wav_path = wav_path
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def yt_job(url: str, workdir: str) -> int:
+    output_path = tempfile.mktemp(suffix=".mp3", dir=workdir)
+    job_dir = tempfile.mkdtemp(dir=workdir)
+    try:
+        download_yt_audio(url=url, output_path=output_path, work_dir=job_dir)
+        return os.path.getsize(output_path)
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+
+
+def cpu_job(seconds: float) -> int:
+    deadline = time.process_time() + seconds
+    loops = 0
+    while time.process_time() < deadline:
+        loops += 1
+    return loops
+
+
+def noop() -> None:
+    return None
+
+
+def hang() -> None:
+    time.sleep(3600)
+
+
+def crash() -> None:
+    os._exit(3)
+
+
+async def measure(pool: JobWorkerPool, jobs: list) -> float:
+    # start all worker processes first, spawn time isn't part of the throughput
+    await asyncio.gather(*(pool.run(noop) for _ in range(pool.size)))
+    started = time.perf_counter()
+    await asyncio.gather(*(pool.run(job) for job in jobs))
+    return time.perf_counter() - started
+
+
+async def check_isolation() -> None:
+    pool = JobWorkerPool(name="isolation", size=1, timeout=60)
+    try:
+        started = time.perf_counter()
+        try:
+            await pool.run(hang, timeout=1)
+        except JobTimeoutError:
+            print(f"hanging job killed after {time.perf_counter() - started:.2f}s")
+        try:
+            await pool.run(crash)
+        except WorkerCrashedError as e:
+            print(f"crashed job reported: {e}")
+        task = asyncio.create_task(pool.run(hang))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await pool.run(noop)
+        print(f"pool still works: {pool.stats()}")
+    finally:
+        pool.shutdown()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--job", choices=("yt", "cpu"), default="yt")
+    parser.add_argument("--jobs", type=int, default=4 * (os.cpu_count() or 1))
+    parser.add_argument(
+        "--seconds", type=float, default=60, help="audio length / cpu time per job"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-transcode-")
+    server = None
+    try:
+        if args.job == "yt":
+            wav_path = os.path.join(workdir, "source.wav")
+            write_wav(wav_path, args.seconds)
+            server, base = serve_wav(wav_path)
+            jobs = [
+                partial(yt_job, f"{base}/track-{i}.wav", workdir)
+                for i in range(args.jobs)
+            ]
+        else:
+            jobs = [partial(cpu_job, args.seconds) for _ in range(args.jobs)]
+
+        baseline = None
+        for workers in args.workers:
+            pool = JobWorkerPool(name="bench", size=workers, timeout=3600)
+            try:
+                elapsed = await measure(pool, jobs)
+            finally:
+                pool.shutdown()
+            throughput = len(jobs) / elapsed
+            baseline = baseline or throughput / workers
+            print(
+                f"{workers:3} workers  {throughput:7.2f} jobs/s"
+                f"  speedup {throughput / baseline:5.2f}x  ({elapsed:.1f}s)"
+            )
+        await check_isolation()
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
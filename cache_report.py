@@ -0,0 +1,74 @@
+"""
+Cache effectiveness per source: cached files, Drive usage, hit ratio and
+bytes served from cache instead of the origin. Hits of a running bot are
+written every ACCESS_FLUSH_INTERVAL seconds, the newest ones may be missing.
+
+    python cache_report.py
+    python cache_report.py --json
+"""
+
+import argparse
+import asyncio
+import json
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.utils.database.models import engine
+from app.utils.database.requests import get_cache_report, init_db
+
+
+def hit_ratio(row: dict) -> float:
+    requests = row["hits"] + row["downloads"]
+    return row["hits"] / requests if requests else 0.0
+
+
+def print_report(rows: list[dict]) -> None:
+    total = {
+        "source": "total",
+        **{
+            key: sum(row[key] for row in rows)
+            for key in (
+                "files",
+                "drive_files",
+                "drive_bytes",
+                "hits",
+                "downloads",
+                "bytes_saved",
+            )
+        },
+    }
+    print(
+        f"{'source':>10} {'files':>8} {'in drive':>9} {'drive MB':>10}"
+        f" {'hits':>9} {'downloads':>10} {'hit ratio':>10} {'saved MB':>10}"
+    )
+    for row in [*rows, total]:
+        print(
+            f"{row['source']:>10} {row['files']:>8} {row['drive_files']:>9}"
+            f" {row['drive_bytes'] / 1024**2:>10.1f} {row['hits']:>9}"
+            f" {row['downloads']:>10} {hit_ratio(row):>10.1%}"
+            f" {row['bytes_saved'] / 1024**2:>10.1f}"
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print rows as JSON")
+    args = parser.parse_args()
+
+    await init_db()
+    try:
+        rows = await get_cache_report()
+    finally:
+        await engine.dispose()
+    if args.json:
+        print(
+            json.dumps([{**row, "hit_ratio": hit_ratio(row)} for row in rows], indent=2)
+        )
+    else:
+        print_report(rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
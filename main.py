@@ -1,31 +1,156 @@
 import asyncio
+import signal
 from dotenv import load_dotenv
 from os import getenv
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiohttp import web
 
 from app.handlers.index import router
+from app.utils.api.drive_eviction import run_drive_eviction
+from app.utils.api.drive_outbox import run_drive_uploader
+from app.utils.api.google_drive import (
+    get_drive_metrics,
+    keep_drive_token_fresh,
+    stop_drive_transfers,
+)
+from app.utils.api.http_client import close_http_session, init_http_session
+from app.utils.api.metrics_server import start_metrics_server
+from app.utils.api.soundcloud_client_id import client_ids, keep_client_id_fresh
+from app.utils.api.webhook import (
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    create_webhook_app,
+    get_webhook_url,
+)
 from logging_config import get_app_logger
 from app.utils.database.requests import init_db
+from app.utils.helpers.access_stats import (
+    flush_access_stats,
+    run_access_stats_writer,
+)
+from app.utils.helpers.executors import (
+    get_executor_stats,
+    shutdown_executors,
+    watch_loop_lag,
+)
+from app.utils.helpers.in_flight import InFlightUpdates
+from app.utils.helpers.metrics import register_gauges
+from app.utils.helpers.scheduler import get_scheduler_stats
+from app.utils.helpers.track_cache import flush_track_cache, get_cache_stats
 
 load_dotenv()
 TOKEN = getenv("BOT_TOKEN")
+# seconds to wait for running downloads on shutdown
+SHUTDOWN_DRAIN_TIMEOUT = float(getenv("SHUTDOWN_DRAIN_TIMEOUT", "60"))
 main_logger = get_app_logger(name="main")
 
 
+def register_runtime_gauges() -> None:
+    register_gauges("bot_pool", "pool", get_executor_stats)
+    register_gauges("bot_lane", "lane", get_scheduler_stats)
+    register_gauges(
+        "bot_disk_cache",
+        "cache",
+        lambda: {"tracks": {"bytes": get_cache_stats()["disk_bytes"]}},
+    )
+    register_gauges(
+        "bot_drive_client", "client", lambda: {"drive": get_drive_metrics()}
+    )
+    register_gauges(
+        "bot_client_id", "source", lambda: {"soundcloud": client_ids.metrics}
+    )
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, in_flight: InFlightUpdates) -> None:
+    """Serve webhook until SIGINT/SIGTERM, then stop accepting updates and drain running ones"""
+    runner = web.AppRunner(create_webhook_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        get_webhook_url(),
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    main_logger.info(f"Webhook is served on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        # webhook is left set, so other replicas keep receiving updates
+        # and Telegram retries the ones this instance doesn't accept anymore
+        await site.stop()
+        await in_flight.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        await runner.cleanup()
+
+
 async def main() -> None:
     if TOKEN is None:
         main_logger.error("BOT_TOKEN env variable is missing!")
         raise ValueError("BOT_TOKEN env variable is missing!")
+    if getenv("FOLDER_ID") is None:
+        main_logger.error("FOLDER_ID env variable is missing!")
+        raise ValueError("FOLDER_ID env variable is missing!")
+    # without it anyone who finds the webhook url can send updates. Replicas
+    # share the webhook, so the secret can't be generated per instance
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        main_logger.error("WEBHOOK_SECRET env variable is missing!")
+        raise ValueError("WEBHOOK_SECRET env variable is missing!")
 
     await init_db()
+    await init_http_session()
+    register_runtime_gauges()
+    metrics_server = await start_metrics_server()
 
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
+    in_flight = InFlightUpdates()
+    dp.update.outer_middleware(in_flight)
     dp.include_routers(router)
-    main_logger.info("Starting polling...")
-    await dp.start_polling(bot)
+    lag_watcher = asyncio.create_task(watch_loop_lag())
+    drive_token_refresher = asyncio.create_task(keep_drive_token_fresh())
+    drive_uploader = asyncio.create_task(run_drive_uploader())
+    drive_eviction = asyncio.create_task(run_drive_eviction())
+    access_stats_writer = asyncio.create_task(run_access_stats_writer())
+    client_id_refresher = asyncio.create_task(keep_client_id_fresh())
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp, in_flight)
+        else:
+            # getUpdates is refused while a webhook is set, e.g. after running in webhook mode
+            await bot.delete_webhook()
+            main_logger.info("Starting polling...")
+            await dp.start_polling(bot, close_bot_session=False)
+            await in_flight.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    finally:
+        stop_drive_transfers()
+        await bot.session.close()
+        lag_watcher.cancel()
+        drive_token_refresher.cancel()
+        drive_uploader.cancel()
+        drive_eviction.cancel()
+        access_stats_writer.cancel()
+        client_id_refresher.cancel()
+        await flush_access_stats()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await close_http_session()
+        # off the loop: worker threads may still need it, e.g. to save a Drive session
+        try:
+            await asyncio.wait_for(
+                asyncio.to_thread(shutdown_executors), timeout=SHUTDOWN_DRAIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            main_logger.warning("Worker pools did not stop in time")
+        flush_track_cache()
 
 
 if __name__ == "__main__":